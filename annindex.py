@@ -0,0 +1,301 @@
+"""
+FAISS index types for the book search
+flat (exact), ivf_flat, hnsw and ivf_pq, plus the memory-compact sq8 and pq
+modes, all addressed by stable book IDs. Quantized indexes can rerank their
+top candidates exactly against the float vectors, memory-mapped from disk.
+The default metric is inner product over unit vectors (cosine similarity,
+what MiniLM is trained for); 'l2' keeps the older Euclidean indexes.
+Training and search parameters come from index_config.json.
+"""
+
+import json
+import math
+import os
+
+import faiss
+import numpy as np
+
+CONFIG_FILE = 'index_config.json'
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'hnsw', 'ivf_pq', 'sq8', 'pq')
+
+METRICS = ('ip', 'l2')
+
+# Quantiles kept per score distribution in the calibration table
+CALIBRATION_POINTS = 101
+
+# Types that must be trained on sample vectors before anything is added
+TRAINED_TYPES = ('ivf_flat', 'ivf_pq', 'sq8', 'pq')
+
+# Types whose stored vectors are lossy codes rather than float32
+QUANTIZED_TYPES = ('ivf_pq', 'sq8', 'pq')
+
+DEFAULT_CONFIG = {
+    'index_type': 'flat',
+    'metric': 'ip',
+    'min_score': 0.1,
+    'ivf_flat': {'nlist': None, 'nprobe': 8},
+    'hnsw': {'M': 32, 'ef_construction': 200, 'ef_search': 64},
+    'ivf_pq': {'nlist': None, 'nprobe': 16, 'm': 48, 'nbits': 8, 'rerank': 0},
+    'sq8': {'rerank': 0},
+    'pq': {'m': 48, 'nbits': 8, 'rerank': 50},
+}
+
+
+def load_config(path=CONFIG_FILE):
+    """DEFAULT_CONFIG overlaid with the JSON file at `path` (if present)."""
+    config = json.loads(json.dumps(DEFAULT_CONFIG))
+    try:
+        with open(path) as f:
+            overrides = json.load(f)
+    except FileNotFoundError:
+        return config
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            config[key].update(value)
+        else:
+            config[key] = value
+    return config
+
+
+def index_params(config, index_type):
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"unknown index type {index_type!r} (choose from {', '.join(INDEX_TYPES)})")
+    return dict(config.get(index_type, {}))
+
+
+def auto_nlist(count):
+    """~4*sqrt(n) lists, but keep >= 39 training points per centroid."""
+    return max(1, min(int(4 * math.sqrt(count)), count // 39))
+
+
+def supports_remove(index_type):
+    """HNSW graphs cannot drop vectors; those indexes are rebuilt instead."""
+    return index_type != 'hnsw'
+
+
+def normalize(vectors):
+    """Unit-length float32 copy of `vectors` (rows of zeros stay zero)."""
+    vectors = np.array(vectors, dtype='float32', copy=True, ndmin=2)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def faiss_metric(metric):
+    if metric not in METRICS:
+        raise ValueError(f"unknown metric {metric!r} (choose from {', '.join(METRICS)})")
+    return faiss.METRIC_INNER_PRODUCT if metric == 'ip' else faiss.METRIC_L2
+
+
+def new_index(index_type, train_vectors, params, metric='ip', count=None):
+    """Empty index of `index_type`, trained on `train_vectors` if the type needs it.
+
+    `count` is how many vectors it will end up holding (it sizes the IVF
+    lists); it defaults to the training set. With metric 'ip' the caller
+    passes unit vectors (see normalize()), so scores are cosine similarities.
+    """
+    train_vectors = np.ascontiguousarray(train_vectors, dtype='float32')
+    dim = train_vectors.shape[1]
+    fmetric = faiss_metric(metric)
+
+    if index_type == 'flat':
+        index = faiss.IndexIDMap(faiss.IndexFlat(dim, fmetric))
+    elif index_type == 'hnsw':
+        hnsw = faiss.IndexHNSWFlat(dim, params['M'], fmetric)
+        hnsw.hnsw.efConstruction = params['ef_construction']
+        hnsw.hnsw.efSearch = params['ef_search']
+        index = faiss.IndexIDMap(hnsw)
+    elif index_type == 'sq8':
+        index = faiss.IndexIDMap(faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, fmetric))
+        index.train(train_vectors)
+    elif index_type == 'pq':
+        # Plain PQ codes, held as a single-list IVF: IndexPQ cannot take the
+        # ID selectors that filtered search (filters.py) passes into FAISS
+        _check_pq(dim, params)
+        index = faiss.IndexIVFPQ(faiss.IndexFlat(dim, fmetric), dim, 1, params['m'], params['nbits'], fmetric)
+        index.train(train_vectors)
+        index.nprobe = 1
+    elif index_type in ('ivf_flat', 'ivf_pq'):
+        # Never more lists than the training set can fill (>= 39 points each)
+        nlist = params.get('nlist') or min(auto_nlist(count or len(train_vectors)), max(1, len(train_vectors) // 39))
+        quantizer = faiss.IndexFlat(dim, fmetric)
+        if index_type == 'ivf_flat':
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, fmetric)
+        else:
+            _check_pq(dim, params)
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, params['m'], params['nbits'], fmetric)
+        index.train(train_vectors)
+        index.nprobe = params['nprobe']
+    else:
+        raise ValueError(f"unknown index type {index_type!r}")
+    return index
+
+
+def build_index(index_type, vectors, ids, params, metric='ip'):
+    """Train (if needed) and fill an index of `index_type` with `vectors` under `ids`."""
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    index = new_index(index_type, vectors, params, metric)
+    index.add_with_ids(vectors, np.asarray(ids, dtype='int64'))
+    return index
+
+
+def index_bytes(index):
+    """Serialized size of an index (what books.index takes on disk)."""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def _check_pq(dim, params):
+    if dim % params['m']:
+        raise ValueError(f"pq: m={params['m']} must divide the vector dimension {dim}")
+
+
+def vectors_path(index_file):
+    """Float32 vectors in the order of books.index.ids.npy, kept for exact reranking."""
+    return f"{index_file}.vectors.f32"
+
+
+class RerankIndex:
+    """Search a quantized index for `candidates` hits, then rerank them exactly.
+
+    `vectors` is a (possibly memory-mapped) float32 array whose row i belongs
+    to `ids[i]`; only the candidate rows are ever read.
+    """
+
+    def __init__(self, index, vectors, ids, candidates, metric='ip'):
+        self.index = index
+        self.vectors = vectors
+        self.candidates = candidates
+        self.metric = metric
+        self.order = np.argsort(ids, kind='stable')
+        self.sorted_ids = np.asarray(ids)[self.order]
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    @property
+    def d(self):
+        return self.index.d
+
+    def search(self, queries, k, params=None):
+        queries = np.ascontiguousarray(queries, dtype='float32')
+        _, candidates = self.index.search(queries, max(k, self.candidates), params=params)
+        # FAISS's conventions: best first, empty slots -inf (ip) / +inf (l2) with label -1
+        distances = np.full((len(queries), k), -np.inf if self.metric == 'ip' else np.inf, dtype='float32')
+        labels = np.full((len(queries), k), -1, dtype='int64')
+        for row, (query, found) in enumerate(zip(queries, candidates)):
+            found = found[found >= 0]
+            if not len(found):
+                continue
+            rows = self.order[np.searchsorted(self.sorted_ids, found)]
+            if self.metric == 'ip':
+                exact = np.asarray(self.vectors[rows]) @ query
+                best = np.argsort(-exact)[:k]
+            else:
+                exact = ((np.asarray(self.vectors[rows]) - query) ** 2).sum(axis=1)
+                best = np.argsort(exact)[:k]
+            distances[row, :len(best)] = exact[best]
+            labels[row, :len(best)] = found[best]
+        return distances, labels
+
+
+class ScoreCalibration:
+    """Maps raw index scores to a 0-1 "match" score, fitted offline on the catalog.
+
+    Two quantile tables of similarity (inner product, or negated L2
+    distance): between random pairs of books, and between each sampled book
+    and its nearest other book. A score is the mean of the two CDFs, so 0.5
+    means "clearly better than chance" and 1.0 "as close as the closest
+    books get". Manifests without a table keep the old 1 / (1 + distance).
+    """
+
+    def __init__(self, metric='l2', random_pairs=None, nearest=None):
+        self.metric = metric
+        self.random_pairs = None if random_pairs is None else np.asarray(random_pairs, dtype='float32')
+        self.nearest = None if nearest is None else np.asarray(nearest, dtype='float32')
+        self.levels = np.linspace(0, 1, CALIBRATION_POINTS, dtype='float32')
+
+    @classmethod
+    def fit(cls, index, vectors, metric='ip', sample=1000, seed=0):
+        """Calibrate on up to `sample` catalog vectors searched against `index`."""
+        rng = np.random.default_rng(seed)
+        picks = rng.choice(len(vectors), size=min(sample, len(vectors)), replace=False)
+        queries = np.ascontiguousarray(vectors[picks], dtype='float32')
+        others = np.asarray(vectors[rng.choice(len(vectors), size=len(picks))], dtype='float32')
+        if metric == 'ip':
+            random_pairs = (queries * others).sum(axis=1)
+        else:
+            random_pairs = -((queries - others) ** 2).sum(axis=1)
+        # The best hit is (normally) the book itself; the second is its nearest neighbour
+        raw, _ = index.search(queries, 2)
+        nearest = raw[:, 1] if metric == 'ip' else -raw[:, 1]
+        nearest = nearest[np.isfinite(nearest)]
+        quantiles = np.linspace(0, 100, CALIBRATION_POINTS)
+        return cls(metric, np.percentile(random_pairs, quantiles), np.percentile(nearest, quantiles))
+
+    @classmethod
+    def from_manifest(cls, manifest):
+        table = manifest.get('calibration') or {}
+        return cls(manifest.get('metric', 'l2'), table.get('random_pairs'), table.get('nearest'))
+
+    def to_json(self):
+        return {
+            'random_pairs': np.round(self.random_pairs, 6).tolist(),
+            'nearest': np.round(self.nearest, 6).tolist(),
+        }
+
+    def __call__(self, raw):
+        raw = np.asarray(raw, dtype='float32')
+        if self.nearest is None:
+            if self.metric == 'ip':
+                return ((1 + raw) / 2).clip(0, 1).astype('float32')
+            return (1 / (1 + raw)).astype('float32')
+        similarity = raw if self.metric == 'ip' else -raw
+        return (0.5 * (np.interp(similarity, self.random_pairs, self.levels) +
+                       np.interp(similarity, self.nearest, self.levels))).astype('float32')
+
+
+def open_index(index_file):
+    """Read books.index the way it was built (wrapping it for reranking if configured)."""
+    index = faiss.read_index(index_file)
+    try:
+        with open(f"{index_file}.json") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return index
+    candidates = manifest.get('params', {}).get('rerank', 0)
+    if candidates and os.path.exists(vectors_path(index_file)):
+        ids = np.load(f"{index_file}.ids.npy")['id']
+        vectors = np.memmap(vectors_path(index_file), dtype='float32', mode='r', shape=(len(ids), manifest['dim']))
+        return RerankIndex(index, vectors, ids, candidates, manifest.get('metric', 'l2'))
+    return index
+
+
+def index_version(index_file):
+    """Identifies one build of books.index (changes whenever bookindex.py writes it)."""
+    try:
+        with open(f"{index_file}.json") as f:
+            return str(json.load(f)['built_at'])
+    except (FileNotFoundError, KeyError, ValueError):
+        return str(os.stat(index_file).st_mtime_ns)
+
+
+def recall_at_k(found, truth):
+    hits = sum(len(set(row_found[row_found >= 0]) & set(row_truth)) for row_found, row_truth in zip(found, truth))
+    return hits / truth.size
+
+
+def footprint_report(index, vectors, ids, k=5, sample=500, seed=0, metric='ip'):
+    """Memory footprint and recall@k against an exact float index on `sample` catalog vectors."""
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), size=min(sample, len(vectors)), replace=False)
+    queries = np.ascontiguousarray(vectors[picks], dtype='float32')
+    exact = build_index('flat', vectors, ids, {}, metric)
+    _, truth = exact.search(queries, k)
+    _, found = index.search(queries, k)
+    inner = index.index if isinstance(index, RerankIndex) else index
+    return {
+        'index_bytes': index_bytes(inner),
+        'float_bytes': index_bytes(exact),
+        'recall': recall_at_k(found, truth),
+    }
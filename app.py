@@ -1,10 +1,15 @@
 import streamlit as st
-import faiss
+import streamlit.components.v1 as components
 import pandas as pd
-from sentence_transformers import SentenceTransformer
-import os
 import time
 
+import metrics
+from carousel import carousel_html
+from catalog import Catalog
+from covers import CoverCache
+from metrics import count, span
+from searchservice import BackgroundSearcher
+
 # Page config
 st.set_page_config(
     page_title="OnceUponAI",
@@ -16,17 +21,31 @@ st.set_page_config(
 # Load resources
 @st.cache_resource
 def load_resources():
-    index = faiss.read_index('books.index')
-    df = pd.read_pickle('books.pkl')
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    return index, df, model
+    started = time.perf_counter()
+    catalog = Catalog('books.arrow')
+    print(f"⏱️  Catalog opened in {time.perf_counter() - started:.3f}s ({len(catalog)} books)")
+    # searchservice.py when it is running (one model for every worker), else in-process;
+    # loads and warms up in the background so the carousel renders immediately
+    searcher = BackgroundSearcher()
+    # Encoded cover bytes, read once per process for every session
+    covers = CoverCache()
+    return catalog, searcher, covers
 
 try:
-    index, df, model = load_resources()
+    catalog, searcher, covers = load_resources()
 except:
     st.error("⚠️ Please run `python build_index.py` first to create the book index!")
     st.stop()
 
+
+def show_cover(book, size, **image_args):
+    """The book's cover (or the bundled placeholder) from the in-memory cover cache."""
+    with span('cover_bytes'):
+        data = covers.get(book, size)
+    count('cover_found', data is not covers.placeholder)
+    with span('st_image'):
+        st.image(data, **image_args)
+
 # Custom CSS for carousel and styling
 st.markdown("""
     <style>
@@ -123,21 +142,16 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# Initialize session state for carousel
-if 'carousel_index' not in st.session_state:
-    st.session_state.carousel_index = 0
-    st.session_state.carousel_books = df.sample(n=min(20, len(df))).reset_index(drop=True)
+# Carousel books for this session: 20 random IDs (an int64 array), rotated in the browser (see carousel.py)
+if 'carousel_ids' not in st.session_state:
+    st.session_state.carousel_ids = catalog.sample(20)
 
-# Auto-rotate carousel
-if 'last_rotation' not in st.session_state:
-    st.session_state.last_rotation = time.time()
 
-# Rotate every 5 seconds
-current_time = time.time()
-if current_time - st.session_state.last_rotation > 5:
-    st.session_state.carousel_index = (st.session_state.carousel_index + 1) % len(st.session_state.carousel_books)
-    st.session_state.last_rotation = current_time
-    st.rerun()
+@st.cache_data(max_entries=64, show_spinner=False)
+def carousel_markup(book_ids):
+    with span('catalog_rows'):
+        books = catalog.rows(list(book_ids))
+    return carousel_html(books, covers, interval_seconds=5, cover_width='30%')
 
 # Header
 st.markdown("<h1 class='main-title'>✨ OnceUponAI</h1>", unsafe_allow_html=True)
@@ -152,42 +166,52 @@ query = st.text_area(
     key="search_input"
 )
 
+# Optional filters, applied inside the vector search
+with st.expander("🎛️ Filters"):
+    filter_col1, filter_col2, filter_col3 = st.columns(3)
+    with filter_col1:
+        call_prefix = st.text_input("Call number starts with", placeholder="e.g. PN6728", key="filter_call_prefix")
+    with filter_col2:
+        author_filter = st.text_input("Author", placeholder="e.g. Chambers", key="filter_author")
+    with filter_col3:
+        has_cover = st.checkbox("Only books with covers", key="filter_has_cover")
+filters = {'call_prefix': call_prefix, 'author': author_filter, 'has_cover': has_cover}
+
 col1, col2, col3 = st.columns([2, 1, 2])
 with col2:
     search_button = st.button("🔍 Search", type="primary", use_container_width=True)
 
 if search_button and query.strip():
     with st.spinner("🔮 Searching through our collection..."):
-        # Encode query
-        query_embedding = model.encode([query])
-        
-        # Search FAISS
-        distances, indices = index.search(query_embedding.astype('float32'), 5)
+        # Encode query and search FAISS (batched by the search service, repeats cached)
+        with span('search_total'):
+            scores, ids = searcher.search(query, 5, filters)
+        with span('catalog_rows'):
+            books = {book['book_id']: book for book in catalog.rows(ids)}
         
         st.markdown("---")
         st.markdown("### 📚 Best Matches")
+        if not books:
+            st.info("📭 No books match that search. Try describing it differently or loosening the filters.")
         
         # Display results in a grid
-        for i in range(0, len(indices[0]), 2):
+        for i in range(0, len(ids), 2):
             cols = st.columns(2)
             
-            for col_idx, result_idx in enumerate(indices[0][i:i+2]):
-                if result_idx >= len(df):
+            for col_idx, result_idx in enumerate(ids[i:i+2]):
+                # FAISS returns book IDs; -1 means fewer than 5 hits
+                if result_idx not in books:
                     continue
                     
-                book = df.iloc[result_idx]
-                similarity_score = 1 / (1 + distances[0][i + col_idx])
+                book = books[result_idx]
+                similarity_score = float(scores[i + col_idx])
                 
                 with cols[col_idx]:
                     # Book card
                     card_col1, card_col2 = st.columns([1, 2])
                     
                     with card_col1:
-                        cover_path = f"data/covers/{book.get('cover_filename', '')}"
-                        if os.path.exists(cover_path):
-                            st.image(cover_path, use_column_width=True)
-                        else:
-                            st.image("https://via.placeholder.com/300x450?text=No+Cover", use_column_width=True)
+                        show_cover(book, 'card', use_column_width=True)
                     
                     with card_col2:
                         st.markdown(f"<p class='book-title'>{book['title']}</p>", unsafe_allow_html=True)
@@ -215,48 +239,24 @@ elif search_button:
 st.markdown("---")
 st.markdown("### 📖 Discover Books from Our Collection")
 
-# Get current book from carousel
-current_book = st.session_state.carousel_books.iloc[st.session_state.carousel_index]
-
-# Display carousel book
-carousel_col1, carousel_col2, carousel_col3 = st.columns([1, 2, 1])
-
-with carousel_col2:
-    inner_col1, inner_col2 = st.columns([1, 2])
-    
-    with inner_col1:
-        cover_path = f"data/covers/{current_book.get('cover_filename', '')}"
-        if os.path.exists(cover_path):
-            st.image(cover_path, use_column_width=True)
-        else:
-            st.image("https://via.placeholder.com/300x450?text=No+Cover", use_column_width=True)
-    
-    with inner_col2:
-        st.markdown(f"<p class='book-title'>{current_book['title']}</p>", unsafe_allow_html=True)
-        st.markdown(f"<p class='book-author'>by {current_book['author']}</p>", unsafe_allow_html=True)
-        st.markdown(f"<p class='book-blurb'>{current_book['blurb']}</p>", unsafe_allow_html=True)
-        
-        if 'call_number' in current_book and pd.notna(current_book['call_number']) and current_book['call_number']:
-            st.markdown(f"<span class='call-number'>📍 {current_book['call_number']}</span>", unsafe_allow_html=True)
-
-# Manual carousel controls
-st.markdown("<br>", unsafe_allow_html=True)
-nav_col1, nav_col2, nav_col3, nav_col4, nav_col5 = st.columns([2, 1, 1, 1, 2])
-
-with nav_col2:
-    if st.button("⬅️ Previous", use_container_width=True):
-        st.session_state.carousel_index = (st.session_state.carousel_index - 1) % len(st.session_state.carousel_books)
-        st.rerun()
-
-with nav_col3:
-    st.markdown(f"<div style='text-align: center; padding: 8px;'>{st.session_state.carousel_index + 1} / {len(st.session_state.carousel_books)}</div>", unsafe_allow_html=True)
-
-with nav_col4:
-    if st.button("Next ➡️", use_container_width=True):
-        st.session_state.carousel_index = (st.session_state.carousel_index + 1) % len(st.session_state.carousel_books)
-        st.rerun()
+components.html(carousel_markup(st.session_state.carousel_ids), height=520)
 
 # Footer
 st.markdown("<br><br>", unsafe_allow_html=True)
 st.markdown("---")
-st.markdown(f"<div style='text-align: center; color: #7F8C8D;'>✨ Featuring {len(df)} books from our collection • Auto-rotating every 5 seconds</div>", unsafe_allow_html=True)
\ No newline at end of file
+st.markdown(f"<div style='text-align: center; color: #7F8C8D;'>✨ Featuring {len(catalog)} books from our collection • Auto-rotating every 5 seconds</div>", unsafe_allow_html=True)
+
+# Hidden diagnostics panel: open the app with ?diagnostics=1 (spans need ONCEUPONAI_METRICS=1)
+if st.query_params.get('diagnostics') == '1':
+    with st.expander("🩺 Diagnostics", expanded=True):
+        if not metrics.ENABLED:
+            st.caption("Span timing is off - start the app with ONCEUPONAI_METRICS=1")
+        st.markdown("**This app process**")
+        local = metrics.snapshot()
+        st.table(metrics.table(local))
+        st.json({'rates': local['rates'], 'searcher': searcher.stats(), 'covers': covers.stats(), 'startup': searcher.timings})
+        service = searcher.service_metrics() if searcher.ready.is_set() else None
+        if service is not None:
+            st.markdown("**Search service**")
+            st.table(metrics.table(service))
+            st.json({'rates': service['rates']})
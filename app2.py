@@ -1,10 +1,15 @@
 import streamlit as st
-import faiss
+import streamlit.components.v1 as components
 import pandas as pd
-from sentence_transformers import SentenceTransformer
-import os
 import time
 
+import metrics
+from carousel import carousel_html
+from catalog import Catalog
+from covers import CoverCache
+from metrics import count, span
+from searchservice import BackgroundSearcher
+
 # Page config
 # st.set_page_config(
 #     page_title="OnceUponAI",
@@ -16,17 +21,31 @@ import time
 # Load resources
 @st.cache_resource
 def load_resources():
-    index = faiss.read_index('books.index')
-    df = pd.read_pickle('books.pkl')
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    return index, df, model
+    started = time.perf_counter()
+    catalog = Catalog('books.arrow')
+    print(f"⏱️  Catalog opened in {time.perf_counter() - started:.3f}s ({len(catalog)} books)")
+    # searchservice.py when it is running (one model for every worker), else in-process;
+    # loads and warms up in the background so the carousel renders immediately
+    searcher = BackgroundSearcher()
+    # Encoded cover bytes, read once per process for every session
+    covers = CoverCache()
+    return catalog, searcher, covers
 
 try:
-    index, df, model = load_resources()
+    catalog, searcher, covers = load_resources()
 except:
     st.error("⚠️ Please run `python build_index.py` first to create the book index!")
     st.stop()
 
+
+def show_cover(book, size, **image_args):
+    """The book's cover (or the bundled placeholder) from the in-memory cover cache."""
+    with span('cover_bytes'):
+        data = covers.get(book, size)
+    count('cover_found', data is not covers.placeholder)
+    with span('st_image'):
+        st.image(data, **image_args)
+
 # Custom CSS
 st.markdown("""
     <style>
@@ -54,61 +73,6 @@ st.markdown("""
         padding: 20px;
     }
     
-    /* Left side - Carousel */
-    .carousel-book-title {
-        font-size: 48px;
-        font-weight: bold;
-        color: #2C3E50;
-        margin-bottom: 15px;
-        line-height: 1.2;
-    }
-    
-    .carousel-book-author {
-        font-size: 32px;
-        color: #7F8C8D;
-        font-style: italic;
-        margin-bottom: 20px;
-    }
-    
-    .carousel-book-blurb {
-        font-size: 24px;
-        color: #34495E;
-        line-height: 1.8;
-        margin-bottom: 20px;
-        max-height: 500px;
-        overflow-y: auto;
-        padding-right: 10px;
-    }
-    
-    /* Scrollbar styling */
-    .carousel-book-blurb::-webkit-scrollbar {
-        width: 8px;
-    }
-    
-    .carousel-book-blurb::-webkit-scrollbar-track {
-        background: #f1f1f1;
-        border-radius: 10px;
-    }
-    
-    .carousel-book-blurb::-webkit-scrollbar-thumb {
-        background: #667eea;
-        border-radius: 10px;
-    }
-    
-    .carousel-book-blurb::-webkit-scrollbar-thumb:hover {
-        background: #764ba2;
-    }
-    
-    .carousel-call-number {
-        background: linear-gradient(120deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        padding: 15px 30px;
-        border-radius: 10px;
-        font-weight: bold;
-        display: inline-block;
-        font-size: 28px;
-    }
-    
     /* Right side - Search */
     .search-title {
         font-size: 36px;
@@ -170,71 +134,41 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# Initialize session state for carousel
-if 'carousel_index' not in st.session_state:
-    st.session_state.carousel_index = 0
-    st.session_state.carousel_books = df.sample(n=min(50, len(df))).reset_index(drop=True)
+# Carousel books for this session: 50 random IDs (an int64 array), rotated in the browser (see carousel.py)
+if 'carousel_ids' not in st.session_state:
+    st.session_state.carousel_ids = catalog.sample(50)
 
-if 'last_rotation' not in st.session_state:
-    st.session_state.last_rotation = time.time()
+# Kiosk-sized type for the carousel component (page CSS does not reach its iframe)
+CAROUSEL_CSS = """
+.carousel { gap: 40px; }
+.title { font-size: 48px; line-height: 1.2; margin-bottom: 15px; }
+.author { font-size: 32px; margin-bottom: 20px; }
+.blurb { font-size: 24px; line-height: 1.8; overflow-y: auto; padding-right: 10px; }
+.blurb::-webkit-scrollbar { width: 8px; }
+.blurb::-webkit-scrollbar-track { background: #f1f1f1; border-radius: 10px; }
+.blurb::-webkit-scrollbar-thumb { background: #667eea; border-radius: 10px; }
+.call-number { padding: 15px 30px; border-radius: 10px; font-size: 28px; }
+.nav { font-size: 18px; margin-top: 30px; }
+"""
 
-if time.time() - st.session_state.last_rotation > 15:
-    st.session_state.carousel_index = (st.session_state.carousel_index + 1) % len(st.session_state.carousel_books)
-    st.session_state.last_rotation = time.time()
-    st.experimental_rerun()
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def carousel_markup(book_ids):
+    with span('catalog_rows'):
+        books = catalog.rows(list(book_ids))
+    return carousel_html(books, covers, interval_seconds=15, size='hero', cover_width='45%', blurb_height='500px',
+                         extra_css=CAROUSEL_CSS)
 
 # No title at top (reduce top padding)
 st.markdown("<div style='height: 10px;'></div>", unsafe_allow_html=True)
 
 
-# Two column layout - LEFT: Image | MIDDLE: Blurb | RIGHT: Search
-left_col, middle_col, right_col = st.columns([1, 1, 1], gap="large")
-
-# ========== LEFT SIDE: BOOK COVER ==========
-with left_col:
-    current_book = st.session_state.carousel_books.iloc[st.session_state.carousel_index]
-    
-    # Book cover
-    cover_path = f"data/covers/{current_book.get('cover_filename', '')}"
-    if os.path.exists(cover_path):
-        st.image(cover_path, width=400)
-    else:
-        st.image("https://via.placeholder.com/400x600?text=No+Cover", width=400)
+# Two column layout - LEFT: Carousel (cover + blurb) | RIGHT: Search
+carousel_col, right_col = st.columns([2, 1], gap="large")
 
-# ========== MIDDLE: BOOK DETAILS ==========
-with middle_col:
-    current_book = st.session_state.carousel_books.iloc[st.session_state.carousel_index]
-    
-    # Book details
-    st.markdown(f"<p class='carousel-book-title'>{current_book['title']}</p>", unsafe_allow_html=True)
-    st.markdown(f"<p class='carousel-book-author'>by {current_book['author']}</p>", unsafe_allow_html=True)
-    st.markdown(f"<div class='carousel-book-blurb'>{current_book['blurb']}</div>", unsafe_allow_html=True)
-    
-    # Call number - using div instead of span for better display
-    if 'call_number' in current_book and pd.notna(current_book['call_number']) and current_book['call_number'] != '':
-        st.markdown(f"<div class='carousel-call-number'>📍 Find at: {current_book['call_number']}</div>", unsafe_allow_html=True)
-    else:
-        st.markdown("<div style='color: #999; font-size: 18px;'>No call number available</div>", unsafe_allow_html=True)
-    
-    # Navigation buttons
-    st.markdown("<br><br>", unsafe_allow_html=True)
-    nav_col1, nav_col2, nav_col3 = st.columns([1, 1, 1])
-    
-    with nav_col1:
-        if st.button("⬅️ Previous", key="prev"):
-            st.session_state.carousel_index = (st.session_state.carousel_index - 1) % len(st.session_state.carousel_books)
-            st.session_state.last_rotation = time.time()  # Reset timer
-            st.rerun()
-    
-    with nav_col2:
-        st.markdown(f"<div style='text-align: center; padding: 8px; font-size: 18px;'>{st.session_state.carousel_index + 1} / {len(st.session_state.carousel_books)}</div>", unsafe_allow_html=True)
-    
-    with nav_col3:
-        if st.button("Next ➡️", key="next"):
-            st.session_state.carousel_index = (st.session_state.carousel_index + 1) % len(st.session_state.carousel_books)
-            st.session_state.last_rotation = time.time()  # Reset timer
-            st.rerun()
-    
+# ========== LEFT SIDE: CAROUSEL ==========
+with carousel_col:
+    components.html(carousel_markup(st.session_state.carousel_ids), height=760)
     st.markdown("<div style='text-align: center; color: #7F8C8D; margin-top: 20px; font-size: 16px;'>Auto-rotating every 15 seconds</div>", unsafe_allow_html=True)
 
 # ========== RIGHT SIDE: SEARCH ==========
@@ -248,37 +182,38 @@ with right_col:
         key="search_input",
         label_visibility="collapsed"
     )
+
+    # Optional filters, applied inside the vector search
+    with st.expander("🎛️ Filters"):
+        call_prefix = st.text_input("Call number starts with", placeholder="e.g. PN6728", key="filter_call_prefix")
+        author_filter = st.text_input("Author", placeholder="e.g. Chambers", key="filter_author")
+        has_cover = st.checkbox("Only books with covers", key="filter_has_cover")
+    filters = {'call_prefix': call_prefix, 'author': author_filter, 'has_cover': has_cover}
     
     search_button = st.button("🔍 Search", type="primary")
     
     if search_button and query.strip():
         with st.spinner("🔮 Searching through our collection..."):
-            # Encode query
-            query_embedding = model.encode([query])
+            # Encode query and search FAISS (batched by the search service, repeats cached)
+            with span('search_total'):
+                scores, ids = searcher.search(query, 5, filters)
 
-            # Search FAISS
-            distances, indices = index.search(query_embedding.astype('float32'), 5)
-            results = [df.iloc[i] for i in indices[0] if i < len(df)]
-
-            # Store search results in session state
-            st.session_state.search_results = results
+            # Session state keeps only the result IDs; rows come from the shared catalog
+            st.session_state.search_ids = catalog.ids[catalog.positions(ids)]
             st.session_state.search_index = 0  # start with first result
             st.session_state.search_time = time.time()
             st.rerun()
 
-    elif "search_results" in st.session_state and st.session_state.search_results:
-        results = st.session_state.search_results
+    elif "search_ids" in st.session_state and len(st.session_state.search_ids):
+        result_ids = st.session_state.search_ids
         current_idx = st.session_state.search_index
-        book = results[current_idx]
+        with span('catalog_rows'):
+            book = catalog.row(result_ids[current_idx])
 
         # Display single book result cleanly
         result_col1, result_col2 = st.columns([1, 1.2])
         with result_col1:
-            cover_path = f"data/covers/{book.get('cover_filename', '')}"
-            if os.path.exists(cover_path):
-                st.image(cover_path, use_column_width=True)
-            else:
-                st.image("https://via.placeholder.com/400x600?text=No+Cover", use_column_width=True)
+            show_cover(book, 'card', use_column_width=True)
 
         with result_col2:
             st.markdown(f"<p class='result-book-title' style='font-size:28px;'>{book['title']}</p>", unsafe_allow_html=True)
@@ -299,13 +234,16 @@ with right_col:
                 st.session_state.search_index -= 1
                 st.rerun()
         with nav_col2:
-            st.markdown(f"<div style='text-align:center; font-size:16px; color:#7F8C8D;'>{current_idx+1} / {len(results)}</div>", unsafe_allow_html=True)
+            st.markdown(f"<div style='text-align:center; font-size:16px; color:#7F8C8D;'>{current_idx+1} / {len(result_ids)}</div>", unsafe_allow_html=True)
         with nav_col3:
-            if st.button("Next Book ➡️", key="search_next") and current_idx < len(results) - 1:
+            if st.button("Next Book ➡️", key="search_next") and current_idx < len(result_ids) - 1:
                 st.session_state.search_index += 1
                 st.rerun()
 
     
+    elif "search_ids" in st.session_state:
+        # Every match fell below the index's score cutoff (or outside the filters)
+        st.info("📭 No books match that search. Try describing it differently or loosening the filters.")
     elif search_button:
         st.warning("⚠️ Please enter a description to search!")
     else:
@@ -322,4 +260,19 @@ with right_col:
             
 
 # Footer
-st.markdown(f"<hr><div style='text-align: center; font-size: 20px; color: #7F8C8D;'><span style='font-size: 32px; font-weight: bold; color: #57068c;'>OnceUponAI ✨</span>&nbsp;&nbsp;|&nbsp;&nbsp;✨ Featuring {len(df)} books from our collection</div>", unsafe_allow_html=True)
+st.markdown(f"<hr><div style='text-align: center; font-size: 20px; color: #7F8C8D;'><span style='font-size: 32px; font-weight: bold; color: #57068c;'>OnceUponAI ✨</span>&nbsp;&nbsp;|&nbsp;&nbsp;✨ Featuring {len(catalog)} books from our collection</div>", unsafe_allow_html=True)
+
+# Hidden diagnostics panel: open the app with ?diagnostics=1 (spans need ONCEUPONAI_METRICS=1)
+if st.query_params.get('diagnostics') == '1':
+    with st.expander("🩺 Diagnostics", expanded=True):
+        if not metrics.ENABLED:
+            st.caption("Span timing is off - start the app with ONCEUPONAI_METRICS=1")
+        st.markdown("**This app process**")
+        local = metrics.snapshot()
+        st.table(metrics.table(local))
+        st.json({'rates': local['rates'], 'searcher': searcher.stats(), 'covers': covers.stats(), 'startup': searcher.timings})
+        service = searcher.service_metrics() if searcher.ready.is_set() else None
+        if service is not None:
+            st.markdown("**Search service**")
+            st.table(metrics.table(service))
+            st.json({'rates': service['rates']})
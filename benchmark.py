@@ -0,0 +1,540 @@
+"""
+Benchmarks for OnceUponAI
+  index  - recall@5 vs exact flat search, p50/p95 query latency, build time
+           and size for every index type (quantized ones also with exact
+           reranking), on the catalog or synthetic vectors
+  e2e    - every stage on a synthetic catalog of --size books: fetch rows/s
+           against the stub server, cover images/s, embeddings/s, index build
+           time, and query p50/p95/p99 latency and QPS
+  sessions - per-session memory of the apps' session state at 1, 100 and
+           1,000 simulated sessions: ID arrays vs the old copied rows
+  encode - embeddings/s of the index builder's encoder against the number
+           of worker processes (bookindex.py --workers), to size build hosts
+Usage: python benchmark.py [--json out.json] index [--synthetic 100000] [--types flat,hnsw] [--rerank 50]
+       python benchmark.py --json e2e-1k.json e2e --size 1k [--stages fetch,covers,build,query]
+       python benchmark.py sessions [--counts 1,100,1000]
+       python benchmark.py encode [--workers 1,2,4,8] [--texts 2000] [--batch-size 32]
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from annindex import (CONFIG_FILE, INDEX_TYPES, QUANTIZED_TYPES, RerankIndex, build_index, index_bytes, index_params,
+                      load_config, normalize, recall_at_k)
+from encoders import BACKENDS, DEFAULT_BACKEND, DEFAULT_MODEL, MODELS_DIR, load_encoder
+
+K = 5
+
+E2E_STAGES = ('fetch', 'covers', 'build', 'query')
+
+# Words for the synthetic catalog and its queries
+FIRST_NAMES = "Ada Alan Anne Carl Clara Diego Edith Farah Grace Hiro Ines Jonas Kofi Lena Maya Nadia Omar Priya Ravi Sofia Tomas Uma Yara Zoe".split()
+LAST_NAMES = "Achebe Baldwin Chen Dickens Eliot Ferrante Garcia Hosseini Ishiguro Jansson Kafka Lessing Morrison Nakamura Okafor Pratchett Rushdie Smith Tolstoy Walker Yamada".split()
+TITLE_WORDS = ("Secret Garden River Night Empire Shadow Winter Ocean Clockwork Silent City Dragon Letters Summer "
+               "Memory Island Forest Stars Kingdom Glass Storm Lantern Atlas Orchard Harbor Mountain Machine").split()
+BLURB_WORDS = ("mystery adventure family war love history science magic journey friendship detective murder "
+               "village ship island revolution childhood memory dragons kingdom space robots mathematics "
+               "music cooking survival betrayal courage grief humor victorian london paris tokyo").split()
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000) if len(samples) else 0.0
+
+
+def synthetic_vectors(count, dim=384, clusters=None, seed=0):
+    """Clustered Gaussian vectors - a rough stand-in for sentence embeddings."""
+    rng = np.random.default_rng(seed)
+    clusters = clusters or max(1, int(np.sqrt(count)))
+    centers = rng.normal(size=(clusters, dim)).astype('float32')
+    labels = rng.integers(0, clusters, size=count)
+    vectors = centers[labels] + 0.5 * rng.normal(size=(count, dim)).astype('float32')
+    return vectors.astype('float32')
+
+
+def catalog_vectors(books_file, model_name, cache_dir):
+    """Cached embeddings for books.csv (run bookindex.py first)."""
+    from bookindex import book_text
+    from embedcache import EmbeddingCache, text_key
+
+    df = pd.read_csv(books_file)
+    keys = [text_key(model_name, book_text(row)) for _, row in df.iterrows()]
+    cache = EmbeddingCache(model_name, cache_dir)
+    if cache.missing(keys):
+        raise SystemExit("❌ Some books have no cached embedding - run `python bookindex.py` first")
+    return cache.get(keys)
+
+
+def query_vectors(vectors, count, seed=1):
+    """Perturbed copies of random catalog vectors, so the true neighbours are non-trivial."""
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(vectors), size=count)
+    noise = rng.normal(size=(count, vectors.shape[1])).astype('float32') * vectors.std() * 0.5
+    return (vectors[picks] + noise).astype('float32')
+
+
+def time_queries(index, queries, k=K):
+    """Single-query latencies (the app searches one query at a time)."""
+    latencies = []
+    results = np.empty((len(queries), k), dtype='int64')
+    for i in range(len(queries)):
+        started = time.perf_counter()
+        _, found = index.search(queries[i:i + 1], k)
+        latencies.append(time.perf_counter() - started)
+        results[i] = found[0]
+    return results, latencies
+
+
+def parse_size(text):
+    """'1k' / '100k' / '1M' / '2500' -> an int."""
+    text = str(text).strip().lower()
+    scale = {'k': 1_000, 'm': 1_000_000}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+
+def synthetic_catalog(count, seed=0):
+    """Book list shaped like the library export: title, author, call_number."""
+    rng = np.random.default_rng(seed)
+    titles = [' '.join(words) for words in zip(
+        rng.choice(['The', 'A', 'Beyond the', 'Songs of the', 'Return to the'], count),
+        rng.choice(TITLE_WORDS, count), rng.choice(['', 'of', 'and the'], count), rng.choice(TITLE_WORDS, count))]
+    last = rng.choice(LAST_NAMES, count)
+    authors = [f"{surname}, {first}" for surname, first in zip(last, rng.choice(FIRST_NAMES, count))]
+    call_numbers = [f"{dewey:03d}.{decimal:02d} {surname[:3].upper()}"
+                    for dewey, decimal, surname in zip(rng.integers(0, 1000, count), rng.integers(0, 100, count), last)]
+    return pd.DataFrame({'title': [' '.join(title.split()) for title in titles], 'author': authors,
+                         'call_number': call_numbers})
+
+
+def synthetic_blurbs(count, seed=0, words=40):
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(BLURB_WORDS, size=(count, words))
+    return [f"A story of {' '.join(row)}." for row in picks]
+
+
+def synthetic_queries(count, seed=2):
+    """Distinct free-text prompts, so every query misses the query cache."""
+    rng = np.random.default_rng(seed)
+    return [f"{' '.join(rng.choice(BLURB_WORDS, 3))} {i}" for i in range(count)]
+
+
+def latency_summary(latencies, elapsed=None):
+    summary = {f'p{q}_ms': percentile_ms(latencies, q) for q in (50, 95, 99)}
+    if elapsed:
+        summary['qps'] = len(latencies) / elapsed
+    return summary
+
+
+def run_info():
+    """Where a result came from, so runs can be compared across commits."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'timestamp': time.time(), 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def bench_fetch(books, workers, latency):
+    """fetch_book for every row against a local stub server. Returns (stats, cover bytes)."""
+    from fetchdata import fetch_book
+    from ratelimit import TokenBucket
+    from stubserver import StubBooksServer
+
+    # The stub is the only server involved, so the limiter never throttles
+    limiter = TokenBucket(1e9, 1e9)
+    rows = books.to_dict('records')
+    with StubBooksServer(miss_rate=0.1, latency=latency) as api_url:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                lambda item: fetch_book(item[0], item[1]['title'], item[1]['author'], item[1]['call_number'], limiter, api_url),
+                enumerate(rows, 1)))
+        elapsed = time.perf_counter() - started
+    covers = [cover for status, _, _, _, cover, _ in results if cover is not None]
+    statuses = [status for status, *_ in results]
+    return {
+        'rows': len(rows),
+        'seconds': elapsed,
+        'rows_per_second': len(rows) / elapsed,
+        'found': statuses.count('ok'),
+        'not_found': statuses.count('not_found'),
+        'errors': statuses.count('error'),
+        'covers_downloaded': len(covers),
+    }, covers
+
+
+def bench_covers(covers, workers, covers_dir):
+    """process_cover on a process pool, as fetchdata.py runs it."""
+    from covers import cover_pool, process_cover
+
+    started = time.perf_counter()
+    with cover_pool(workers) as pool:
+        infos = list(pool.map(process_cover, covers, ['jpeg'] * len(covers), [covers_dir] * len(covers), chunksize=8))
+    elapsed = time.perf_counter() - started
+    return {
+        'images': len(covers),
+        'seconds': elapsed,
+        'images_per_second': len(covers) / elapsed if elapsed else 0.0,
+        'distinct_covers': len({info['cover_filename'] for info in infos}),
+    }
+
+
+def bench_build(books, encoder, encode_rows, index_type, config):
+    """Encode a sample of the catalog, then build every index structure at full size.
+
+    Encoding the whole of a 1M catalog takes hours on CPU, so embeddings/s is
+    measured on `encode_rows` books and the index is filled with synthetic
+    vectors of the encoder's dimension.
+    """
+    from annindex import ScoreCalibration, build_index, index_params
+    from bookindex import book_ids, book_text
+    from lexical import LexicalIndex
+
+    metric = config['metric']
+    params = index_params(config, index_type)
+    texts = [book_text(row) for _, row in books.head(encode_rows).iterrows()]
+    started = time.perf_counter()
+    encoded = encoder.encode(texts, batch_size=32)
+    encode_seconds = time.perf_counter() - started
+
+    vectors = synthetic_vectors(len(books), encoder.dim)
+    vectors[:len(encoded)] = encoded
+    if metric == 'ip':
+        vectors = normalize(vectors)
+    timings = {}
+    started = time.perf_counter()
+    ids = book_ids(books)
+    timings['ids_seconds'] = time.perf_counter() - started
+    started = time.perf_counter()
+    index = build_index(index_type, vectors, ids, params, metric)
+    timings['index_seconds'] = time.perf_counter() - started
+    started = time.perf_counter()
+    calibration = ScoreCalibration.fit(index, vectors, metric)
+    timings['calibration_seconds'] = time.perf_counter() - started
+    started = time.perf_counter()
+    lexical = LexicalIndex.build(books, ids)
+    timings['lexical_seconds'] = time.perf_counter() - started
+    stats = {
+        'books': len(books),
+        'index_type': index_type,
+        'metric': metric,
+        'encoded': len(texts),
+        'encode_seconds': encode_seconds,
+        'embeddings_per_second': len(texts) / encode_seconds if encode_seconds else 0.0,
+        **timings,
+        'build_seconds': sum(timings.values()),
+        'index_bytes': index_bytes(index),
+    }
+    return stats, (index, calibration, lexical)
+
+
+def bench_query(encoder, built, queries, clients, min_score):
+    """Sequential in-process latency, then QPS of `clients` threads through the search service."""
+    from querycache import QueryCache
+    from searchservice import SearchClient, SearchService
+
+    index, calibration, lexical = built
+    # No cache entries: every query pays for encode + search
+    cache = QueryCache(encoder, index, 'benchmark', max_entries=0, lexical=lexical,
+                       calibration=calibration, min_score=min_score)
+    cache.search('warm up', K)
+    half = len(queries) // 2
+    latencies = []
+    for query in queries[:half]:
+        started = time.perf_counter()
+        cache.search(query, K)
+        latencies.append(time.perf_counter() - started)
+
+    served = []
+    lock = threading.Lock()
+    with SearchService(cache) as url:
+        client = SearchClient(url)
+
+        def run(chunk):
+            for query in chunk:
+                started = time.perf_counter()
+                client.search(query, K)
+                with lock:
+                    served.append(time.perf_counter() - started)
+
+        chunks = [queries[half + i::clients] for i in range(clients)]
+        started = time.perf_counter()
+        threads = [threading.Thread(target=run, args=(chunk,)) for chunk in chunks]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    return {
+        'in_process': latency_summary(latencies, sum(latencies)),
+        'service': {'clients': clients, **latency_summary(served, elapsed)},
+        'lexical_answers': cache.lexical_answers,
+    }
+
+
+def bench_e2e(args):
+    config = load_config(args.config)
+    size = parse_size(args.size)
+    stages = [stage for stage in args.stages if stage in E2E_STAGES]
+    books = synthetic_catalog(size)
+    books['blurb'] = synthetic_blurbs(size)
+    result = {'benchmark': 'e2e', 'size': size, 'stages': {}}
+
+    print("="*60)
+    print("⏱️  OnceUponAI - End-to-End Benchmark")
+    print("="*60)
+    print(f"   Synthetic catalog: {size} books, stages: {', '.join(stages)}\n")
+
+    with tempfile.TemporaryDirectory(prefix='onceuponai-bench-') as workdir:
+        covers = []
+        if 'fetch' in stages or 'covers' in stages:
+            fetch_rows = min(size, args.fetch_rows)
+            stats, covers = bench_fetch(books.head(fetch_rows), args.workers, args.latency)
+            result['stages']['fetch'] = stats
+            print(f"📡 fetch:  {stats['rows_per_second']:>9.1f} rows/s   ({stats['rows']} rows, {args.workers} workers)")
+        if 'covers' in stages and covers:
+            stats = bench_covers(covers, args.cover_workers, os.path.join(workdir, 'covers'))
+            result['stages']['covers'] = stats
+            print(f"🖼️  covers: {stats['images_per_second']:>9.1f} images/s ({stats['images']} covers)")
+
+        built = None
+        if 'build' in stages or 'query' in stages:
+            encoder = load_encoder(args.model, args.backend, args.models_dir)
+            stats, built = bench_build(books, encoder, min(size, args.encode_rows), args.index_type or config['index_type'], config)
+            result['stages']['build'] = stats
+            print(f"🧠 encode: {stats['embeddings_per_second']:>9.1f} embeddings/s ({stats['encoded']} books, {encoder.backend})")
+            print(f"🔨 build:  {stats['build_seconds']:>9.2f} s        ({stats['index_type']} index {stats['index_seconds']:.2f}s,"
+                  f" BM25 {stats['lexical_seconds']:.2f}s)")
+        if 'query' in stages:
+            stats = bench_query(encoder, built, synthetic_queries(args.queries), args.clients, config['min_score'])
+            result['stages']['query'] = stats
+            for name in ('in_process', 'service'):
+                row = stats[name]
+                print(f"🔍 {name:<11} p50 {row['p50_ms']:.2f} ms  p95 {row['p95_ms']:.2f} ms  p99 {row['p99_ms']:.2f} ms"
+                      f"  {row['qps']:.1f} QPS")
+    return result
+
+
+def session_state(catalog, frame, layout, rng, carousel=50, results=5):
+    """What one app2.py session keeps in st.session_state after a search.
+
+    'ids' is the current layout (int64 ID arrays, resolved against the
+    shared catalog at render time); 'rows' copies the books themselves, as
+    the apps did with df.sample() / df.iloc[i].
+    """
+    carousel_ids = catalog.sample(carousel, seed=int(rng.integers(1 << 31)))
+    result_ids = catalog.sample(results, seed=int(rng.integers(1 << 31)))
+    state = {'search_input': 'a thrilling mystery in victorian london', 'search_index': 0,
+             'filter_call_prefix': '', 'filter_author': '', 'filter_has_cover': False}
+    if layout == 'ids':
+        state.update(carousel_ids=carousel_ids, search_ids=result_ids)
+    else:
+        state.update(carousel_books=frame.loc[carousel_ids].copy(),
+                     search_results=[frame.loc[book_id].copy() for book_id in result_ids])
+    return state
+
+
+def bench_sessions(args):
+    from catalog import Catalog
+
+    catalog = Catalog(args.catalog)
+    # Both are shared by every session, so they are built before measuring
+    frame = catalog.to_pandas()
+    rows = []
+    print("="*60)
+    print("⏱️  OnceUponAI - Session Memory Benchmark")
+    print("="*60)
+    print(f"   Catalog: {args.catalog} ({len(catalog)} books)\n")
+    print(f"{'layout':<8}{'sessions':>10}{'total KB':>12}{'per session KB':>16}")
+    for layout in ('ids', 'rows'):
+        for count in args.counts:
+            rng = np.random.default_rng(0)
+            tracemalloc.start()
+            baseline = tracemalloc.get_traced_memory()[0]
+            sessions = [session_state(catalog, frame, layout, rng) for _ in range(count)]
+            used = tracemalloc.get_traced_memory()[0] - baseline
+            tracemalloc.stop()
+            del sessions
+            rows.append({'layout': layout, 'sessions': count, 'bytes': used, 'bytes_per_session': used / count})
+            print(f"{layout:<8}{count:>10}{used / 1024:>12.1f}{used / count / 1024:>16.2f}")
+    return {'benchmark': 'sessions', 'catalog': args.catalog, 'books': len(catalog), 'results': rows}
+
+
+def default_worker_counts():
+    """1, 2, 4, ... up to the number of cores."""
+    cpus = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= cpus:
+        counts.append(counts[-1] * 2)
+    return counts
+
+
+def bench_encode(args):
+    texts = synthetic_blurbs(args.texts)
+    rows = []
+    serial = None
+    print("="*60)
+    print("⏱️  OnceUponAI - Parallel Encode Benchmark")
+    print("="*60)
+    print(f"   {len(texts)} texts, batch size {args.batch_size}, {args.backend} backend, {os.cpu_count()} cores\n")
+    print(f"{'workers':>8}{'threads':>9}{'emb/s':>10}{'speedup':>9}{'startup s':>11}")
+    for workers in args.workers:
+        started = time.perf_counter()
+        encoder = load_encoder(args.model, args.backend, args.models_dir, workers, args.threads)
+        startup = time.perf_counter() - started
+        try:
+            encoder.encode(texts[:args.batch_size * workers], batch_size=args.batch_size)  # warm-up
+            started = time.perf_counter()
+            vectors = encoder.encode(texts, batch_size=args.batch_size)
+            elapsed = time.perf_counter() - started
+        finally:
+            if workers > 1:
+                encoder.close()
+        # Sharding must not reorder or change the embeddings
+        if serial is None:
+            serial = vectors
+        rate = len(texts) / elapsed
+        rows.append({
+            'workers': workers,
+            'threads_per_worker': getattr(encoder, 'threads', args.threads),
+            'embeddings_per_second': rate,
+            'speedup': rate / rows[0]['embeddings_per_second'] if rows else 1.0,
+            'startup_seconds': startup,
+            'matches_first': bool(np.allclose(vectors, serial, atol=1e-4)),
+        })
+        row = rows[-1]
+        print(f"{workers:>8}{row['threads_per_worker'] or '-':>9}{rate:>10.1f}{row['speedup']:>8.2f}x{startup:>11.2f}"
+              f"{'' if row['matches_first'] else '   ⚠️ embeddings differ'}")
+    return {'benchmark': 'encode', 'texts': len(texts), 'batch_size': args.batch_size, 'backend': args.backend,
+            'model': args.model, 'results': rows}
+
+
+def bench_index(args):
+    config = load_config(args.config)
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic, args.dim)
+        source = f"synthetic ({args.synthetic} x {args.dim})"
+    else:
+        from bookindex import BOOKS_FILE, MODEL_NAME
+        from embedcache import EMBEDDINGS_DIR
+        vectors = catalog_vectors(BOOKS_FILE, MODEL_NAME, EMBEDDINGS_DIR)
+        source = f"catalog ({len(vectors)} books)"
+    metric = config['metric']
+    if metric == 'ip':
+        vectors = normalize(vectors)
+    ids = np.arange(len(vectors), dtype='int64')
+    queries = query_vectors(vectors, args.queries)
+    if metric == 'ip':
+        queries = normalize(queries)
+
+    print("="*60)
+    print("⏱️  OnceUponAI - Index Benchmark")
+    print("="*60)
+    print(f"   Vectors: {source}, {len(queries)} queries, recall@{K} vs flat, metric {metric}\n")
+
+    truth = build_index('flat', vectors, ids, {}, metric).search(queries, K)[1]
+    rows = []
+    for index_type in args.types:
+        params = index_params(config, index_type)
+        started = time.perf_counter()
+        index = build_index(index_type, vectors, ids, params, metric)
+        build_seconds = time.perf_counter() - started
+
+        variants = [(index_type, index, 0)]
+        if index_type in QUANTIZED_TYPES and args.rerank:
+            # Reranking reads float vectors from disk (mmap), not from the index
+            variants.append((f"{index_type}+rr", RerankIndex(index, vectors, ids, args.rerank, metric), args.rerank))
+        for name, searcher, rerank in variants:
+            found, latencies = time_queries(searcher, queries)
+            rows.append({
+                'index_type': name,
+                'params': params,
+                'rerank': rerank,
+                'build_seconds': build_seconds,
+                'index_bytes': index_bytes(index),
+                'rerank_vector_bytes': int(vectors.nbytes) if rerank else 0,
+                f'recall_at_{K}': recall_at_k(found, truth),
+                'p50_ms': percentile_ms(latencies, 50),
+                'p95_ms': percentile_ms(latencies, 95),
+            })
+
+    flat_bytes = next((row['index_bytes'] for row in rows if row['index_type'] == 'flat'), None)
+    print(f"{'type':<11}{'recall@5':>10}{'p50 ms':>10}{'p95 ms':>10}{'build s':>10}{'size MB':>10}{'vs flat':>9}")
+    for row in rows:
+        ratio = f"{row['index_bytes'] / flat_bytes:.2f}x" if flat_bytes else '-'
+        print(f"{row['index_type']:<11}{row[f'recall_at_{K}']:>10.3f}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}"
+              f"{row['build_seconds']:>10.2f}{row['index_bytes'] / 1024 / 1024:>10.2f}{ratio:>9}")
+    if any(row['rerank'] for row in rows):
+        print(f"\n   +rr rows rerank the top {args.rerank} candidates exactly; their float vectors"
+              f"\n   ({vectors.nbytes / 1024 / 1024:.2f} MB) stay on disk and are memory-mapped, not held in RAM")
+    return {'benchmark': 'index', 'source': source, 'metric': metric, 'queries': len(queries), 'results': rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OnceUponAI benchmarks")
+    parser.add_argument('--json', help="also write the results to this file")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    index_parser = sub.add_parser('index', help="compare index types")
+    index_parser.add_argument('--types', default=','.join(INDEX_TYPES), type=lambda value: value.split(','))
+    index_parser.add_argument('--config', default=CONFIG_FILE)
+    index_parser.add_argument('--synthetic', type=int, default=None, help="use N synthetic vectors instead of the catalog")
+    index_parser.add_argument('--dim', type=int, default=384)
+    index_parser.add_argument('--queries', type=int, default=200)
+    index_parser.add_argument('--rerank', type=int, default=50, help="candidates to rerank for quantized types (0 = off)")
+    index_parser.set_defaults(run=bench_index)
+
+    e2e_parser = sub.add_parser('e2e', help="fetch, covers, build and query on a synthetic catalog")
+    e2e_parser.add_argument('--size', default='1k', help="catalog size: 1k, 100k, 1M, ...")
+    e2e_parser.add_argument('--stages', default=','.join(E2E_STAGES), type=lambda value: value.split(','))
+    e2e_parser.add_argument('--config', default=CONFIG_FILE)
+    e2e_parser.add_argument('--index-type', choices=INDEX_TYPES, default=None, help="override index_type from the config")
+    e2e_parser.add_argument('--fetch-rows', type=int, default=2000, help="rows fetched from the stub server (at most --size)")
+    e2e_parser.add_argument('--workers', type=int, default=8, help="fetch threads")
+    e2e_parser.add_argument('--latency', type=float, default=0.0, help="stub server delay per request, in seconds")
+    e2e_parser.add_argument('--cover-workers', type=int, default=None, help="cover processes (default: all cores)")
+    e2e_parser.add_argument('--encode-rows', type=int, default=2000, help="books actually encoded (at most --size)")
+    e2e_parser.add_argument('--model', default=DEFAULT_MODEL)
+    e2e_parser.add_argument('--backend', choices=list(BACKENDS), default=DEFAULT_BACKEND, help="encoder backend (see encoders.py)")
+    e2e_parser.add_argument('--models-dir', default=MODELS_DIR)
+    e2e_parser.add_argument('--queries', type=int, default=400)
+    e2e_parser.add_argument('--clients', type=int, default=8, help="concurrent clients against the search service")
+    e2e_parser.set_defaults(run=bench_e2e)
+
+    sessions_parser = sub.add_parser('sessions', help="per-session memory of the apps' session state")
+    sessions_parser.add_argument('--catalog', default='books.arrow')
+    sessions_parser.add_argument('--counts', default=[1, 100, 1000], type=lambda value: [int(n) for n in value.split(',')])
+    sessions_parser.set_defaults(run=bench_sessions)
+
+    encode_parser = sub.add_parser('encode', help="embeddings/s against the number of encoder processes")
+    encode_parser.add_argument('--workers', default=default_worker_counts(), type=lambda value: [int(n) for n in value.split(',')])
+    encode_parser.add_argument('--threads', type=int, default=None, help="threads per worker (default: cores / workers)")
+    encode_parser.add_argument('--texts', type=int, default=2000)
+    encode_parser.add_argument('--batch-size', type=int, default=32)
+    encode_parser.add_argument('--model', default=DEFAULT_MODEL)
+    encode_parser.add_argument('--backend', choices=list(BACKENDS), default=DEFAULT_BACKEND, help="encoder backend (see encoders.py)")
+    encode_parser.add_argument('--models-dir', default=MODELS_DIR)
+    encode_parser.set_defaults(run=bench_encode)
+
+    args = parser.parse_args()
+    result = args.run(args)
+    result['run'] = run_info()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\n📄 Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,54 +1,583 @@
-import pandas as pd
-from sentence_transformers import SentenceTransformer
+"""
+Build the FAISS vector index for data/books.csv
+Incremental: embeddings are cached on disk (see embedcache.py) and books keep
+stable IDs, so a rebuild only encodes new or changed rows, adds/removes just
+those vectors, and drops books deleted from books.csv.
+Book rows go to books.arrow (see catalog.py), keyed by the same IDs, with a
+has_cover column recording which cover files exist.
+The index type (flat, ivf_flat, hnsw, ivf_pq) and its parameters come from
+index_config.json; compare them with `python benchmark.py index`.
+A BM25 inverted index over title / author / blurb (lexical.py) is rebuilt
+alongside for hybrid search.
+The encoder backend (torch, int8, onnx - see encoders.py) is recorded in the
+manifest so the apps can refuse to query the index with an incompatible one,
+along with the metric (cosine over unit vectors by default) and the score
+calibration table the apps turn raw scores into match percentages with.
+--stream rebuilds from scratch in bounded memory for catalogs too big to load
+at once: books.csv is read in chunks, each chunk is encoded (with a batch size
+tuned on the first one), appended to the embedding cache, the index and the
+catalog, and checkpointed, so an interrupted build resumes after the last
+finished chunk instead of re-encoding it.
+--workers N encodes in N processes (see encoders.ParallelEncoder).
+Usage: python bookindex.py [--full] [--index-type TYPE] [--backend torch|int8|onnx] [--workers N]
+       python bookindex.py --stream [--chunk-size 10000] [--batch-size auto|N]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
 import faiss
 import numpy as np
-import os
+import pandas as pd
+
+from annindex import (CONFIG_FILE, INDEX_TYPES, METRICS, QUANTIZED_TYPES, TRAINED_TYPES, ScoreCalibration,
+                      build_index, footprint_report, index_params, load_config, new_index, normalize,
+                      supports_remove, vectors_path)
+from catalog import CATALOG_FILE, CatalogWriter, write_catalog
+from covers import has_cover_column
+from embedcache import EMBEDDINGS_DIR, KEY_BYTES, EmbeddingCache, text_key
+from encoders import BACKENDS, DEFAULT_BACKEND, DEFAULT_MODEL, MODELS_DIR, cache_name, encoder_info, load_encoder
+from lexical import LexicalBuilder, LexicalIndex, lexical_path
+
+MODEL_NAME = DEFAULT_MODEL
+BOOKS_FILE = 'data/books.csv'
+INDEX_FILE = 'books.index'
+
+# Columns that identify a holding; the text that gets embedded may change freely
+ID_COLUMNS = ['title', 'author', 'isbn', 'call_number']
+
+# Always read as text, so IDs do not depend on how pandas guessed a chunk's dtypes
+TEXT_COLUMNS = ['title', 'author', 'blurb', 'isbn', 'call_number', 'cover_filename']
+
+DEFAULT_CHUNK_SIZE = 10000
+# IVF / PQ types train on this many vectors from the start of the catalog
+DEFAULT_TRAIN_ROWS = 100000
+
+# Candidates for --batch-size auto, timed on the first texts to encode
+BATCH_SIZES = (16, 32, 64, 128)
+TUNE_SAMPLE = 256
+DEFAULT_BATCH_SIZE = 32
+
+# Books sampled from a streamed build to fit the score calibration
+CALIBRATION_SAMPLE = 2000
+
+# Files a streamed build spreads row identities over to number duplicate holdings
+DUPLICATE_BUCKETS = 256
+IDENTITY_DTYPE = [('hash', '<u8'), ('row', '<i8')]
+
+
+def manifest_path(index_file):
+    return f"{index_file}.json"
+
+
+def state_path(index_file):
+    """Per-vector (book_id, text key) pairs currently stored in the index."""
+    return f"{index_file}.ids.npy"
+
+
+def checkpoint_path(index_file):
+    """Progress of an unfinished --stream build."""
+    return f"{index_file}.checkpoint.json"
+
+
+def trained_path(index_file):
+    """The empty, trained index of an unfinished --stream build (IVF / PQ types)."""
+    return f"{index_file}.trained"
+
+
+def occurrences_path(index_file):
+    """Duplicate-holding numbers of a --stream build in progress."""
+    return f"{index_file}.occurrences.npy"
+
+
+def postings_path(index_file):
+    """Per-chunk BM25 postings of a --stream build in progress."""
+    return f"{lexical_path(index_file)}.parts"
+
+
+def read_books(path, chunksize=None):
+    """books.csv as one DataFrame, or an iterator of `chunksize`-row DataFrames."""
+    return pd.read_csv(path, dtype={column: str for column in TEXT_COLUMNS}, chunksize=chunksize)
+
+
+def book_text(row):
+    # Combine title, author, and blurb for better matching
+    return f"{row['title']} by {row['author']}. {row['blurb']}"
+
+
+def row_identities(df):
+    """Each row's identifying columns joined into one string."""
+    return ['\x1f'.join('' if pd.isna(row.get(column)) else str(row.get(column)) for column in ID_COLUMNS)
+            for _, row in df.iterrows()]
+
+
+def book_ids(df, occurrences=None):
+    """Stable, non-negative int64 IDs derived from each row's identifying columns.
+
+    Duplicate holdings get an occurrence suffix so every row has its own ID.
+    For a catalog read in chunks, pass each chunk's slice of
+    occurrence_numbers() so the suffixes count across chunks.
+    """
+    identities = row_identities(df)
+    if occurrences is None:
+        seen = {}
+        occurrences = []
+        for identity in identities:
+            occurrences.append(seen.get(identity, 0))
+            seen[identity] = occurrences[-1] + 1
+    ids = []
+    for identity, occurrence in zip(identities, occurrences):
+        digest = hashlib.blake2b(f"{identity}\x1e{int(occurrence)}".encode('utf-8'), digest_size=8).digest()
+        ids.append(int.from_bytes(digest, 'little') & 0x7FFFFFFFFFFFFFFF)
+    return np.array(ids, dtype='int64')
+
+
+def occurrence_numbers(chunks, path, buckets=DUPLICATE_BUCKETS):
+    """Per row, how many earlier rows share its identity, memory-mapped at `path`.
+
+    Instead of a dict of every identity, rows are hashed and spread over
+    `buckets` files on disk by hash, and each bucket is sorted on its own,
+    so memory holds one chunk or one bucket at a time.
+    """
+    workdir = f"{path}.buckets"
+    os.makedirs(workdir, exist_ok=True)
+    files = [open(os.path.join(workdir, f"{bucket}.bin"), 'wb') for bucket in range(buckets)]
+    rows = 0
+    try:
+        for chunk in chunks:
+            entries = np.empty(len(chunk), dtype=IDENTITY_DTYPE)
+            entries['hash'] = [int.from_bytes(hashlib.blake2b(identity.encode('utf-8'), digest_size=8).digest(), 'little')
+                               for identity in row_identities(chunk)]
+            entries['row'] = np.arange(rows, rows + len(chunk))
+            spread = entries['hash'] % buckets
+            for bucket in np.unique(spread):
+                files[bucket].write(entries[spread == bucket].tobytes())
+            rows += len(chunk)
+    finally:
+        for f in files:
+            f.close()
+
+    occurrences = np.lib.format.open_memmap(path, mode='w+', dtype='<u4', shape=(rows,))
+    for bucket in range(buckets):
+        bucket_path = os.path.join(workdir, f"{bucket}.bin")
+        entries = np.fromfile(bucket_path, dtype=IDENTITY_DTYPE)
+        os.remove(bucket_path)
+        if not len(entries):
+            continue
+        # Rows were appended in file order, so a stable sort keeps them in order within each identity
+        entries = entries[np.argsort(entries['hash'], kind='stable')]
+        position = np.arange(len(entries))
+        first = np.r_[True, entries['hash'][1:] != entries['hash'][:-1]]
+        occurrences[entries['row']] = position - np.maximum.accumulate(np.where(first, position, 0))
+    os.rmdir(workdir)
+    occurrences.flush()
+    return occurrences
+
+
+def index_vectors(cache, keys, metric):
+    """Cached embeddings for `keys`, as the index stores them (unit length for 'ip')."""
+    vectors = cache.get(keys)
+    return normalize(vectors) if metric == 'ip' else vectors
+
+
+def load_previous(index_file, model_name, index_type, params, backend='torch', metric='ip'):
+    """Existing index and its (ids, keys) if it was built with the same settings, else None."""
+    try:
+        with open(manifest_path(index_file)) as f:
+            manifest = json.load(f)
+        state = np.load(state_path(index_file))
+        index = faiss.read_index(index_file)
+    except (FileNotFoundError, OSError, ValueError, RuntimeError):
+        return None
+    if (manifest.get('model') != model_name or manifest.get('encoder', {}).get('backend', 'torch') != backend
+            or manifest.get('index_type', 'flat') != index_type or manifest.get('metric', 'l2') != metric
+            or manifest.get('params', {}) != params or index.ntotal != len(state)):
+        return None
+    return index, manifest, state
+
+
+def batch_size_arg(value):
+    return value if value == 'auto' else int(value)
+
+
+def tune_batch_size(encoder, texts, sizes=BATCH_SIZES, sample=TUNE_SAMPLE):
+    """The fastest of `sizes` (texts per second) at encoding the first `sample` of `texts`."""
+    texts = texts[:sample]
+    encoder.encode(texts[:sizes[0]], batch_size=sizes[0])  # warm-up
+    rates = {}
+    for size in sizes:
+        started = time.perf_counter()
+        encoder.encode(texts, batch_size=size)
+        rates[size] = len(texts) / (time.perf_counter() - started)
+    best = max(rates, key=rates.get)
+    print(f"   Batch size {best} ({', '.join(f'{size}: {rate:.0f}/s' for size, rate in rates.items())})")
+    return best
+
+
+def encode_batch_size(requested, encoder, texts):
+    """`requested`, or for 'auto' a tuned size once there is enough to encode to tune on."""
+    if requested != 'auto':
+        return requested
+    if len(texts) < 4 * TUNE_SAMPLE:
+        return DEFAULT_BATCH_SIZE
+    return tune_batch_size(encoder, texts)
+
+
+def _previous_encoder(index_file):
+    """Encoder info (with probe vectors) from the last build, reused when nothing needs encoding."""
+    try:
+        with open(manifest_path(index_file)) as f:
+            info = json.load(f).get('encoder', {})
+    except (FileNotFoundError, ValueError):
+        return {}
+    return info if info.get('probe') else {}
+
+
+def write_manifest(index_file, model, dim, encoder, index_type, params, metric, calibration, min_score, count):
+    with open(manifest_path(index_file), 'w') as f:
+        json.dump({
+            'model': model,
+            'dim': dim,
+            'encoder': encoder,
+            'index_type': index_type,
+            'params': params,
+            'metric': metric,
+            'calibration': calibration.to_json(),
+            'min_score': min_score,
+            'count': int(count),
+            'built_at': time.time(),
+        }, f, indent=2)
+
+
+def stream_signature(args, index_type, params, metric):
+    """What a checkpoint was made with; any difference means starting over."""
+    stat = os.stat(args.books)
+    return {
+        'books': os.path.abspath(args.books),
+        'books_size': stat.st_size,
+        'books_mtime': stat.st_mtime,
+        'chunk_size': args.chunk_size,
+        'model': args.model,
+        'backend': args.backend,
+        'index_type': index_type,
+        'params': params,
+        'metric': metric,
+    }
+
+
+def load_checkpoint(index_file, signature):
+    try:
+        with open(checkpoint_path(index_file)) as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    return checkpoint if checkpoint.get('signature') == signature else None
+
+
+def save_checkpoint(index_file, checkpoint):
+    tmp_path = f"{checkpoint_path(index_file)}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, checkpoint_path(index_file))
+
+
+def stream_build(args, config, index_type, params, metric):
+    """Full rebuild, one --chunk-size slice of books.csv at a time.
+
+    Memory holds one chunk of rows and vectors (plus the IVF training sample)
+    besides what the outputs themselves need: duplicate holdings are numbered
+    and BM25 postings collected through files on disk (occurrence_numbers,
+    LexicalBuilder). Per chunk, new embeddings are
+    fsynced to the cache before the checkpoint moves past it; on resume the
+    finished chunks are replayed from the cache (no encoding, and no
+    retraining) and encoding picks up at the first unfinished one.
+    """
+    print(f"\n📖 Counting books in {args.books}...")
+    try:
+        occurrences = occurrence_numbers(read_books(args.books, args.chunk_size), occurrences_path(INDEX_FILE))
+    except FileNotFoundError:
+        print(f"❌ Error: {args.books} not found!")
+        print("   Please run fetchdata.py first")
+        exit(1)
+    total = len(occurrences)
+    print(f"✅ Found {total} books, {-(-total // args.chunk_size)} chunks of {args.chunk_size}")
+
+    signature = stream_signature(args, index_type, params, metric)
+    checkpoint = load_checkpoint(INDEX_FILE, signature) or {'signature': signature, 'chunks_done': 0, 'rows_done': 0}
+    resumed = checkpoint['chunks_done']
+    if resumed:
+        print(f"⏩ Resuming after chunk {resumed} ({checkpoint['rows_done']} books already encoded)")
+
+    namespace = cache_name(args.model, args.backend)
+    cache = EmbeddingCache(namespace, args.cache_dir)
+    batch_size = checkpoint.get('batch_size', args.batch_size)
+
+    index = None
+    if index_type in TRAINED_TYPES and resumed and os.path.exists(trained_path(INDEX_FILE)):
+        index = faiss.read_index(trained_path(INDEX_FILE))
+    pending = []  # (vectors, ids) held back until the index is trained
+    train_rows = args.train_rows
+
+    state = np.lib.format.open_memmap(f"{state_path(INDEX_FILE)}.tmp", mode='w+', shape=(total,),
+                                      dtype=[('id', '<i8'), ('key', f'S{KEY_BYTES}')])
+    rerank = None
+    catalog = CatalogWriter(CATALOG_FILE)
+    lexical = LexicalBuilder(postings_path(INDEX_FILE))
+    rows = 0
+
+    print(f"\n🤖 Loading AI model ({args.backend})...")
+    encoder = load_encoder(args.model, args.backend, args.models_dir, args.workers, args.threads)
+    print("✅ Model loaded")
+    started = time.time()
+
+    print(f"\n🧠 Encoding and indexing ({index_type})...")
+    try:
+        built_with = encoder_info(encoder)
+        for number, chunk in enumerate(read_books(args.books, args.chunk_size)):
+            if rows + len(chunk) > total:
+                print(f"❌ Error: {args.books} changed during the build - run it again")
+                exit(1)
+            ids = book_ids(chunk, occurrences[rows:rows + len(chunk)])
+            texts = [book_text(row) for _, row in chunk.iterrows()]
+            keys = [text_key(namespace, text) for text in texts]
+            missing = cache.missing(keys)
+            if missing:
+                if batch_size == 'auto':
+                    batch_size = encode_batch_size('auto', encoder, [texts[i] for i in missing])
+                cache.append([keys[i] for i in missing],
+                             encoder.encode([texts[i] for i in missing], batch_size=batch_size))
+            vectors = index_vectors(cache, keys, metric)
+
+            state[rows:rows + len(chunk)] = list(zip(ids, keys))
+            if params.get('rerank'):
+                if rerank is None:
+                    rerank = np.memmap(f"{vectors_path(INDEX_FILE)}.tmp", dtype='float32', mode='w+', shape=(total, vectors.shape[1]))
+                rerank[rows:rows + len(chunk)] = vectors
+            if index is None and index_type not in TRAINED_TYPES:
+                index = new_index(index_type, vectors, params, metric)
+            if index is None:
+                pending.append((vectors, ids))
+                if sum(len(held) for held, _ in pending) >= min(train_rows, total):
+                    index = _train_stream_index(index_type, pending, params, metric, total, train_rows)
+                    pending = []
+            else:
+                index.add_with_ids(vectors, ids)
+            # Checked once here, so the apps never stat cover files while rendering
+            catalog.write(chunk.assign(has_cover=has_cover_column(chunk)), ids)
+            lexical.add(chunk, ids)
+            rows += len(chunk)
+
+            if number >= resumed:
+                checkpoint.update(chunks_done=number + 1, rows_done=rows, batch_size=batch_size)
+                save_checkpoint(INDEX_FILE, checkpoint)
+                elapsed = time.time() - started
+                print(f"   Chunk {number + 1}: {rows}/{total} books, {len(missing)} encoded ({rows / max(elapsed, 1e-9):.0f} books/s)")
+    finally:
+        if args.workers > 1:
+            encoder.close()
+
+    if not rows:
+        print(f"❌ Error: {args.books} has no books")
+        exit(1)
+    if index is None:
+        index = _train_stream_index(index_type, pending, params, metric, total, train_rows)
+    print(f"✅ Index built with {index.ntotal} vectors in {time.time() - started:.1f}s")
+
+    rng = np.random.default_rng(0)
+    picks = np.sort(rng.choice(rows, size=min(CALIBRATION_SAMPLE, rows), replace=False))
+    calibration = ScoreCalibration.fit(index, index_vectors(cache, state['key'][picks].tolist(), metric), metric)
+    print(f"   Calibrated scores: nearest-neighbour median {calibration.nearest[len(calibration.nearest) // 2]:.3f}, "
+          f"random-pair median {calibration.random_pairs[len(calibration.random_pairs) // 2]:.3f} ({metric})")
+
+    print("\n💾 Saving index and data...")
+    faiss.write_index(index, INDEX_FILE)
+    state.flush()
+    del state
+    os.replace(f"{state_path(INDEX_FILE)}.tmp", state_path(INDEX_FILE))
+    if rerank is not None:
+        rerank.flush()
+        del rerank
+        os.replace(f"{vectors_path(INDEX_FILE)}.tmp", vectors_path(INDEX_FILE))
+    elif os.path.exists(vectors_path(INDEX_FILE)):
+        os.remove(vectors_path(INDEX_FILE))
+    write_manifest(INDEX_FILE, args.model, cache.dim, built_with, index_type, params, metric,
+                   calibration, config['min_score'], index.ntotal)
+    catalog.close()
+    print(f"✅ Saved to {INDEX_FILE} and {CATALOG_FILE}")
+
+    started = time.time()
+    lexical = lexical.finish()
+    lexical.save(lexical_path(INDEX_FILE))
+    print(f"✅ BM25 index: {len(lexical.vocab)} terms, {len(lexical.docs)} postings in {time.time() - started:.1f}s ({lexical_path(INDEX_FILE)})")
+
+    del occurrences
+    for path in (checkpoint_path(INDEX_FILE), trained_path(INDEX_FILE), occurrences_path(INDEX_FILE)):
+        if os.path.exists(path):
+            os.remove(path)
+    return index
+
+
+def _train_stream_index(index_type, pending, params, metric, total, train_rows):
+    """Train on the held-back chunks (up to `train_rows` vectors), then add them all."""
+    vectors = np.concatenate([held for held, _ in pending])
+    print(f"   Training {index_type} on {min(len(vectors), train_rows)} vectors...")
+    index = new_index(index_type, vectors[:train_rows], params, metric, count=total)
+    # Kept until the build finishes, so a resumed build adds to the same trained lists
+    faiss.write_index(index, trained_path(INDEX_FILE))
+    index.add_with_ids(vectors, np.concatenate([ids for _, ids in pending]))
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the OnceUponAI vector index")
+    parser.add_argument('--books', default=BOOKS_FILE)
+    parser.add_argument('--model', default=MODEL_NAME)
+    parser.add_argument('--full', action='store_true', help="rebuild the index from scratch (cached embeddings are still reused)")
+    parser.add_argument('--cache-dir', default=EMBEDDINGS_DIR, help="embedding cache directory")
+    parser.add_argument('--config', default=CONFIG_FILE, help="index type and training parameters")
+    parser.add_argument('--index-type', choices=INDEX_TYPES, default=None, help="override index_type from the config")
+    parser.add_argument('--backend', choices=list(BACKENDS), default=DEFAULT_BACKEND, help="encoder backend (see encoders.py)")
+    parser.add_argument('--models-dir', default=MODELS_DIR, help="local model directory")
+    parser.add_argument('--batch-size', type=batch_size_arg, default='auto',
+                        help="encoder batch size, or 'auto' to time a few on the first texts")
+    parser.add_argument('--workers', type=int, default=1, help="encoder processes, each with its own model")
+    parser.add_argument('--threads', type=int, default=None, help="threads per encoder process (default: cores / workers)")
+    parser.add_argument('--stream', action='store_true', help="rebuild chunk by chunk in bounded memory, resuming an interrupted build")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="books per chunk with --stream")
+    parser.add_argument('--train-rows', type=int, default=DEFAULT_TRAIN_ROWS, help="training sample for IVF / PQ types with --stream")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    index_type = args.index_type or config['index_type']
+    params = index_params(config, index_type)
+    metric = config['metric']
+    if metric not in METRICS:
+        print(f"❌ Error: unknown metric {metric!r} in {args.config} (choose from {', '.join(METRICS)})")
+        exit(1)
+
+    print("="*60)
+    print("🔨 OnceUponAI - Building Vector Index")
+    print("="*60)
+
+    if args.stream:
+        index = stream_build(args, config, index_type, params, metric)
+        _print_success(index)
+        return
+
+    print("\n📖 Loading data...")
+    try:
+        df = read_books(args.books)
+        print(f"✅ Found {len(df)} books")
+    except FileNotFoundError:
+        print(f"❌ Error: {args.books} not found!")
+        print("   Please run fetchdata.py first")
+        exit(1)
+
+    ids = book_ids(df)
+    texts = [book_text(row) for _, row in df.iterrows()]
+    namespace = cache_name(args.model, args.backend)
+    keys = [text_key(namespace, text) for text in texts]
+
+    print("\n🧠 Creating embeddings...")
+    print("   This combines title, author, and blurb for better search results")
+    cache = EmbeddingCache(namespace, args.cache_dir)
+    missing = cache.missing(keys)
+    print(f"   {len(keys) - len(missing)} cached, {len(missing)} to encode")
+
+    built_with = _previous_encoder(INDEX_FILE)
+    if args.full or missing or built_with.get('model') != args.model or built_with.get('backend') != args.backend:
+        print(f"\n🤖 Loading AI model ({args.backend})...")
+        print("   (This may take a minute on first run - downloading model)")
+        encoder = load_encoder(args.model, args.backend, args.models_dir, args.workers, args.threads)
+        print("✅ Model loaded")
+        try:
+            built_with = encoder_info(encoder)
+            if missing:
+                started = time.time()
+                batch_size = encode_batch_size(args.batch_size, encoder, [texts[i] for i in missing])
+                embeddings = encoder.encode([texts[i] for i in missing], batch_size=batch_size, show_progress_bar=True)
+                cache.append([keys[i] for i in missing], embeddings)
+                print(f"✅ Created embeddings for {len(missing)} books in {time.time() - started:.1f}s")
+        finally:
+            if args.workers > 1:
+                encoder.close()
+
+    print(f"\n📊 Updating FAISS index ({index_type})...")
+    previous = None if args.full else load_previous(INDEX_FILE, args.model, index_type, params, args.backend, metric)
+    state = np.array(list(zip(ids, keys)), dtype=[('id', '<i8'), ('key', f'S{KEY_BYTES}')])
+
+    if previous is not None:
+        index, manifest, old_state = previous
+        old = dict(zip(old_state['id'].tolist(), old_state['key'].tolist()))
+        new = dict(zip(ids.tolist(), keys))
+        stale = [book_id for book_id, key in old.items() if new.get(book_id) != key]
+        fresh = [i for i, book_id in enumerate(ids.tolist()) if old.get(book_id) != keys[i]]
+        if stale and not supports_remove(index_type):
+            # Vectors come from the cache, so a rebuild costs no encoding
+            print(f"   {index_type} cannot remove vectors - rebuilding from cached embeddings")
+            previous = None
+
+    if previous is None:
+        started = time.time()
+        index = build_index(index_type, index_vectors(cache, keys, metric), ids, params, metric)
+        print(f"✅ Index built with {index.ntotal} vectors in {time.time() - started:.1f}s")
+    else:
+        if stale:
+            index.remove_ids(np.array(stale, dtype='int64'))
+        if fresh:
+            index.add_with_ids(index_vectors(cache, [keys[i] for i in fresh], metric), ids[fresh])
+        deleted = sum(1 for book_id in stale if book_id not in new)
+        print(f"✅ Index updated: {len(fresh) - (len(stale) - deleted)} added, {len(stale) - deleted} changed, {deleted} removed ({index.ntotal} vectors)")
+
+    if index_type in QUANTIZED_TYPES:
+        report = footprint_report(index, index_vectors(cache, keys, metric), ids, metric=metric)
+        print(f"   Memory: {report['index_bytes'] / 1024 / 1024:.2f} MB vs {report['float_bytes'] / 1024 / 1024:.2f} MB as float32"
+              f" ({report['index_bytes'] / report['float_bytes']:.0%})")
+        print(f"   Recall@5 vs float index: {report['recall']:.3f} (before reranking)")
+
+    calibration = ScoreCalibration.fit(index, index_vectors(cache, keys, metric), metric)
+    print(f"   Calibrated scores: nearest-neighbour median {calibration.nearest[len(calibration.nearest) // 2]:.3f}, "
+          f"random-pair median {calibration.random_pairs[len(calibration.random_pairs) // 2]:.3f} ({metric})")
+
+    dropped = cache.compact(keys)
+    if dropped:
+        print(f"🧹 Dropped {dropped} stale cached embeddings")
+
+    print("\n💾 Saving index and data...")
+    faiss.write_index(index, INDEX_FILE)
+    np.save(state_path(INDEX_FILE), state)
+    if params.get('rerank'):
+        # Float vectors in state order, memory-mapped by the apps for exact reranking
+        index_vectors(cache, keys, metric).tofile(vectors_path(INDEX_FILE))
+    elif os.path.exists(vectors_path(INDEX_FILE)):
+        os.remove(vectors_path(INDEX_FILE))
+    write_manifest(INDEX_FILE, args.model, cache.dim, built_with,
+                   index_type, params, metric, calibration, config['min_score'], index.ntotal)
+    # Checked once here, so the apps never stat cover files while rendering
+    write_catalog(df.assign(has_cover=has_cover_column(df)), ids, CATALOG_FILE)
+    print(f"✅ Saved to {INDEX_FILE} and {CATALOG_FILE}")
+
+    started = time.time()
+    lexical = LexicalIndex.build(df, ids)
+    lexical.save(lexical_path(INDEX_FILE))
+    print(f"✅ BM25 index: {len(lexical.vocab)} terms, {len(lexical.docs)} postings in {time.time() - started:.1f}s ({lexical_path(INDEX_FILE)})")
+    _print_success(index)
+
+
+def _print_success(index):
+    print("\n" + "="*60)
+    print("🎉 SUCCESS!")
+    print("="*60)
+    print(f"Vector database ready with {index.ntotal} books")
+    print("\nNext step: Run your app!")
+    print("   streamlit run app.py")
+    print("="*60)
+
 
-print("="*60)
-print("🔨 OnceUponAI - Building Vector Index")
-print("="*60)
-
-print("\n📖 Loading data...")
-try:
-    df = pd.read_csv('data/books.csv')
-    print(f"✅ Found {len(df)} books")
-except FileNotFoundError:
-    print("❌ Error: data/books.csv not found!")
-    print("   Please run bulk_fetch_books.py first")
-    exit(1)
-
-print("\n🤖 Loading AI model...")
-print("   (This may take a minute on first run - downloading model)")
-model = SentenceTransformer('all-MiniLM-L6-v2')
-print("✅ Model loaded")
-
-print("\n🧠 Creating embeddings...")
-print("   This combines title, author, and blurb for better search results")
-
-# Combine title, author, and blurb for better matching
-texts = []
-for _, row in df.iterrows():
-    text = f"{row['title']} by {row['author']}. {row['blurb']}"
-    texts.append(text)
-
-embeddings = model.encode(texts, show_progress_bar=True)
-print(f"✅ Created embeddings for {len(embeddings)} books")
-
-print("\n📊 Building FAISS index...")
-dimension = embeddings.shape[1]
-index = faiss.IndexFlatL2(dimension)
-index.add(embeddings.astype('float32'))
-print(f"✅ Index built with {index.ntotal} vectors")
-
-print("\n💾 Saving index and data...")
-faiss.write_index(index, 'books.index')
-df.to_pickle('books.pkl')
-print("✅ Saved to books.index and books.pkl")
-
-print("\n" + "="*60)
-print("🎉 SUCCESS!")
-print("="*60)
-print(f"Vector database ready with {index.ntotal} books")
-print("\nNext step: Run your app!")
-print("   streamlit run app.py")
-print("="*60)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Browser-side book carousel for the apps
+The sampled books (covers inlined as data URIs) are sent once as a small
+HTML component; rotation and the previous / next buttons run in its own
+JavaScript, so an idle kiosk costs the server nothing between interactions
+instead of a full script rerun per rotation.
+"""
+
+import json
+
+import pandas as pd
+
+STYLE = """
+body { margin: 0; font-family: "Source Sans Pro", sans-serif; }
+.carousel { display: flex; gap: 24px; align-items: flex-start; }
+.cover { flex: 0 0 %(cover_width)s; }
+.cover img { width: 100%%; border-radius: 8px; box-shadow: 0 4px 6px rgba(0,0,0,0.1); }
+.details { flex: 1; min-width: 0; }
+.title { font-size: 26px; font-weight: bold; color: #2C3E50; margin: 0 0 5px; }
+.author { font-size: 20px; color: #7F8C8D; font-style: italic; margin: 0 0 10px; }
+.blurb { font-size: 17px; color: #34495E; line-height: 1.6; max-height: %(blurb_height)s; overflow: hidden; }
+.call-number { background: linear-gradient(120deg, #667eea 0%%, #764ba2 100%%); color: white; padding: 8px 16px;
+               border-radius: 8px; font-weight: bold; display: inline-block; font-size: 16px; margin-top: 10px; }
+.call-number:empty { display: none; }
+.nav { display: flex; gap: 16px; align-items: center; justify-content: center; margin-top: 16px; color: #7F8C8D; }
+.nav button { border: 1px solid #ddd; background: white; border-radius: 8px; padding: 6px 16px; font-size: 16px; cursor: pointer; }
+"""
+
+SCRIPT = """
+const books = %(books)s;
+const placeholder = %(placeholder)s;
+const interval = %(interval_ms)d;
+let index = 0;
+let timer = null;
+const $ = (id) => document.getElementById(id);
+
+function show(i) {
+  index = (i + books.length) %% books.length;
+  const book = books[index];
+  const img = $('cover-image');
+  img.src = book.cover || placeholder;
+  img.alt = book.title;
+  $('title').textContent = book.title;
+  $('author').textContent = book.author ? 'by ' + book.author : '';
+  $('blurb').textContent = book.blurb;
+  $('call-number').textContent = book.call_number ? '📍 ' + book.call_number : '';
+  $('position').textContent = (index + 1) + ' / ' + books.length;
+}
+
+function restart() {
+  clearInterval(timer);
+  timer = setInterval(() => show(index + 1), interval);
+}
+
+$('prev').onclick = () => { show(index - 1); restart(); };
+$('next').onclick = () => { show(index + 1); restart(); };
+if (books.length) { show(0); restart(); }
+"""
+
+BODY = """
+<div class="carousel">
+  <div class="cover"><img id="cover-image"></div>
+  <div class="details">
+    <p class="title" id="title"></p>
+    <p class="author" id="author"></p>
+    <div class="blurb" id="blurb"></div>
+    <div class="call-number" id="call-number"></div>
+    <div class="nav">
+      <button id="prev">⬅️ Previous</button><span id="position"></span><button id="next">Next ➡️</button>
+    </div>
+  </div>
+</div>
+"""
+
+
+def _text(value):
+    return '' if value is None or (not isinstance(value, str) and pd.isna(value)) else str(value)
+
+
+def carousel_html(books, covers, interval_seconds=5, size='card', cover_width='33%', blurb_height='12em', extra_css=''):
+    """Self-contained HTML for a rotating carousel over `books` (catalog rows).
+
+    Covers are the stored `size` derivatives, inlined as data URIs that
+    `covers` (covers.CoverCache) builds once per cover and process; books
+    without one share a single copy of the placeholder. The component is an iframe, so page CSS does not reach it; `extra_css`
+    restyles it (e.g. app2.py's larger kiosk type).
+    """
+    items = []
+    for book in books:
+        uri = covers.data_uri(book, size)
+        items.append({
+            'title': _text(book.get('title')),
+            'author': _text(book.get('author')),
+            'blurb': _text(book.get('blurb')),
+            'call_number': _text(book.get('call_number')),
+            'cover': '' if uri is covers.placeholder_uri else uri,
+        })
+    # Keep "</script>" inside a title or blurb from closing the script tag
+    data = json.dumps(items).replace('</', '<\\/')
+    script = SCRIPT % {'books': data, 'placeholder': json.dumps(covers.placeholder_uri),
+                       'interval_ms': int(interval_seconds * 1000)}
+    return (f"<style>{STYLE % {'cover_width': cover_width, 'blurb_height': blurb_height}}{extra_css}</style>{BODY}"
+            f"<script>{script}</script>")
@@ -0,0 +1,153 @@
+"""
+Columnar book catalog (books.arrow)
+An uncompressed Arrow IPC file, normally sorted by book_id, that the apps memory-map
+instead of unpickling a DataFrame: opening it reads no row data, a lookup only
+touches the rows it returns, and every server process shares the same pages.
+Usage: python catalog.py [--pickle books.pkl]
+       (converts a books.pkl written by older versions of bookindex.py)
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+CATALOG_FILE = 'books.arrow'
+ID_COLUMN = 'book_id'
+
+
+def _arrow_ready(df):
+    """Copy of `df` with one type per column, as Arrow needs.
+
+    Object columns of numbers and blanks (cover sizes after covers.py) become
+    numeric; any other object column holds only str or None.
+    """
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype != object:
+            continue
+        values = [value for value in df[column] if value is not None and value == value and value != '']
+        if values and all(isinstance(value, (int, float, np.number)) and not isinstance(value, bool) for value in values):
+            df[column] = pd.to_numeric(df[column].mask(df[column] == ''))
+        else:
+            df[column] = [None if value is None or value != value else str(value) for value in df[column]]
+    return df
+
+
+def write_catalog(df, ids, path=CATALOG_FILE):
+    """Write `df` with its FAISS IDs as one record batch, sorted by ID."""
+    df = _arrow_ready(df.reset_index(drop=True))
+    df.insert(0, ID_COLUMN, np.asarray(ids, dtype='int64'))
+    df = df.sort_values(ID_COLUMN, kind='stable')
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=max(1, len(table)))
+    # Atomic swap: apps that still map the old file keep reading it safely
+    os.replace(tmp_path, path)
+
+
+class CatalogWriter:
+    """Writes the catalog one DataFrame chunk at a time (bookindex.py --stream).
+
+    Rows stay in arrival order, one record batch per chunk, so memory is
+    bounded by the chunk; Catalog sorts the IDs it needs when it opens the
+    file. The first chunk fixes the schema (all-empty columns become strings)
+    and later chunks are cast to it.
+    """
+
+    def __init__(self, path=CATALOG_FILE):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.sink = None
+        self.writer = None
+        self.schema = None
+
+    def write(self, df, ids):
+        df = _arrow_ready(df.reset_index(drop=True))
+        df.insert(0, ID_COLUMN, np.asarray(ids, dtype='int64'))
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            self.schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                                     for field in table.schema]).remove_metadata()
+            self.sink = pa.OSFile(self.tmp_path, 'wb')
+            self.writer = pa.ipc.new_file(self.sink, self.schema)
+        table = table.select(self.schema.names).cast(self.schema)
+        self.writer.write_table(table, max_chunksize=max(1, len(table)))
+
+    def close(self):
+        """Finish the file and swap it in (atomically, as write_catalog does)."""
+        if self.writer is None:
+            raise ValueError("no rows were written")
+        self.writer.close()
+        self.sink.close()
+        os.replace(self.tmp_path, self.path)
+
+
+class Catalog:
+    """Read-only, memory-mapped view of books.arrow.
+
+    Rows come back as plain dicts, so callers index them like the pandas
+    rows they used to get (book['title'], book.get('cover_filename')).
+    """
+
+    def __init__(self, path=CATALOG_FILE):
+        self.path = path
+        self.table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        self.ids = self.table.column(ID_COLUMN).combine_chunks().to_numpy()
+        # Streamed catalogs (CatalogWriter) keep arrival order; look IDs up through a sorted copy
+        self.order = None if np.all(self.ids[1:] >= self.ids[:-1]) else np.argsort(self.ids, kind='stable')
+        self.sorted_ids = self.ids if self.order is None else self.ids[self.order]
+        self.columns = [name for name in self.table.column_names if name != ID_COLUMN]
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def positions(self, book_ids):
+        """Row positions for `book_ids`, dropping IDs the catalog does not hold (e.g. FAISS's -1)."""
+        book_ids = np.asarray(book_ids, dtype='int64').ravel()
+        found = np.searchsorted(self.sorted_ids, book_ids).clip(0, max(len(self.ids) - 1, 0))
+        keep = (book_ids >= 0) & (self.sorted_ids[found] == book_ids) if len(self.ids) else np.zeros(len(book_ids), bool)
+        return found[keep] if self.order is None else self.order[found[keep]]
+
+    def rows(self, book_ids, columns=None):
+        """Books for `book_ids`, in the order given; only `columns` are read if set."""
+        table = self.table if columns is None else self.table.select([ID_COLUMN] + list(columns))
+        return table.take(pa.array(self.positions(book_ids))).to_pylist()
+
+    def row(self, book_id, columns=None):
+        rows = self.rows([book_id], columns)
+        if not rows:
+            raise KeyError(book_id)
+        return rows[0]
+
+    def column(self, name):
+        """One column as an Arrow array (no other column is touched)."""
+        return self.table.column(name)
+
+    def sample(self, n, seed=None):
+        """`n` random book IDs."""
+        rng = np.random.default_rng(seed)
+        return rng.choice(self.ids, size=min(n, len(self.ids)), replace=False)
+
+    def to_pandas(self):
+        return self.table.to_pandas().set_index(ID_COLUMN)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert books.pkl to the memory-mapped catalog")
+    parser.add_argument('--pickle', default='books.pkl')
+    parser.add_argument('--output', default=CATALOG_FILE)
+    args = parser.parse_args()
+
+    df = pd.read_pickle(args.pickle)
+    # Older pickles carry positional row numbers, which is what their index was built with
+    write_catalog(df, df.index.to_numpy(), args.output)
+    print(f"✅ Wrote {len(df)} books to {args.output} ({os.path.getsize(args.output) / 1024:.0f} KB)")
+
+
+if __name__ == '__main__':
+    main()
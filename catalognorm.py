@@ -0,0 +1,157 @@
+"""
+Normalization of library catalog strings for book lookups
+Catalog exports carry headings like "Hofstadter, Douglas R., 1945- (NBpol)100557":
+inverted names, life dates, fuller forms and local holding codes that make
+poor search terms. clean_author() / clean_title() reduce them to what a
+search engine expects, and plan_queries() lists the Google Books lookups to
+try for one row, most specific first: ISBN, then intitle: / inauthor:, then
+free text. fetchdata.py spends at most its per-row request budget on them;
+dumpindex.py matches on the same normalized forms.
+"""
+
+import re
+import unicodedata
+
+# Bump when plan_queries() changes, so rows an older planner missed are retried
+PLANNER_VERSION = 1
+
+STRATEGIES = ('isbn', 'fielded', 'text')
+
+HOLDING_CODE = re.compile(r"\(\s*[A-Za-z]+\s*\)\s*\d+")  # (NBpol)100557
+PARENTHETICAL = re.compile(r"\([^)]*\)")  # fuller forms: (John Ronald Reuel)
+BRACKETED = re.compile(r"\[[^\]]*\]")  # [author], [electronic resource]
+DATES = re.compile(r"^(?:b\.|d\.|fl\.|ca\.|active|born|died)?\s*\d{3,4}\??\s*-?\s*(?:\d{3,4}\??)?\.?$", re.IGNORECASE)
+# Relator terms closing a name part: "Akhtar, Ayad. author.", "1986- author"
+ROLE_TAIL = re.compile(r"(?:[.,]?\s*\b(?:joint author|author|editor|eds?|illustrator|translator|artist|compiler|comp|narrator)\b\.?)+$",
+                       re.IGNORECASE)
+SUFFIXES = frozenset({'jr', 'sr', 'ii', 'iii', 'iv'})
+
+LEADING_ARTICLES = ('the', 'a', 'an')
+
+
+def _blank(text):
+    return text is None or (isinstance(text, float) and text != text) or str(text).strip() in ('', 'nan')
+
+
+def ascii_words(text):
+    """Lowercased, accent-stripped words."""
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode('ascii').lower()
+    return re.findall(r"[a-z0-9]+", text)
+
+
+def split_name(author):
+    """(given, surname, suffix) of the first name in a catalog author heading."""
+    if _blank(author):
+        return '', '', ''
+    text = str(author).split(';')[0]
+    text = BRACKETED.sub('', PARENTHETICAL.sub('', HOLDING_CODE.sub('', text)))
+    parts = []
+    for i, part in enumerate(text.split(',')):
+        part = ' '.join(part.split())
+        if i:  # the surname itself may well be "Author"
+            part = ROLE_TAIL.sub('', part).strip()
+        # "Nicholas." -> "Nicholas", but keep the dot of an initial ("R.")
+        part = re.sub(r"(\w{2,})\.$", r"\1", part)
+        if part and not DATES.match(part):
+            parts.append(part)
+    if not parts:
+        return '', '', ''
+    if len(parts) == 1:
+        words = parts[0].split()
+        suffix = words.pop() if len(words) > 2 and words[-1].lower().strip('.') in SUFFIXES else ''
+        return ' '.join(words[:-1]), words[-1], suffix
+    suffix = parts[2] if len(parts) > 2 and parts[2].lower().strip('.') in SUFFIXES else ''
+    return parts[1], parts[0], suffix
+
+
+def clean_author(author):
+    """Direct-order name without dates or codes: "Douglas R. Hofstadter".
+
+    Headings as they appear in Leisure_Title_Author_Callnumber.xlsx:
+
+    >>> clean_author('Hofstadter, Douglas R., 1945- (NBpol)100557')
+    'Douglas R. Hofstadter'
+    >>> clean_author('Merton, Thomas, 1915-1968. (NBpol)53714')
+    'Thomas Merton'
+    >>> clean_author('Wolpert, L. (Lewis) (NBpol)156570')
+    'L. Wolpert'
+    >>> clean_author('Fearn, Nicholas. (NBpol)156564')
+    'Nicholas Fearn'
+    >>> clean_author('Marsh, Selina Tusitala, author, illustrator.')
+    'Selina Tusitala Marsh'
+    >>> clean_author('Kahneman, Daniel, 1934- author.')
+    'Daniel Kahneman'
+    """
+    return ' '.join(part for part in split_name(author) if part)
+
+
+def author_surname(author):
+    """Last word of the surname, lowercased and accent-free - what matching compares."""
+    words = ascii_words(split_name(author)[1])
+    return words[-1] if words else ''
+
+
+def clean_title(title):
+    """Title without bracketed qualifiers or a trailing " / statement of responsibility".
+
+    >>> clean_title('Things that make us [sic]')
+    'Things that make us'
+    >>> clean_title('Avengers: the Initiative.')
+    'Avengers: the Initiative'
+    """
+    if _blank(title):
+        return ''
+    text = BRACKETED.sub('', str(title)).split(' / ')[0]
+    return ' '.join(text.split()).strip(' :;,/.')
+
+
+def main_title(title):
+    """clean_title() without its subtitle."""
+    return clean_title(title).split(':')[0].strip(' ;,.')
+
+
+def normalize_title(title):
+    """Lowercase words of the main title, without punctuation or leading article."""
+    words = ascii_words(main_title(title))
+    if len(words) > 1 and words[0] in LEADING_ARTICLES:
+        words = words[1:]
+    return ' '.join(words)
+
+
+def normalize_isbn(isbn):
+    """ISBN-13 digits for an ISBN-10 or -13 (hyphens and spaces allowed), else ''.
+
+    >>> normalize_isbn('0-465-03078-5')
+    '9780465030781'
+    """
+    if _blank(isbn):
+        return ''
+    digits = re.sub(r"[^0-9Xx]", '', str(isbn).split('.')[0] if isinstance(isbn, float) else str(isbn)).upper()
+    if len(digits) == 10:
+        core = '978' + digits[:9]
+        check = (10 - sum(int(d) * (1 if i % 2 == 0 else 3) for i, d in enumerate(core)) % 10) % 10
+        return core + str(check)
+    return digits if len(digits) == 13 and digits.isdigit() else ''
+
+
+def plan_queries(title, author='', isbn=''):
+    """[(strategy, q)] for one row: ISBN, then intitle: / inauthor:, then free text.
+
+    Duplicates are dropped, so a row with nothing to add in a later
+    strategy does not spend a request on it.
+
+    >>> plan_queries('I am a strange loop', 'Hofstadter, Douglas R., 1945- (NBpol)100557')
+    [('fielded', 'intitle:"I am a strange loop" inauthor:"Hofstadter"'), ('text', 'I am a strange loop Douglas R. Hofstadter')]
+    """
+    plan = []
+    isbn = normalize_isbn(isbn)
+    if isbn:
+        plan.append(('isbn', f"isbn:{isbn}"))
+    main, surname = main_title(title), split_name(author)[1]
+    if main:
+        plan.append(('fielded', f'intitle:"{main}" inauthor:"{surname}"' if surname else f'intitle:"{main}"'))
+    text = ' '.join(part for part in (clean_title(title), clean_author(author)) if part)
+    if text:
+        plan.append(('text', text))
+    seen = set()
+    return [(strategy, query) for strategy, query in plan if not (query in seen or seen.add(query))]
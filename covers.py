@@ -0,0 +1,379 @@
+"""
+Cover image pipeline
+Decodes each downloaded cover once and writes precomputed derivatives
+(card / hero) under data/covers/<size>/, recording their dimensions
+and file sizes so the apps never resize or probe images at request time.
+Files are named by a hash of the processed image, so duplicates are stored once.
+Runs on a process pool so CPU-bound image work never stalls network I/O.
+For rendering, CoverCache holds each encoded cover (and its data: URI for
+HTML components) in memory once per process, and the catalog's has_cover column (set at build time) means the
+apps never stat a file or fetch a placeholder over the network.
+Usage: python covers.py [--format jpeg|webp] [--workers N] [--keep-old]
+       (migrates data/covers/ to the shared store and rewrites books.csv / books.arrow)
+"""
+
+import argparse
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+
+from PIL import Image
+
+COVERS_DIR = 'data/covers'
+
+# Shown for books without a cover (bundled, so rendering never needs the network)
+PLACEHOLDER_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', 'no_cover.jpg')
+
+DEFAULT_CACHE_MB = 64
+
+# Target widths; covers narrower than a target are never upscaled
+COVER_SIZES = {
+    'card': 300,    # result cards (column width), app.py carousel
+    'hero': 400,    # app2.py kiosk carousel
+}
+
+# JPEG passes straight through st.image; WebP is smaller but st.image re-encodes it
+DEFAULT_FORMAT = 'jpeg'
+FORMATS = {
+    'jpeg': ('.jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('.webp', 'WEBP', {'quality': 80, 'method': 4}),
+}
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+
+# Leading bytes of each image format a cover can be stored in
+MAGIC_NUMBERS = ((b'\x89PNG', 'image/png'), (b'RIFF', 'image/webp'), (b'\xff\xd8', 'image/jpeg'))
+
+COVER_COLUMNS = [f'cover_{size}_{field}' for size in COVER_SIZES for field in ('width', 'height', 'bytes')]
+
+
+def derivative_path(cover_filename, size, covers_dir=COVERS_DIR):
+    return os.path.join(covers_dir, size, cover_filename)
+
+
+def cover_path(book, size='card', covers_dir=COVERS_DIR):
+    """Path of the best stored cover for a book row ('' if it has none).
+
+    Rows processed by this pipeline point at a derivative; older rows fall
+    back to the single legacy file in data/covers/.
+    """
+    cover_filename = book.get('cover_filename', '')
+    if not isinstance(cover_filename, str) or not cover_filename:
+        return ''
+    width = book.get(f'cover_{size}_width', '')
+    if width == width and width not in ('', None):  # NaN-safe "is recorded"
+        return derivative_path(cover_filename, size, covers_dir)
+    return os.path.join(covers_dir, cover_filename)
+
+
+def cover_exists(book, covers_dir=COVERS_DIR):
+    """Whether the book's card cover is on disk - stored as the has_cover column at build time."""
+    path = cover_path(book, 'card', covers_dir)
+    return bool(path) and os.path.isfile(path)
+
+
+def has_cover_column(df, covers_dir=COVERS_DIR):
+    return [cover_exists(row, covers_dir) for row in df.to_dict('records')]
+
+
+class CoverCache:
+    """Encoded cover bytes, read from disk once per process and shared by every session.
+
+    Bounded by total bytes (least recently used covers go first). Books
+    whose has_cover is False get the bundled placeholder without touching
+    the filesystem.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_MB * 1024 * 1024, covers_dir=COVERS_DIR):
+        self.max_bytes = max_bytes
+        self.covers_dir = covers_dir
+        with open(PLACEHOLDER_FILE, 'rb') as f:
+            self.placeholder = f.read()
+        self.placeholder_uri = data_uri(self.placeholder)
+        self.entries = OrderedDict()
+        self.uris = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, book, size='card'):
+        """Cover bytes for a catalog row, or the placeholder."""
+        has_cover = book.get('has_cover')
+        if has_cover is None:
+            # Catalogs written before the has_cover column: a missing file is remembered below
+            has_cover = isinstance(book.get('cover_filename'), str) and bool(book.get('cover_filename'))
+        if not has_cover:
+            return self.placeholder
+        path = cover_path(book, size, self.covers_dir)
+        with self.lock:
+            data = self.entries.get(path)
+            if data is not None:
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return data
+            self.misses += 1
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = self.placeholder
+        with self.lock:
+            if path not in self.entries:
+                self.entries[path] = data
+                self.bytes += len(data)
+            self._evict()
+        return data
+
+    def data_uri(self, book, size='card'):
+        """get() as a data: URI, for covers inlined in HTML (see carousel.py).
+
+        Stored bytes go in as they are, no resizing, and each cover's URI is
+        built once per process; books without a cover get placeholder_uri.
+        """
+        data = self.get(book, size)
+        if data is self.placeholder:
+            return self.placeholder_uri
+        path = cover_path(book, size, self.covers_dir)
+        with self.lock:
+            uri = self.uris.get(path)
+            if uri is not None:
+                self.uris.move_to_end(path)
+                return uri
+        uri = data_uri(data)
+        with self.lock:
+            if path not in self.uris:
+                self.uris[path] = uri
+                self.bytes += len(uri)
+            self._evict()
+        return uri
+
+    def _evict(self):
+        """Drop least recently used entries until under max_bytes (call with the lock held).
+
+        Raw bytes go before URIs: a URI is rebuilt from the bytes, not the other way round.
+        """
+        for cache in (self.entries, self.uris):
+            while self.bytes > self.max_bytes and len(self.entries) + len(self.uris) > 1 and cache:
+                _, evicted = cache.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0,
+                    'entries': len(self.entries), 'uris': len(self.uris), 'bytes': self.bytes}
+
+
+def data_uri(data):
+    """Encoded image bytes as a data: URI (the type is read from the leading bytes)."""
+    mime = next((mime for magic, mime in MAGIC_NUMBERS if data.startswith(magic)), 'image/jpeg')
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def empty_cover_info():
+    """Cover columns for a book without a cover."""
+    return {column: '' for column in COVER_COLUMNS}
+
+
+def process_cover(data, fmt=DEFAULT_FORMAT, covers_dir=COVERS_DIR):
+    """Decode `data` once and write every derivative size.
+
+    Covers are content-addressed: the file name is a hash of the processed
+    hero bytes, so identical covers (duplicate holdings, re-downloads) share
+    one set of files and an existing blob is never rewritten.
+    Returns the book columns: cover_filename plus width/height/bytes per size.
+    Runs in a worker process, so it only takes and returns plain values.
+    """
+    ext, pil_format, save_options = FORMATS[fmt]
+    img = Image.open(BytesIO(data))
+    largest = max(COVER_SIZES.values())
+    if img.width > largest:
+        # Let the JPEG decoder downscale by a power of two while decoding
+        img.draft('RGB', (largest, int(img.height * largest / img.width)))
+    img = img.convert('RGB')
+
+    encoded = {}
+    for size, target in sorted(COVER_SIZES.items(), key=lambda item: -item[1]):
+        if img.width > target:
+            resized = img.resize((target, max(1, round(img.height * target / img.width))), Image.Resampling.LANCZOS)
+        else:
+            resized = img
+        buffer = BytesIO()
+        resized.save(buffer, format=pil_format, **save_options)
+        encoded[size] = (resized.width, resized.height, buffer.getvalue())
+
+    hero_size = max(COVER_SIZES, key=COVER_SIZES.get)
+    cover_filename = content_name(encoded[hero_size][2], ext)
+    info = {'cover_filename': cover_filename}
+    for size, (width, height, body) in encoded.items():
+        path = derivative_path(cover_filename, size, covers_dir)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        info[f'cover_{size}_width'] = width
+        info[f'cover_{size}_height'] = height
+        info[f'cover_{size}_bytes'] = len(body)
+    return info
+
+
+def content_name(body, ext):
+    return hashlib.sha256(body).hexdigest()[:32] + ext
+
+
+def cover_pool(workers=None):
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+
+
+def _source_bytes(cover_filename, covers_dir):
+    """Best available source image for a row: legacy file, else the hero derivative."""
+    hero_size = max(COVER_SIZES, key=COVER_SIZES.get)
+    for path in (os.path.join(covers_dir, cover_filename), derivative_path(cover_filename, hero_size, covers_dir)):
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                return f.read()
+    return None
+
+
+def _migrated_info(row, covers_dir):
+    """A row's cover columns if it already points at a full set of derivatives, else None."""
+    cover_filename = row.get('cover_filename')
+    if not isinstance(cover_filename, str) or not cover_filename:
+        return None
+    for size in COVER_SIZES:
+        if row.get(f'cover_{size}_width', '') in ('', None) or not os.path.isfile(derivative_path(cover_filename, size, covers_dir)):
+            return None
+    return {column: row[column] for column in ['cover_filename'] + COVER_COLUMNS}
+
+
+def _apply(df, mapping):
+    """Point every row of `df` at its new content-addressed cover."""
+    # Columns of derivative sizes this pipeline no longer makes
+    df.drop(columns=[column for column in df.columns if column.startswith('cover_') and column not in COVER_COLUMNS
+                     and column.endswith(('_width', '_height', '_bytes'))], inplace=True)
+    for column in ['cover_filename'] + COVER_COLUMNS:
+        if column not in df.columns:
+            df[column] = ''
+        df[column] = df[column].astype(object)
+    for i, old in df['cover_filename'].items():
+        info = mapping.get(old) if isinstance(old, str) else None
+        if info is not None:
+            for column, value in info.items():
+                df.at[i, column] = value
+    return df
+
+
+def _prune(covers_dir, keep):
+    """Delete cover files that no row references any more, or of sizes no longer made; returns (files, bytes)."""
+    removed, freed = 0, 0
+    for root, _, files in os.walk(covers_dir):
+        dropped_size = os.path.abspath(root) != os.path.abspath(covers_dir) and os.path.basename(root) not in COVER_SIZES
+        for name in files:
+            if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS or (name in keep and not dropped_size):
+                continue
+            path = os.path.join(root, name)
+            freed += os.path.getsize(path)
+            os.remove(path)
+            removed += 1
+    return removed, freed
+
+
+def _dir_bytes(covers_dir):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(covers_dir) for name in files)
+
+
+def main():
+    import pandas as pd
+
+    from catalog import CATALOG_FILE, Catalog, write_catalog
+
+    parser = argparse.ArgumentParser(description="Migrate data/covers/ to the deduplicated, content-addressed store")
+    parser.add_argument('--books', default='data/books.csv')
+    parser.add_argument('--catalog', default=CATALOG_FILE, help="also rewritten when present")
+    parser.add_argument('--format', choices=sorted(FORMATS), default=DEFAULT_FORMAT)
+    parser.add_argument('--workers', type=int, default=None, help="cover processes (default: all cores)")
+    parser.add_argument('--keep-old', action='store_true', help="leave per-row cover files in place")
+    args = parser.parse_args()
+
+    print("="*60)
+    print("🖼️  OnceUponAI - Cover Store Migration")
+    print("="*60)
+
+    df = pd.read_csv(args.books, keep_default_na=False)
+    before = _dir_bytes(COVERS_DIR)
+
+    # Rows an earlier run migrated keep their covers: re-encoding the hero JPEG would only lose quality
+    mapping = {}
+    for row in df.to_dict('records'):
+        info = _migrated_info(row, COVERS_DIR)
+        if info is not None:
+            mapping[row['cover_filename']] = info
+    if mapping:
+        print(f"  ⏭️  {len(mapping)} covers already migrated")
+
+    # Identical source files are only processed once
+    sources = {}
+    for cover_filename in df['cover_filename'].unique():
+        if not cover_filename or cover_filename in mapping:
+            continue
+        data = _source_bytes(cover_filename, COVERS_DIR)
+        if data is None:
+            print(f"  ⚠️  Missing source for {cover_filename}")
+            continue
+        sources.setdefault(hashlib.sha256(data).hexdigest(), (data, []))[1].append(cover_filename)
+
+    with cover_pool(args.workers) as pool:
+        jobs = {pool.submit(process_cover, data, args.format): names for data, names in sources.values()}
+        print(f"\n🚀 Processing {len(jobs)} unique covers for {sum(len(n) for n in jobs.values())} files...")
+        for done, future in enumerate(as_completed(jobs), start=1):
+            try:
+                info = future.result()
+            except Exception as e:
+                print(f"  ❌ {jobs[future][0]}: {e}")
+                continue
+            for name in jobs[future]:
+                mapping[name] = info
+            if done % 100 == 0:
+                print(f"   {done}/{len(jobs)}")
+
+    # Rows whose cover failed to convert (or had no source) keep pointing at their old file
+    catalog_df = Catalog(args.catalog).to_pandas() if os.path.exists(args.catalog) else None
+    referenced = set(df['cover_filename'])
+    if catalog_df is not None:
+        referenced |= {name for name in catalog_df['cover_filename'] if isinstance(name, str)}
+    unconverted = {name for name in referenced if name and name not in mapping}
+
+    _apply(df, mapping).to_csv(args.books, index=False)
+    print(f"📄 Rewrote {args.books}")
+
+    blobs = {info['cover_filename'] for info in mapping.values()}
+    if not args.keep_old:
+        removed, freed = _prune(COVERS_DIR, blobs | unconverted)
+        print(f"🧹 Removed {removed} superseded files ({freed / 1024 / 1024:.1f} MB)")
+        kept = sorted(name for name in unconverted if _source_bytes(name, COVERS_DIR) is not None)
+        if kept:
+            print(f"  ⚠️  Kept {len(kept)} unconverted covers that rows still reference:")
+            for name in kept:
+                print(f"     {name}")
+
+    if catalog_df is not None:
+        # After pruning, so has_cover describes the files that are left
+        catalog_df = _apply(catalog_df, mapping)
+        catalog_df['has_cover'] = has_cover_column(catalog_df)
+        write_catalog(catalog_df, catalog_df.index.to_numpy(), args.catalog)
+        print(f"📄 Rewrote {args.catalog}")
+
+    after = _dir_bytes(COVERS_DIR)
+    print(f"\n✅ {len(mapping)} cover references -> {len(blobs)} shared covers in {COVERS_DIR}/{{{','.join(COVER_SIZES)}}}/")
+    print(f"💾 data/covers: {before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
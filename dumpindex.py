@@ -0,0 +1,268 @@
+"""
+Offline lookup index over a local bibliographic dump
+Streams gzipped (or plain) Open Library style dumps in one pass - JSONL, or
+the tab-separated type / key / revision / date / JSON layout of the official
+dumps - and keeps a compact copy of each author, work and edition
+(records.jsonl) plus a sorted array of hashed title / ISBN / key entries
+pointing into it (keys.npy, memory-mapped). fetchdata.py --dump-index then
+matches book-list rows against it without the network; only rows it cannot
+match go to the Google Books API.
+Author names and work descriptions are resolved through the same key
+entries at lookup time, so the build never holds the dump in memory.
+Usage: python dumpindex.py --dump ol_dump_editions.txt.gz [--dump ol_dump_works.txt.gz]
+                           [--dump ol_dump_authors.txt.gz] [--output data/dump_index]
+"""
+
+import argparse
+import array
+import gzip
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from catalognorm import ascii_words, author_surname, clean_author, normalize_isbn, normalize_title
+from covers import empty_cover_info
+
+DUMP_INDEX_DIR = 'data/dump_index'
+
+COVER_URL = "https://covers.openlibrary.org/b/id/{}-L.jpg"
+
+KEY_DTYPE = [('hash', '<u8'), ('offset', '<i8')]
+
+# Same limit fetchdata.py applies to API descriptions
+MAX_BLURB = 600
+
+
+def keys_path(directory):
+    return os.path.join(directory, 'keys.npy')
+
+
+def records_path(directory):
+    return os.path.join(directory, 'records.jsonl')
+
+
+def meta_path(directory):
+    return os.path.join(directory, 'meta.json')
+
+
+def entry_hash(kind, value):
+    digest = hashlib.blake2b(f"{kind}\x1f{value}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def _text(value):
+    """Description-like fields are either a string or {"type": ..., "value": ...}."""
+    if isinstance(value, dict):
+        value = value.get('value', '')
+    elif isinstance(value, list):
+        value = value[0] if value else ''
+    return ' '.join(str(value or '').split())
+
+
+def parse_line(line):
+    """(type, record) for one dump line, or None for lines that are not records."""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        record = json.loads(line if line.startswith('{') else line.rsplit('\t', 1)[-1])
+    except json.JSONDecodeError:
+        return None
+    kind = (record.get('type') or {}).get('key', '') if isinstance(record.get('type'), dict) else ''
+    if not kind:
+        kind = '/type/edition' if record.get('title') else '/type/author' if record.get('name') else ''
+    return kind, record
+
+
+def compact(kind, record):
+    """The few fields a books.csv row needs, or None for records that cannot become one."""
+    if kind == '/type/author':
+        if not record.get('key') or not record.get('name'):
+            return None
+        return {'key': record['key'], 'name': record['name']}
+    if kind not in ('/type/edition', '/type/work') or not record.get('title'):
+        return None
+    # Editions list {"key": ...}, works {"author": {"key": ...}}; search-style docs carry names
+    authors = []
+    for author in record.get('authors') or []:
+        if isinstance(author, dict):
+            author = author.get('author', author)
+            author = author.get('key') if isinstance(author, dict) else author
+        if author:
+            authors.append(author)
+    isbns = list(record.get('isbn_13') or []) + list(record.get('isbn_10') or []) + list(record.get('isbn') or [])
+    covers = [cover for cover in record.get('covers') or [] if isinstance(cover, int) and cover > 0]
+    blurb = _text(record.get('description')) or _text(record.get('first_sentence'))
+    compacted = {
+        'key': record.get('key', ''),
+        'title': record['title'],
+        'authors': authors,
+        'names': list(record.get('author_name') or []),
+        'isbn': isbns[0] if isbns else '',
+        'isbns': sorted({normalize_isbn(isbn) for isbn in isbns} - {''}),
+        'blurb': blurb[:MAX_BLURB - 3] + '...' if len(blurb) > MAX_BLURB else blurb,
+        'cover': covers[0] if covers else record.get('cover_i'),
+        'work': ((record.get('works') or [{}])[0] or {}).get('key', ''),
+    }
+    return {name: value for name, value in compacted.items() if value}
+
+
+def _open_dump(path):
+    return gzip.open(path, 'rt', encoding='utf-8') if path.endswith('.gz') else open(path, encoding='utf-8')
+
+
+def build(dumps, directory=DUMP_INDEX_DIR, progress_every=1_000_000):
+    """One pass over every dump file; returns counts per record type."""
+    os.makedirs(directory, exist_ok=True)
+    # Two flat arrays (16 bytes per entry) rather than a list of tuples
+    hashes, offsets = array.array('Q'), array.array('q')
+    counts = {'lines': 0, 'authors': 0, 'works': 0, 'editions': 0}
+    started = time.time()
+    with open(f"{records_path(directory)}.tmp", 'wb') as out:
+        for path in dumps:
+            with _open_dump(path) as f:
+                for line in f:
+                    counts['lines'] += 1
+                    if counts['lines'] % progress_every == 0:
+                        print(f"   {counts['lines']:,} lines, {len(hashes):,} entries ({time.time() - started:.0f}s)")
+                    parsed = parse_line(line)
+                    record = compact(*parsed) if parsed else None
+                    if record is None:
+                        continue
+                    offset = out.tell()
+                    out.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+                    if 'name' in record:
+                        counts['authors'] += 1
+                    else:
+                        counts['works' if parsed[0] == '/type/work' else 'editions'] += 1
+                        entries = [('isbn', isbn) for isbn in record.get('isbns', [])]
+                        title = normalize_title(record['title'])
+                        if title:
+                            entries.append(('title', title))
+                        for kind, value in entries:
+                            hashes.append(entry_hash(kind, value))
+                            offsets.append(offset)
+                    if record.get('key'):
+                        hashes.append(entry_hash('key', record['key']))
+                        offsets.append(offset)
+
+    keys = np.empty(len(hashes), dtype=KEY_DTYPE)
+    keys['hash'] = np.frombuffer(hashes, dtype='<u8')
+    keys['offset'] = np.frombuffer(offsets, dtype='<i8')
+    del hashes, offsets
+    keys.sort(order='hash', kind='stable')
+    np.save(f"{keys_path(directory)}.tmp.npy", keys)
+    os.replace(f"{keys_path(directory)}.tmp.npy", keys_path(directory))
+    os.replace(f"{records_path(directory)}.tmp", records_path(directory))
+    with open(meta_path(directory), 'w') as f:
+        json.dump({'dumps': [os.path.abspath(path) for path in dumps], 'entries': len(keys), **counts,
+                   'built_at': time.time()}, f, indent=2)
+    return counts
+
+
+class DumpIndex:
+    """Read side: hashed entries memory-mapped, records read by offset on demand."""
+
+    def __init__(self, directory=DUMP_INDEX_DIR):
+        self.directory = directory
+        self.keys = np.load(keys_path(directory), mmap_mode='r')
+        self.records = open(records_path(directory), 'rb')
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.records.close()
+
+    def _find(self, kind, value):
+        target = np.uint64(entry_hash(kind, value))
+        hashes = self.keys['hash']
+        start, end = np.searchsorted(hashes, target, 'left'), np.searchsorted(hashes, target, 'right')
+        found = []
+        for offset in sorted(set(self.keys['offset'][start:end].tolist())):
+            self.records.seek(offset)
+            found.append(json.loads(self.records.readline()))
+        return found
+
+    def record(self, key):
+        return next((record for record in self._find('key', key) if record.get('key') == key), None)
+
+    def author_names(self, record):
+        names = list(record.get('names', []))
+        for key in record.get('authors', []):
+            author = self.record(key) if key.startswith('/authors/') else {'name': key}
+            if author and author.get('name'):
+                names.append(author['name'])
+        return names
+
+    def candidates(self, title, isbn=''):
+        isbn = normalize_isbn(isbn) if isbn else ''
+        if isbn:
+            found = [record for record in self._find('isbn', isbn) if isbn in record.get('isbns', [])]
+            if found:
+                return found
+        title = normalize_title(title)
+        return [record for record in self._find('title', title) if normalize_title(record.get('title', '')) == title]
+
+    def match(self, title, author='', call_number='', isbn=''):
+        """(book, cover_url) for a book-list row - the books.csv row fetch_book would make - or None.
+
+        With an author, only records by someone with the same surname count;
+        among those, records with a description, ISBN and cover win.
+        """
+        surname = author_surname(author)
+        best, best_score = None, None
+        for record in self.candidates(title, isbn):
+            names = self.author_names(record)
+            if surname and not any(surname in ascii_words(name) for name in names):
+                continue
+            blurb = record.get('blurb', '')
+            if not blurb and record.get('work'):
+                blurb = (self.record(record['work']) or {}).get('blurb', '')
+            score = (bool(blurb), bool(record.get('isbn')), bool(record.get('cover')), bool(names))
+            if best_score is None or score > best_score:
+                best, best_score = (record, names, blurb), score
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        record, names, blurb = best
+        book = {
+            'title': record['title'],
+            'author': ', '.join(names) if names else (clean_author(author) or 'Unknown Author'),
+            'blurb': blurb or 'No description available.',
+            'isbn': record.get('isbn', ''),
+            'call_number': call_number if call_number and call_number != 'nan' else '',
+            'cover_filename': '',
+            **empty_cover_info(),
+        }
+        return book, COVER_URL.format(record['cover']) if record.get('cover') else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline lookup index from bibliographic dumps")
+    parser.add_argument('--dump', action='append', required=True, help="dump file (.jsonl/.txt, optionally .gz); repeatable")
+    parser.add_argument('--output', default=DUMP_INDEX_DIR)
+    args = parser.parse_args()
+
+    print("="*60)
+    print("📦 OnceUponAI - Dump Lookup Index")
+    print("="*60)
+    missing = [path for path in args.dump if not os.path.exists(path)]
+    if missing:
+        print(f"❌ Error: {', '.join(missing)} not found")
+        exit(1)
+
+    started = time.time()
+    counts = build(args.dump, args.output)
+    size = sum(os.path.getsize(path) for path in (keys_path(args.output), records_path(args.output)))
+    print(f"✅ {counts['editions']:,} editions, {counts['works']:,} works, {counts['authors']:,} authors "
+          f"from {counts['lines']:,} lines in {time.time() - started:.1f}s")
+    print(f"💾 {args.output} ({size / 1024 / 1024:.1f} MB)")
+    print("\nNext step: python fetchdata.py --dump-index " + args.output)
+
+
+if __name__ == '__main__':
+    main()
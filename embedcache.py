@@ -0,0 +1,118 @@
+"""
+Persistent embedding cache for the index builder
+Vectors live in an append-only float32 file that is memory-mapped on read,
+keyed by a hash of (model name, input text), so rebuilding the index only
+encodes rows that are new or whose text changed.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+EMBEDDINGS_DIR = 'data/embeddings'
+
+KEY_BYTES = 32
+
+
+def text_key(model_name, text):
+    """Hex digest (as bytes) identifying one text under one model.
+
+    Hex rather than raw bytes: numpy's fixed-width bytes dtype drops trailing NULs.
+    """
+    return hashlib.blake2b(f"{model_name}\0{text}".encode('utf-8'), digest_size=KEY_BYTES // 2).hexdigest().encode('ascii')
+
+
+class EmbeddingCache:
+    """Append-only (keys, vectors) store for a single model.
+
+    Layout under `root/<model>/`: keys.bin (32 bytes per row), vectors.f32
+    (dim float32 per row) and meta.json. Row i of both files belong together.
+    """
+
+    def __init__(self, model_name, root=EMBEDDINGS_DIR):
+        self.model_name = model_name
+        self.dir = os.path.join(root, model_name.replace('/', '__'))
+        os.makedirs(self.dir, exist_ok=True)
+        self.keys_path = os.path.join(self.dir, 'keys.bin')
+        self.vectors_path = os.path.join(self.dir, 'vectors.f32')
+        self.meta_path = os.path.join(self.dir, 'meta.json')
+        self.dim = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)['dim']
+        self._load()
+
+    def _load(self):
+        count = os.path.getsize(self.keys_path) // KEY_BYTES if os.path.exists(self.keys_path) else 0
+        if count and self.dim:
+            # A crash between the two appends can leave one file longer; cut both
+            # back to the rows they share so later appends stay aligned
+            count = min(count, os.path.getsize(self.vectors_path) // (4 * self.dim))
+            os.truncate(self.keys_path, count * KEY_BYTES)
+            os.truncate(self.vectors_path, count * 4 * self.dim)
+            keys = np.fromfile(self.keys_path, dtype=f'S{KEY_BYTES}', count=count)
+            self.vectors = np.memmap(self.vectors_path, dtype='float32', mode='r', shape=(count, self.dim))
+        else:
+            keys = np.empty(0, dtype=f'S{KEY_BYTES}')
+            self.vectors = None
+        self.count = len(keys)
+        self.rows = {key: i for i, key in enumerate(keys.tolist())}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def missing(self, keys):
+        """Positions in `keys` that have no cached vector."""
+        return [i for i, key in enumerate(keys) if key not in self.rows]
+
+    def append(self, keys, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+        if len(keys) == 0:
+            return
+        if self.dim is None:
+            self.dim = int(vectors.shape[1])
+            with open(self.meta_path, 'w') as f:
+                json.dump({'model': self.model_name, 'dim': self.dim}, f)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"expected {self.dim}-d vectors, got {vectors.shape[1]}")
+        # Vectors first: a key without its vector would be read as cached
+        with open(self.vectors_path, 'ab') as f:
+            vectors.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.keys_path, 'ab') as f:
+            np.asarray(keys, dtype=f'S{KEY_BYTES}').tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        # Extend the in-memory view rather than re-reading every key, so
+        # appending chunk by chunk (bookindex.py --stream) stays linear
+        start = self.count
+        self.count += len(keys)
+        for i, key in enumerate(np.asarray(keys, dtype=f'S{KEY_BYTES}').tolist()):
+            self.rows[key] = start + i
+        self.vectors = np.memmap(self.vectors_path, dtype='float32', mode='r', shape=(self.count, self.dim))
+
+    def get(self, keys):
+        """(len(keys), dim) float32 array; every key must be cached."""
+        rows = np.fromiter((self.rows[key] for key in keys), dtype='int64', count=len(keys))
+        if len(rows) == 0:
+            return np.empty((0, self.dim or 0), dtype='float32')
+        return np.asarray(self.vectors[rows])
+
+    def compact(self, live_keys, threshold=0.5):
+        """Rewrite the files without stale rows once they exceed `threshold` of the cache."""
+        live = [key for key in dict.fromkeys(live_keys) if key in self.rows]
+        if not self.rows or len(live) >= len(self.rows) * (1 - threshold):
+            return 0
+        vectors = self.get(live)
+        dropped = len(self.rows) - len(live)
+        self.vectors = None
+        for path in (self.keys_path, self.vectors_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.rows = {}
+        self.count = 0
+        self.append(live, vectors)
+        return dropped
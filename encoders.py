@@ -0,0 +1,341 @@
+"""
+Sentence encoders for the index builder and the search path
+Backends, all loaded from a local model directory (models/<name>/):
+  torch - the SentenceTransformer model as is (float32 PyTorch)
+  int8  - the same model with its Linear layers dynamically quantized to int8
+  onnx  - an ONNX Runtime export of the transformer, mean-pooled in numpy
+Every index records which encoder built it plus the vectors of a few probe
+texts; check_compatible() refuses query encoders that do not reproduce them.
+With workers > 1, load_encoder() returns a ParallelEncoder that shards texts
+across processes, each with its own copy of the backend and a fixed thread
+count (bookindex.py --workers; sized with `python benchmark.py encode`).
+Usage: python encoders.py [--model all-MiniLM-L6-v2] [--onnx]
+       (downloads the model into models/ once, optionally exporting it to ONNX)
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+MODELS_DIR = 'models'
+DEFAULT_MODEL = 'all-MiniLM-L6-v2'
+DEFAULT_BACKEND = os.environ.get('ONCEUPONAI_ENCODER', 'torch')
+
+# Index and query vectors must agree this closely (cosine) on every probe text
+PROBE_TEXTS = [
+    "A thrilling mystery in Victorian London",
+    "An inspiring story about overcoming challenges",
+    "The history of mathematics",
+]
+MIN_PROBE_SIMILARITY = 0.98
+
+# Shards per worker in one ParallelEncoder.encode call: small enough that no
+# worker is left with a long tail, large enough to amortize the pickling
+SHARDS_PER_WORKER = 4
+
+# Thread pools read these when they start, so workers set them before loading
+THREAD_VARIABLES = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+
+class IncompatibleEncoder(ValueError):
+    """The query encoder does not produce vectors in the index's space."""
+
+
+def model_path(model_name, models_dir=MODELS_DIR):
+    return os.path.join(models_dir, model_name.replace('/', '__'))
+
+
+def _local_or_hub(model_name, models_dir):
+    path = model_path(model_name, models_dir)
+    if os.path.isdir(path):
+        return path
+    print(f"   ⚠️  {path} not found - loading {model_name} from the hub (run `python encoders.py` to keep a local copy)")
+    return model_name
+
+
+class TorchEncoder:
+    backend = 'torch'
+
+    def __init__(self, model_name=DEFAULT_MODEL, models_dir=MODELS_DIR, threads=None):
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        self.model_name = model_name
+        self.model = SentenceTransformer(_local_or_hub(model_name, models_dir), device='cpu')
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False):
+        vectors = self.model.encode(list(texts), batch_size=batch_size, show_progress_bar=show_progress_bar)
+        return np.asarray(vectors, dtype='float32').reshape(len(texts), self.dim)
+
+
+class Int8Encoder(TorchEncoder):
+    """Dynamic quantization: int8 weights, activations quantized on the fly (CPU only)."""
+
+    backend = 'int8'
+
+    def __init__(self, model_name=DEFAULT_MODEL, models_dir=MODELS_DIR, threads=None):
+        import torch
+
+        super().__init__(model_name, models_dir, threads)
+        torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+class OnnxEncoder:
+    backend = 'onnx'
+
+    def __init__(self, model_name=DEFAULT_MODEL, models_dir=MODELS_DIR, threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("the onnx encoder needs onnxruntime: pip install onnxruntime") from None
+        from transformers import AutoTokenizer
+
+        path = model_path(model_name, models_dir)
+        onnx_file = os.path.join(path, 'onnx', 'model.onnx')
+        if not os.path.exists(onnx_file):
+            raise FileNotFoundError(f"{onnx_file} not found - run `python encoders.py --model {model_name} --onnx`")
+        with open(os.path.join(path, 'onnx', 'config.json')) as f:
+            self.config = json.load(f)
+
+        self.model_name = model_name
+        self.dim = self.config['dim']
+        self.tokenizer = AutoTokenizer.from_pretrained(path)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(onnx_file, options, providers=['CPUExecutionProvider'])
+        self.inputs = [node.name for node in self.session.get_inputs()]
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False):
+        texts = list(texts)
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            tokens = self.tokenizer(texts[start:start + batch_size], padding=True, truncation=True,
+                                    max_length=self.config['max_seq_length'], return_tensors='np')
+            hidden = self.session.run(None, {name: tokens[name].astype('int64') for name in self.inputs})[0]
+            # Mean pooling over real tokens, as the SentenceTransformer Pooling module does
+            mask = tokens['attention_mask'][..., None].astype('float32')
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            if self.config['normalize']:
+                pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            batches.append(pooled.astype('float32'))
+        return np.vstack(batches) if batches else np.empty((0, self.dim), dtype='float32')
+
+
+BACKENDS = {
+    'torch': TorchEncoder,
+    'int8': Int8Encoder,
+    'onnx': OnnxEncoder,
+}
+
+
+# The encoder of this process when it is a ParallelEncoder worker, or why it failed to load
+_worker_encoder = None
+_worker_error = None
+
+
+def _start_worker(model_name, backend, models_dir, threads, slots):
+    global _worker_encoder, _worker_error
+    for name in THREAD_VARIABLES:
+        os.environ[name] = str(threads)
+    with slots.get_lock():
+        slot = slots.value
+        slots.value += 1
+    # Pin each worker to its own cores while there are enough to go round
+    if hasattr(os, 'sched_setaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+        if (slot + 1) * threads <= len(cpus):
+            os.sched_setaffinity(0, cpus[slot * threads:(slot + 1) * threads])
+    # A failing initializer makes the pool respawn the worker forever; keep
+    # the error instead and raise it from every task (see _worker_ready)
+    try:
+        _worker_encoder = load_encoder(model_name, backend, models_dir, threads=threads)
+    except Exception as e:
+        _worker_error = e
+
+
+def _worker_ready():
+    """This worker's encoder, or the error that kept it from loading (raised in every task)."""
+    if _worker_error is not None:
+        raise RuntimeError(f"encoder worker {os.getpid()} could not load its model: "
+                           f"{type(_worker_error).__name__}: {_worker_error}")
+    return _worker_encoder
+
+
+def _worker_dim():
+    return _worker_ready().dim
+
+
+def _worker_encode(job):
+    texts, batch_size = job
+    return _worker_ready().encode(texts, batch_size=batch_size)
+
+
+class ParallelEncoder:
+    """Encodes with a pool of `workers` processes, each holding its own encoder.
+
+    Every worker runs `threads` threads (default: the cores divided among
+    the workers) so they do not oversubscribe the machine. encode() splits
+    the texts into contiguous shards of whole batches and gathers them back
+    in order, so row i of the result is still texts[i].
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL, backend=DEFAULT_BACKEND, models_dir=MODELS_DIR, workers=2, threads=None):
+        import multiprocessing
+
+        self.model_name = model_name
+        self.backend = backend
+        self.workers = workers
+        self.threads = threads or max(1, (os.cpu_count() or 1) // workers)
+        # spawn: torch's thread pools do not survive a fork
+        context = multiprocessing.get_context('spawn')
+        self.pool = context.Pool(workers, _start_worker,
+                                 (model_name, backend, models_dir, self.threads, context.Value('i', 0)))
+        try:
+            self.dim = self.pool.apply(_worker_dim)
+        except Exception:
+            self.pool.terminate()
+            raise
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False):
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.dim), dtype='float32')
+        batches = -(-len(texts) // batch_size)
+        shard = batch_size * max(1, -(-batches // (self.workers * SHARDS_PER_WORKER)))
+        jobs = [(texts[start:start + shard], batch_size) for start in range(0, len(texts), shard)]
+        parts = []
+        for part in self.pool.imap(_worker_encode, jobs):
+            parts.append(part)
+            if show_progress_bar:
+                print(f"\r   Encoded {min(len(parts) * shard, len(texts))}/{len(texts)} ({self.workers} workers)", end='', flush=True)
+        if show_progress_bar:
+            print()
+        return np.vstack(parts)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_encoder(model_name=DEFAULT_MODEL, backend=DEFAULT_BACKEND, models_dir=MODELS_DIR, workers=1, threads=None):
+    """Encoder for `backend`; a ParallelEncoder over `workers` processes when workers > 1.
+
+    `threads` caps the backend's intra-op threads (per worker when parallel).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown encoder backend {backend!r} (choose from {', '.join(BACKENDS)})")
+    if workers > 1:
+        return ParallelEncoder(model_name, backend, models_dir, workers, threads)
+    return BACKENDS[backend](model_name, models_dir, threads)
+
+
+def cache_name(model_name, backend):
+    """Embedding-cache namespace: each backend's vectors are cached separately."""
+    return model_name if backend == 'torch' else f"{model_name}@{backend}"
+
+
+def encoder_info(encoder):
+    """What an index manifest records about the encoder that built it."""
+    return {
+        'model': encoder.model_name,
+        'backend': encoder.backend,
+        'dim': int(encoder.dim),
+        'probe': np.round(encoder.encode(PROBE_TEXTS), 6).tolist(),
+    }
+
+
+def check_compatible(encoder, manifest):
+    """Raise IncompatibleEncoder unless `encoder` can query the index described by `manifest`."""
+    info = manifest.get('encoder') or {'model': manifest.get('model'), 'dim': manifest.get('dim')}
+    if info.get('model') and info['model'] != encoder.model_name:
+        raise IncompatibleEncoder(f"index was built with {info['model']}, not {encoder.model_name}")
+    if info.get('dim') and info['dim'] != encoder.dim:
+        raise IncompatibleEncoder(f"index holds {info['dim']}-d vectors, the {encoder.backend} encoder makes {encoder.dim}-d ones")
+    if info.get('probe'):
+        built = np.asarray(info['probe'], dtype='float32')
+        query = encoder.encode(PROBE_TEXTS)
+        similarity = (built * query).sum(axis=1) / np.maximum(
+            np.linalg.norm(built, axis=1) * np.linalg.norm(query, axis=1), 1e-12)
+        if similarity.min() < MIN_PROBE_SIMILARITY:
+            raise IncompatibleEncoder(
+                f"the {encoder.backend} encoder disagrees with the {info.get('backend', 'torch')} encoder that built the index "
+                f"(probe cosine {similarity.min():.3f} < {MIN_PROBE_SIMILARITY}) - rebuild with `python bookindex.py --backend {encoder.backend}`")
+
+
+def export(model_name=DEFAULT_MODEL, models_dir=MODELS_DIR, onnx=False):
+    """Save `model_name` under models_dir (and export it to ONNX if asked)."""
+    from sentence_transformers import SentenceTransformer
+
+    path = model_path(model_name, models_dir)
+    model = SentenceTransformer(path if os.path.isdir(path) else model_name, device='cpu')
+    model.save(path)
+    if onnx:
+        _export_onnx(model, path)
+    return path
+
+
+def _export_onnx(model, path):
+    import torch
+
+    pooling = model[1]
+    if not getattr(pooling, 'pooling_mode_mean_tokens', False):
+        raise ValueError("only mean-pooled models can be exported")
+    sample = model.tokenizer(PROBE_TEXTS, padding=True, return_tensors='pt')
+    names = list(sample.keys())
+
+    class Transformer(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, *inputs):
+            return self.auto_model(**dict(zip(names, inputs)))[0]
+
+    os.makedirs(os.path.join(path, 'onnx'), exist_ok=True)
+    axes = {name: {0: 'batch', 1: 'tokens'} for name in names}
+    axes['last_hidden_state'] = {0: 'batch', 1: 'tokens'}
+    torch.onnx.export(Transformer(model[0].auto_model).eval(), tuple(sample[name] for name in names),
+                      os.path.join(path, 'onnx', 'model.onnx'), input_names=names,
+                      output_names=['last_hidden_state'], dynamic_axes=axes, opset_version=14)
+    with open(os.path.join(path, 'onnx', 'config.json'), 'w') as f:
+        json.dump({
+            'dim': model.get_sentence_embedding_dimension(),
+            'max_seq_length': model.max_seq_length,
+            'normalize': any(type(module).__name__ == 'Normalize' for module in model),
+        }, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download the sentence model into models/ (and export it to ONNX)")
+    parser.add_argument('--model', default=DEFAULT_MODEL)
+    parser.add_argument('--models-dir', default=MODELS_DIR)
+    parser.add_argument('--onnx', action='store_true', help="also export an ONNX Runtime model")
+    args = parser.parse_args()
+
+    path = export(args.model, args.models_dir, args.onnx)
+    print(f"✅ Saved {args.model} to {path}")
+
+    for backend in BACKENDS:
+        try:
+            encoder = load_encoder(args.model, backend, args.models_dir)
+        except (ImportError, FileNotFoundError) as e:
+            print(f"   {backend:<6} unavailable: {e}")
+            continue
+        print(f"   {backend:<6} ready ({encoder.dim}-d)")
+
+
+if __name__ == '__main__':
+    main()
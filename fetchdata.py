@@ -1,119 +1,124 @@
 """
 Bulk fetch book data for large collections
-Searches by title (and optionally author), fetches everything automatically
-Usage: python bulk_fetch_books.py
+Pipeline per book-list row: offline dump match (--dump-index, see dumpindex.py),
+then Google Books lookups planned by catalognorm.py, then cover download and
+processing (covers.py). Results go to data/books.csv and data/covers/; the
+fetch journal, HTTP cache and rate limiter make reruns resumable and polite.
+Usage: python fetchdata.py [--workers 8] [--rps 4] [--burst 8] [--api-url URL] [--fresh] [--no-cache]
+       python fetchdata.py --dump-index data/dump_index [--dump-covers] [--no-api]
 """
 
+import argparse
 import requests
 import pandas as pd
 import time
-from PIL import Image
-from io import BytesIO
 import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
-print("="*60)
-print("📚 OnceUponAI - Bulk Book Data Fetcher")
-print("="*60)
-
-# Read your book list
-print("\n📖 Reading your book list...")
-
-# Try to read the file (supports CSV, Excel)
-input_file = 'Leisure_Title_Author_Callnumber.xlsx'  # Change this to your filename
-
-try:
-    if input_file.endswith('.xlsx') or input_file.endswith('.xls'):
-        df_input = pd.read_excel(input_file)
-    else:
-        # Read CSV and handle different column name formats
-        df_input = pd.read_csv(input_file)
-    
-    print(f"✅ Found {len(df_input)} books in {input_file}")
-    
-    # Normalize column names (remove spaces, lowercase)
-    df_input.columns = df_input.columns.str.strip().str.lower().str.replace(' ', '_')
-    
-    # Map common column name variations
-    column_mapping = {
-        'call no': 'call_number'
-    }
-    df_input.rename(columns=column_mapping, inplace=True)
-    
-    print(f"   Columns found: {', '.join(df_input.columns)}")
-    
-except FileNotFoundError:
-    print(f"❌ Could not find '{input_file}'")
-    print("\nPlease create a file named 'book_list.csv' with your books.")
-    print("Format: author, call no, title")
-    exit(1)
-
-# Check required columns
-if 'title' not in df_input.columns:
-    print("❌ Error: 'title' column not found!")
-    print(f"   Found columns: {', '.join(df_input.columns)}")
-    exit(1)
-
-has_author = 'author' in df_input.columns
-has_call_number = 'call_number' in df_input.columns
-
-print(f"   ✓ Title column: Found")
-print(f"   ✓ Author column: {'Found' if has_author else 'Not found'}")
-print(f"   ✓ Call number column: {'Found' if has_call_number else 'Not found'}")
-
-# Create directories
-os.makedirs('data/covers', exist_ok=True)
-
-books = []
-failed = []
-total = len(df_input)
-
-print(f"\n🚀 Starting to fetch {total} books...")
-print("   This will take approximately {:.0f} minutes\n".format(total * 1.5 / 60))
-
-for i, row in df_input.iterrows():
-    idx = i + 1
-    title = str(row['title']).strip()
-    author = str(row.get('author', '')).strip() if has_author else ''
-    call_number = str(row.get('call_number', '')).strip() if has_call_number else ''
-    
-    # Skip empty rows
-    if not title or title == 'nan':
-        print(f"[{idx}/{total}] ⚠️  Skipping empty row")
-        continue
-    
-    print(f"[{idx}/{total}] {title}" + (f" by {author}" if author and author != 'nan' else ""))
-    
+from catalognorm import PLANNER_VERSION, STRATEGIES, clean_author, plan_queries
+from covers import COVER_SIZES, DEFAULT_FORMAT, FORMATS, cover_pool, empty_cover_info, process_cover
+from dumpindex import DumpIndex
+from fetchjournal import JOURNAL_FILE, FetchJournal
+from httpcache import CACHE_DIR, DEFAULT_MAX_MB, DEFAULT_TTL_DAYS, HTTPCache
+from ratelimit import TokenBucket, limited_get
+
+API_URL = "https://www.googleapis.com/books/v1/volumes"
+INPUT_FILE = 'Leisure_Title_Author_Callnumber.xlsx'  # Change this to your filename
+
+# Rate limiting - be nice to Google
+DEFAULT_WORKERS = 8
+DEFAULT_RPS = 4.0
+DEFAULT_BURST = 8
+
+# Lookup requests per row (see catalognorm.plan_queries)
+DEFAULT_BUDGET = 3
+
+_local = threading.local()
+
+
+def get_session():
+    """One requests.Session per worker thread (connection reuse)."""
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def load_book_list(input_file):
+    """Read the book list and normalize its column names."""
+    print("\n📖 Reading your book list...")
+
+    # Try to read the file (supports CSV, Excel)
     try:
-        # Build search query
-        if author and author != 'nan':
-            query = f"{title} {author}"
+        if input_file.endswith('.xlsx') or input_file.endswith('.xls'):
+            df_input = pd.read_excel(input_file)
         else:
-            query = title
-        
-        # Google Books API search
-        url = "https://www.googleapis.com/books/v1/volumes"
-        params = {
-            'q': query,
-            'maxResults': 1
+            # Read CSV and handle different column name formats
+            df_input = pd.read_csv(input_file)
+
+        print(f"✅ Found {len(df_input)} books in {input_file}")
+
+        # Normalize column names (remove spaces, lowercase)
+        df_input.columns = df_input.columns.str.strip().str.lower().str.replace(' ', '_')
+
+        # Map common column name variations
+        column_mapping = {
+            'call_no': 'call_number'
         }
-        
-        response = requests.get(url, params=params, timeout=10)
-        data = response.json()
-        
-        if 'items' not in data or len(data['items']) == 0:
-            print(f"  ❌ Not found")
-            failed.append({'title': title, 'author': author, 'call_number': call_number, 'reason': 'Not found'})
-            time.sleep(1)
-            continue
-        
+        df_input.rename(columns=column_mapping, inplace=True)
+
+        print(f"   Columns found: {', '.join(df_input.columns)}")
+
+    except FileNotFoundError:
+        print(f"❌ Could not find '{input_file}'")
+        print("\nPlease create a file named 'book_list.csv' with your books.")
+        print("Format: author, call no, title")
+        exit(1)
+
+    # Check required columns
+    if 'title' not in df_input.columns:
+        print("❌ Error: 'title' column not found!")
+        print(f"   Found columns: {', '.join(df_input.columns)}")
+        exit(1)
+
+    return df_input
+
+
+def fetch_book(idx, title, author, call_number, limiter, api_url, cache=None, isbn='', budget=DEFAULT_BUDGET):
+    """Look up one title and download its cover.
+
+    Tries the catalognorm.plan_queries() lookups in order - ISBN, then
+    intitle: / inauthor:, then free text - spending at most `budget` requests.
+    Returns (status, book, failure, note, cover, lookup): status is 'ok' (book
+    set), 'not_found' or 'error' (failure set; only errors are retried on
+    resume). `cover` is the raw image bytes for the cover stage, or None;
+    `lookup` says which strategy found the book and how many requests it took.
+    """
+    plan = plan_queries(title, author, isbn)[:budget]
+    lookup = {'strategy': None, 'requests': 0}
+    try:
+        session = get_session()
+        data = {}
+        for strategy, query in plan:
+            response = limited_get(session, limiter, api_url, cache=cache, params={'q': query, 'maxResults': 1}, timeout=10)
+            lookup['requests'] += 1
+            data = response.json()
+            if data.get('items'):
+                lookup['strategy'] = strategy
+                break
+
+        if not data.get('items'):
+            tried = ', '.join(strategy for strategy, _ in plan)
+            return 'not_found', None, {'title': title, 'author': author, 'call_number': call_number, 'reason': f"Not found ({tried})"}, "❌ Not found", None, lookup
+
         book_data = data['items'][0]['volumeInfo']
-        
+
         # Extract data
         found_title = book_data.get('title', title)
-        found_authors = book_data.get('authors', [author] if author and author != 'nan' else ['Unknown Author'])
+        found_authors = book_data.get('authors', [clean_author(author) or 'Unknown Author'])
         found_author = ', '.join(found_authors)
-        
+
         # Get ISBN
         isbn = ''
         if 'industryIdentifiers' in book_data:
@@ -121,107 +126,267 @@ for i, row in df_input.iterrows():
                 if identifier['type'] in ['ISBN_13', 'ISBN_10']:
                     isbn = identifier['identifier']
                     break
-        
+
         # Get description
         blurb = book_data.get('description', 'No description available.')
         blurb = blurb.replace('\n', ' ').replace('\r', ' ').strip()
-        
+
         # Truncate if too long (keep it readable)
         if len(blurb) > 600:
             blurb = blurb[:597] + '...'
-        
+
         # Get cover image
-        cover_filename = ''
+        cover = None
+        note = f"✅ Saved (no cover, via {lookup['strategy']})"
         image_links = book_data.get('imageLinks', {})
         cover_url = image_links.get('thumbnail') or image_links.get('smallThumbnail')
-        
+
         if cover_url:
             # Remove zoom parameter for better quality
             cover_url = cover_url.replace('zoom=1', 'zoom=0')
-            # Use HTTPS
-            cover_url = cover_url.replace('http://', 'https://')
-            
+            # Use HTTPS (a plain-HTTP api_url means the local stub server)
+            if api_url.startswith('https://'):
+                cover_url = cover_url.replace('http://', 'https://')
+
             try:
-                img_response = requests.get(cover_url, timeout=10)
-                img = Image.open(BytesIO(img_response.content))
-                
-                # Resize for consistency
-                if img.width > 400:
-                    ratio = 400 / img.width
-                    new_size = (400, int(img.height * ratio))
-                    img = img.resize(new_size, Image.Resampling.LANCZOS)
-                
-                # Save with sanitized filename
-                safe_title = "".join(c for c in found_title if c.isalnum() or c in (' ', '-', '_'))[:50]
-                cover_filename = f"{safe_title}_{idx}.jpg"
-                img.save(f"data/covers/{cover_filename}")
-                print(f"  ✅ Saved with cover")
-            except Exception as e:
-                print(f"  ✅ Saved (no cover)")
-        else:
-            print(f"  ✅ Saved (no cover)")
-        
-        books.append({
+                img_response = limited_get(session, limiter, cover_url, cache=cache, timeout=10)
+                img_response.raise_for_status()
+
+                # Decoding, resizing and naming happen on the cover process pool
+                cover = img_response.content
+                note = f"✅ Saved with cover (via {lookup['strategy']})"
+            except Exception:
+                cover = None
+
+        book = {
             'title': found_title,
             'author': found_author,
             'blurb': blurb,
             'isbn': isbn,
             'call_number': call_number if call_number and call_number != 'nan' else '',
-            'cover_filename': cover_filename
-        })
-        
-        # Save progress every 50 books
-        if idx % 50 == 0:
-            temp_df = pd.DataFrame(books)
-            temp_df.to_csv('data/books_progress.csv', index=False)
-            print(f"\n  💾 Progress saved ({len(books)} books so far)\n")
-        
+            'cover_filename': '',
+            **empty_cover_info(),
+        }
+        return 'ok', book, None, note, cover, lookup
+
     except Exception as e:
-        print(f"  ❌ Error: {e}")
-        failed.append({'title': title, 'author': author, 'call_number': call_number, 'reason': str(e)})
-    
-    # Rate limiting - be nice to Google
-    time.sleep(1.2)
-    
-    # Show progress every 10 books
-    if idx % 10 == 0:
-        print(f"\n--- Progress: {idx}/{total} ({idx/total*100:.1f}%) ---\n")
-
-# Final save
-print("\n" + "="*60)
-print("💾 Saving final results...")
-
-df_final = pd.DataFrame(books)
-df_final.to_csv('data/books.csv', index=False)
-
-# Save failed list
-if failed:
-    df_failed = pd.DataFrame(failed)
-    df_failed.to_csv('data/books_failed.csv', index=False)
-
-print("\n" + "="*60)
-print("📊 RESULTS")
-print("="*60)
-print(f"✅ Successfully fetched: {len(books)} books")
-print(f"❌ Failed to fetch: {len(failed)} books")
-print(f"📈 Success rate: {len(books)/total*100:.1f}%")
-
-print(f"\n📄 Main data: data/books.csv")
-print(f"🖼️  Covers: data/covers/ ({sum(1 for b in books if b['cover_filename'])} covers downloaded)")
-
-if failed:
-    print(f"⚠️  Failed books: data/books_failed.csv")
-    print("   (You can manually add these later or retry)")
-
-if has_call_number:
-    books_with_call = sum(1 for b in books if b['call_number'])
-    print(f"📍 Books with call numbers: {books_with_call}/{len(books)}")
-
-print("\n" + "="*60)
-print("🎉 DONE! Next steps:")
-print("="*60)
-print("1. Review data/books.csv")
-print("2. Check data/books_failed.csv for any books that couldn't be found")
-print("3. Run: python build_index.py")
-print("4. Run: streamlit run app.py")
-print("5. Enjoy OnceUponAI! ✨")
\ No newline at end of file
+        return 'error', None, {'title': title, 'author': author, 'call_number': call_number, 'reason': str(e)}, f"❌ Error: {e}", None, lookup
+
+
+def fetch_dump_cover(book, cover_url, limiter, cache=None):
+    """Download the cover of a book matched in the dump; same result shape as fetch_book."""
+    try:
+        response = limited_get(get_session(), limiter, cover_url, cache=cache, timeout=10)
+        response.raise_for_status()
+        return 'ok', book, None, "✅ Matched in dump, with cover", response.content, None
+    except Exception:
+        return 'ok', book, None, "✅ Matched in dump (no cover)", None, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk fetch book data from Google Books")
+    parser.add_argument('--input', default=INPUT_FILE, help="book list (.xlsx or .csv)")
+    parser.add_argument('--api-url', default=API_URL, help="volumes endpoint (point at stubserver.py for testing)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="concurrent fetch threads")
+    parser.add_argument('--rps', type=float, default=DEFAULT_RPS, help="requests per second across all workers")
+    parser.add_argument('--burst', type=int, default=DEFAULT_BURST, help="token bucket size")
+    parser.add_argument('--journal', default=JOURNAL_FILE, help="append-only fetch journal")
+    parser.add_argument('--fresh', action='store_true', help="discard the journal and refetch every row")
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help="HTTP response cache directory")
+    parser.add_argument('--cache-ttl-days', type=float, default=DEFAULT_TTL_DAYS, help="cache entry lifetime")
+    parser.add_argument('--cache-max-mb', type=float, default=DEFAULT_MAX_MB, help="cache size before LRU eviction")
+    parser.add_argument('--no-cache', action='store_true', help="always hit the network")
+    parser.add_argument('--cover-workers', type=int, default=None, help="cover processes (default: all cores)")
+    parser.add_argument('--cover-format', choices=sorted(FORMATS), default=DEFAULT_FORMAT)
+    parser.add_argument('--max-requests', type=int, default=DEFAULT_BUDGET, help="lookup requests per book (ISBN, intitle:/inauthor:, free text)")
+    parser.add_argument('--dump-index', default=None, help="offline lookup index from dumpindex.py, tried before the API")
+    parser.add_argument('--dump-covers', action='store_true', help="download covers of dump matches (covers.openlibrary.org)")
+    parser.add_argument('--no-api', action='store_true', help="only match offline; leave unmatched rows for a later run")
+    args = parser.parse_args()
+
+    print("="*60)
+    print("📚 OnceUponAI - Bulk Book Data Fetcher")
+    print("="*60)
+
+    df_input = load_book_list(args.input)
+
+    has_author = 'author' in df_input.columns
+    has_call_number = 'call_number' in df_input.columns
+    has_isbn = 'isbn' in df_input.columns
+
+    print(f"   ✓ Title column: Found")
+    print(f"   ✓ Author column: {'Found' if has_author else 'Not found'}")
+    print(f"   ✓ Call number column: {'Found' if has_call_number else 'Not found'}")
+    print(f"   ✓ ISBN column: {'Found' if has_isbn else 'Not found'}")
+
+    # Create directories
+    os.makedirs('data/covers', exist_ok=True)
+
+    total = len(df_input)
+    limiter = TokenBucket(args.rps, args.burst)
+
+    if args.fresh and os.path.exists(args.journal):
+        os.remove(args.journal)
+    journal = FetchJournal(args.journal)
+    cache = None if args.no_cache else HTTPCache(args.cache_dir, args.cache_ttl_days, args.cache_max_mb)
+
+    # Work out what is left to do; rows already resolved (or not found by
+    # the current query planner) are skipped
+    rows = {}
+    todo = []
+    for i, row in df_input.iterrows():
+        idx = i + 1
+        title = str(row['title']).strip()
+        author = str(row.get('author', '')).strip() if has_author else ''
+        call_number = str(row.get('call_number', '')).strip() if has_call_number else ''
+        isbn = str(row.get('isbn', '')).strip() if has_isbn else ''
+
+        # Skip empty rows
+        if not title or title == 'nan':
+            print(f"[{idx}/{total}] ⚠️  Skipping empty row")
+            continue
+
+        rows[idx] = title
+        if not journal.is_done(idx, title, PLANNER_VERSION):
+            todo.append((idx, title, author, call_number, isbn))
+
+    if len(todo) < len(rows):
+        print(f"\n♻️  Resuming: {len(rows) - len(todo)} rows already in {args.journal}")
+
+    # Offline matches first: (idx, title, author, book, cover_url)
+    matched = []
+    if args.dump_index:
+        started = time.time()
+        dump = DumpIndex(args.dump_index)
+        remaining = []
+        for idx, title, author, call_number, isbn in todo:
+            found = dump.match(title, author, call_number, isbn)
+            if found is None:
+                remaining.append((idx, title, author, call_number, isbn))
+            else:
+                matched.append((idx, title, author, *found))
+        dump.close()
+        print(f"\n📦 Matched {len(matched)}/{len(todo)} rows in {args.dump_index} ({time.time() - started:.1f}s), "
+              f"{len(remaining)} left for the API")
+        todo = remaining
+    if args.no_api and todo:
+        print(f"   --no-api: leaving {len(todo)} unmatched rows for a later run")
+        todo = []
+
+    print(f"\n🚀 Starting to fetch {len(todo)} books...")
+    print(f"   {args.workers} workers, {args.rps:g} requests/sec (burst {args.burst}), up to {args.max_requests} lookups per book")
+    # Typically two requests per book (first lookup + cover)
+    print("   This will take approximately {:.0f} minutes\n".format(len(todo) * 2 / args.rps / 60))
+
+    started = time.time()
+    done = 0
+    todo_count = len(todo) + len(matched)
+    strategies = dict.fromkeys(STRATEGIES, 0)
+    lookups = 0
+    with journal, ThreadPoolExecutor(max_workers=args.workers) as executor, cover_pool(args.cover_workers) as covers:
+        # Fetch futures and cover futures share one wait set
+        pending = {
+            executor.submit(fetch_book, idx, title, author, call_number, limiter, args.api_url, cache, isbn, args.max_requests):
+                ('fetch', idx, title, author, None, {'source': 'api', 'planner': PLANNER_VERSION})
+            for idx, title, author, call_number, isbn in todo
+        }
+        for idx, title, author, book, cover_url in matched:
+            if cover_url and args.dump_covers:
+                pending[executor.submit(fetch_dump_cover, book, cover_url, limiter, cache)] = ('fetch', idx, title, author, None, {'source': 'dump'})
+            else:
+                journal.append(idx, title, 'ok', book=book, source='dump')
+                done += 1
+
+        try:
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage, idx, title, author, book, details = pending.pop(future)
+
+                    if stage == 'fetch':
+                        status, book, failure, note, cover, lookup = future.result()
+                        print(f"[{idx}/{total}] {title}" + (f" by {author}" if author and author != 'nan' else "") + f"\n  {note}")
+                        if lookup:
+                            details.update(lookup)
+                            lookups += lookup['requests']
+                            if lookup['strategy']:
+                                strategies[lookup['strategy']] += 1
+                        if cover is not None:
+                            pending[covers.submit(process_cover, cover, args.cover_format)] = ('cover', idx, title, author, book, details)
+                            continue
+                    else:
+                        status, failure = 'ok', None
+                        try:
+                            book.update(future.result())
+                        except Exception as e:
+                            print(f"[{idx}/{total}] {title}\n  ⚠️  Cover could not be processed: {e}")
+
+                    # Journal every row as soon as it resolves
+                    journal.append(idx, title, status, book=book, failure=failure, **details)
+                    done += 1
+
+                    # Show progress every 10 books
+                    if done % 10 == 0:
+                        rate = done / max(time.time() - started, 1e-9)
+                        print(f"\n--- Progress: {done}/{todo_count} ({done/todo_count*100:.1f}%, {rate:.1f} books/sec) ---\n")
+        except KeyboardInterrupt:
+            executor.shutdown(wait=False, cancel_futures=True)
+            covers.shutdown(wait=False, cancel_futures=True)
+            print(f"\n⏸️  Interrupted - progress is in {args.journal}, rerun to resume")
+            exit(1)
+
+    # One pass over the journal, in input order
+    books, failed = journal.results(rows)
+
+    # Final save
+    print("\n" + "="*60)
+    print("💾 Saving final results...")
+
+    df_final = pd.DataFrame(books)
+    df_final.to_csv('data/books.csv', index=False)
+
+    # Save failed list
+    if failed:
+        df_failed = pd.DataFrame(failed)
+        df_failed.to_csv('data/books_failed.csv', index=False)
+
+    print("\n" + "="*60)
+    print("📊 RESULTS")
+    print("="*60)
+    print(f"✅ Successfully fetched: {len(books)} books")
+    if matched:
+        print(f"📦 Matched offline this run: {len(matched)} books ({args.dump_index})")
+    if lookups:
+        found = sum(strategies.values())
+        print(f"🧭 Lookups this run: {lookups} requests for {found} books found ({found / lookups:.2f} per request) - "
+              + ', '.join(f"{strategy} {count}" for strategy, count in strategies.items()))
+    print(f"❌ Failed to fetch: {len(failed)} books")
+    print(f"📈 Success rate: {len(books)/total*100:.1f}%")
+    print(f"⏱️  Took {time.time() - started:.1f}s")
+    if cache is not None:
+        print(f"🗄️  Cache: {cache.hits} hits, {cache.misses} misses ({cache.total_bytes / 1024 / 1024:.1f} MB in {args.cache_dir})")
+        cache.close()
+
+    print(f"\n📄 Main data: data/books.csv")
+    print(f"🖼️  Covers: data/covers/{{{','.join(COVER_SIZES)}}}/ ({sum(1 for b in books if b['cover_filename'])} covers processed)")
+
+    if failed:
+        print(f"⚠️  Failed books: data/books_failed.csv")
+        print("   (You can manually add these later or retry)")
+
+    if has_call_number:
+        books_with_call = sum(1 for b in books if b['call_number'])
+        print(f"📍 Books with call numbers: {books_with_call}/{len(books)}")
+
+    print("\n" + "="*60)
+    print("🎉 DONE! Next steps:")
+    print("="*60)
+    print("1. Review data/books.csv")
+    print("2. Check data/books_failed.csv for any books that couldn't be found")
+    print("3. Run: python bookindex.py")
+    print("4. Run: streamlit run app.py")
+    print("5. Enjoy OnceUponAI! ✨")
+
+
+if __name__ == '__main__':
+    main()
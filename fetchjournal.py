@@ -0,0 +1,107 @@
+"""
+Append-only fetch journal
+One JSON line per resolved input row, so a crashed or interrupted fetch
+loses nothing that was already written and a rerun picks up where it stopped.
+"""
+
+import json
+import os
+import time
+
+JOURNAL_FILE = 'data/fetch_journal.jsonl'
+
+# Failures worth retrying on the next run (network errors, 5xx, ...).
+# Everything else - "Not found" - is permanent and skipped on resume.
+RETRYABLE = 'error'
+
+
+class FetchJournal:
+    """JSONL journal keyed by input row number.
+
+    Records are flushed as they are written and fsync'd in batches
+    (every `sync_every` records or `sync_seconds`, and on close).
+    """
+
+    def __init__(self, path=JOURNAL_FILE, sync_every=25, sync_seconds=2.0):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_seconds = sync_seconds
+        self.records = self._load()
+        self.file = open(path, 'a', encoding='utf-8')
+        self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def _load(self):
+        """Replay the journal; the last record for a row wins."""
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn final line from a crash mid-write
+                    continue
+                records[record['row']] = record
+        return records
+
+    def is_done(self, row, title, planner=None):
+        """True if this row was resolved or failed permanently for the same title.
+
+        With `planner`, a "Not found" only counts if that query planner
+        version (catalognorm.PLANNER_VERSION) produced it; rows an older
+        planner missed get another try.
+        """
+        record = self.records.get(row)
+        if record is None or record['title'] != title or record['status'] == RETRYABLE:
+            return False
+        return record['status'] == 'ok' or planner is None or record.get('planner') == planner
+
+    def append(self, row, title, status, book=None, failure=None, **details):
+        """Record one resolved row; `details` (source, strategy, requests, ...) are kept alongside."""
+        record = {'row': row, 'title': title, 'status': status}
+        record.update((name, value) for name, value in details.items() if value is not None)
+        if book is not None:
+            record['book'] = book
+        if failure is not None:
+            record['failure'] = failure
+        self.records[row] = record
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+        self.pending += 1
+        if self.pending >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_seconds:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def results(self, rows=None):
+        """Books and failures in input order, in one pass over the journal.
+
+        `rows` optionally maps row -> title for the current input file; records
+        for rows that no longer exist (or now hold a different title) are dropped.
+        """
+        books, failed = [], []
+        for row in sorted(self.records):
+            record = self.records[row]
+            if rows is not None and rows.get(row) != record['title']:
+                continue
+            if record['status'] == 'ok':
+                books.append(record['book'])
+            else:
+                failed.append(record['failure'])
+        return books, failed
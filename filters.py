@@ -0,0 +1,119 @@
+"""
+Metadata filters for the search path
+Call-number prefix, author and has-cover filters become boolean bitmaps over
+the catalog, computed once per index version (the normalized columns up
+front, each distinct filter on first use) and kept with a ready-made FAISS
+ID selector. The selector is applied inside index.search, so a filtered
+query still gets a full top-k instead of post-filtering a global one.
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pyarrow.compute as pc
+
+FILTER_KEYS = ('call_prefix', 'author', 'has_cover')
+
+DEFAULT_MAX_CACHED = 64
+
+# ids: allowed book IDs; selector: faiss.IDSelector over them; lexical_mask: allowed BM25 documents
+ActiveFilter = namedtuple('ActiveFilter', ['key', 'ids', 'selector', 'lexical_mask'])
+
+
+def normalize_filters(filters):
+    """Hashable, canonical form of a filters dict; () when nothing is filtered."""
+    if not filters:
+        return ()
+    unknown = set(filters) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"unknown filters {sorted(unknown)} (choose from {', '.join(FILTER_KEYS)})")
+    key = []
+    for name in FILTER_KEYS:
+        value = filters.get(name)
+        if name == 'has_cover':
+            if value:
+                key.append((name, True))
+        elif isinstance(value, str) and value.strip():
+            key.append((name, _normalize_call(value) if name == 'call_prefix' else value.strip().lower()))
+    return tuple(key)
+
+
+def _normalize_call(text):
+    return ''.join(text.upper().split())
+
+
+def search_params(index, selector):
+    """SearchParameters of the right kind for `index`, carrying `selector`.
+
+    IVF and HNSW params also carry the index's own nprobe / efSearch, which
+    would otherwise fall back to FAISS's defaults.
+    """
+    import faiss
+
+    from annindex import RerankIndex
+
+    if isinstance(index, RerankIndex):
+        index = index.index
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=inner.nprobe)
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+    if isinstance(inner, faiss.IndexPQ):
+        raise ValueError("this pq index predates filtered search - rebuild it with `python bookindex.py --full`")
+    return faiss.SearchParameters(sel=selector)
+
+
+class CatalogFilters:
+    """Filter bitmaps for one catalog / index version, shared by every query."""
+
+    def __init__(self, catalog, lexical=None, max_cached=DEFAULT_MAX_CACHED):
+        self.ids = catalog.ids
+        self.lexical = lexical
+        self.max_cached = max_cached
+        # Normalized once; each new filter value is then one vectorized pass
+        call_numbers = catalog.column('call_number').cast('string')
+        self.call_numbers = pc.utf8_upper(pc.replace_substring_regex(call_numbers, r'\s+', ''))
+        self.authors = pc.utf8_lower(catalog.column('author').cast('string'))
+        if 'has_cover' in catalog.columns:
+            self.has_cover = pc.fill_null(catalog.column('has_cover'), False).to_numpy(zero_copy_only=False)
+        else:
+            covers = catalog.column('cover_filename').cast('string')
+            self.has_cover = pc.fill_null(pc.not_equal(covers, ''), False).to_numpy(zero_copy_only=False)
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def bitmap(self, key):
+        """Boolean mask over catalog rows for a normalized filter key."""
+        mask = np.ones(len(self.ids), dtype=bool)
+        for name, value in key:
+            if name == 'has_cover':
+                mask &= self.has_cover
+            elif name == 'call_prefix':
+                mask &= pc.fill_null(pc.starts_with(self.call_numbers, value), False).to_numpy(zero_copy_only=False)
+            elif name == 'author':
+                mask &= pc.fill_null(pc.match_substring(self.authors, value), False).to_numpy(zero_copy_only=False)
+        return mask
+
+    def get(self, filters):
+        """ActiveFilter for `filters` (dict or normalized key), or None if nothing is filtered."""
+        key = filters if isinstance(filters, tuple) else normalize_filters(filters)
+        if not key:
+            return None
+        with self.lock:
+            active = self.cache.get(key)
+            if active is not None:
+                self.cache.move_to_end(key)
+                return active
+        import faiss
+
+        ids = np.ascontiguousarray(self.ids[self.bitmap(key)])
+        selector = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+        lexical_mask = np.isin(self.lexical.doc_ids, ids) if self.lexical is not None else None
+        active = ActiveFilter(key, ids, selector, lexical_mask)
+        with self.lock:
+            self.cache[key] = active
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+        return active
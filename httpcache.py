@@ -0,0 +1,151 @@
+"""
+On-disk HTTP response cache for the fetcher
+Volume lookups are keyed by their normalized query, cover downloads by URL.
+Bodies are stored content-addressed (by SHA-256) so identical responses are
+kept once; an SQLite index tracks keys, TTL and LRU order for size-bounded eviction.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlencode
+
+import requests
+
+CACHE_DIR = 'data/http_cache'
+DEFAULT_TTL_DAYS = 30
+DEFAULT_MAX_MB = 2048
+
+
+def cache_key(url, params=None):
+    """Stable key for a GET: the URL plus sorted params, with `q` normalized."""
+    if not params:
+        return url
+    items = []
+    for name, value in sorted(params.items()):
+        if name == 'q':
+            value = ' '.join(str(value).lower().split())
+        items.append((name, value))
+    return f"{url}?{urlencode(items)}"
+
+
+class HTTPCache:
+    """Thread-safe, TTL-bounded, size-bounded LRU cache of GET response bodies."""
+
+    def __init__(self, root=CACHE_DIR, ttl_days=DEFAULT_TTL_DAYS, max_mb=DEFAULT_MAX_MB):
+        self.root = root
+        self.ttl = ttl_days * 86400
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(root, 'index.sqlite'), check_same_thread=False)
+        self.db.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, digest TEXT NOT NULL, content_type TEXT,
+                created REAL NOT NULL, accessed REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+            CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest);
+            CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER NOT NULL);
+        """)
+        self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def get(self, url, params=None):
+        """Return a cached `requests.Response`, or None on a miss or expired entry."""
+        key = cache_key(url, params)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute(
+                "SELECT digest, content_type, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[2] > self.ttl:
+                if row is not None:
+                    self._delete_entry(key, row[0])
+                    self.db.commit()
+                self.misses += 1
+                return None
+            digest, content_type, _ = row
+            try:
+                with open(self._blob_path(digest), 'rb') as f:
+                    body = f.read()
+            except FileNotFoundError:
+                self._delete_entry(key, digest)
+                self.db.commit()
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self.db.commit()
+            self.hits += 1
+
+        response = requests.Response()
+        response.status_code = 200
+        response._content = body
+        response.url = key
+        response.headers['Content-Type'] = content_type or ''
+        response.headers['X-Cache'] = 'HIT'
+        return response
+
+    def put(self, url, params, response):
+        """Store a successful response body."""
+        key = cache_key(url, params)
+        body = response.content
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._blob_path(digest)
+        now = time.time()
+        with self.lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(body)
+                os.replace(tmp_path, path)
+            if self.db.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone() is None:
+                self.db.execute("INSERT INTO blobs (digest, size) VALUES (?, ?)", (digest, len(body)))
+                self.total_bytes += len(body)
+            old = self.db.execute("SELECT digest FROM entries WHERE key = ?", (key,)).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries (key, digest, content_type, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, digest, response.headers.get('Content-Type'), now, now))
+            if old is not None and old[0] != digest:
+                self._release_blob(old[0])
+            self._evict()
+            self.db.commit()
+
+    def _delete_entry(self, key, digest):
+        self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self._release_blob(digest)
+
+    def _release_blob(self, digest):
+        """Drop a blob once no entry points at it any more."""
+        if self.db.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone():
+            return
+        row = self.db.execute("SELECT size FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        if row is None:
+            return
+        self.db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+        self.total_bytes -= row[0]
+        try:
+            os.remove(self._blob_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        """Evict least recently used entries until back under 90% of the budget."""
+        if self.total_bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        for key, digest in self.db.execute("SELECT key, digest FROM entries ORDER BY accessed").fetchall():
+            if self.total_bytes <= target:
+                break
+            self._delete_entry(key, digest)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
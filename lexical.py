@@ -0,0 +1,279 @@
+"""
+BM25 inverted index over title / author / blurb
+Built by bookindex.py next to the FAISS index (books.index.lexical.npz) and
+stored as flat postings arrays: a sorted vocabulary, per-term offsets, and
+per-posting document, weighted term frequency and field bits.
+The search path fuses its ranking with the vector ranking (reciprocal rank
+fusion), and answers short title / author queries without the transformer.
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import unicodedata
+
+import numpy as np
+
+# Field bits per posting, and how much a term occurrence in each field counts
+TITLE, AUTHOR, BLURB = 1, 2, 4
+FIELD_WEIGHTS = {TITLE: 3.0, AUTHOR: 3.0, BLURB: 1.0}
+FIELDS = {'title': TITLE, 'author': AUTHOR, 'blurb': BLURB}
+
+K1 = 1.2
+B = 0.75
+MAX_TERM_LENGTH = 32
+RRF_K = 60
+
+# Queries of at most this many terms that name a title / author skip the transformer
+SHORTCUT_MAX_TERMS = 4
+
+# Match score of a query term that only appears in a book's blurb
+BLURB_ONLY_COVERAGE = 0.5
+
+# Coverage a book only BM25 found needs to enter fused results: every query term in its title / author
+FUSION_MIN_COVERAGE = 1.0
+
+STOPWORDS = frozenset("""
+a an and are as at be book books by for from in into is it its of on or about
+that the their this to with like want looking something story stories
+""".split())
+
+
+def lexical_path(index_file):
+    return f"{index_file}.lexical.npz"
+
+
+def tokenize(text):
+    """Lowercased, accent-stripped word tokens without stopwords."""
+    if not isinstance(text, str):
+        return []
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii').lower()
+    return [token[:MAX_TERM_LENGTH] for token in re.findall(r"[a-z0-9]+", text) if token not in STOPWORDS]
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Merge ranked ID lists: each ID scores sum(1 / (k + rank)). Returns IDs, best first."""
+    scores = {}
+    for ranking in rankings:
+        for rank, book_id in enumerate(ranking):
+            if book_id >= 0:
+                scores[int(book_id)] = scores.get(int(book_id), 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class LexicalIndex:
+    def __init__(self, vocab, offsets, docs, tfs, fields, doc_lengths, doc_ids):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.fields = fields
+        self.doc_lengths = doc_lengths
+        self.doc_ids = doc_ids
+        self.avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 1.0
+
+    @classmethod
+    def build(cls, df, ids):
+        """Index the title, author and blurb columns of `df`, addressed by `ids`."""
+        builder = LexicalBuilder()
+        builder.add(df, ids)
+        return builder.finish()
+
+    def save(self, path):
+        np.savez_compressed(path, vocab=self.vocab, offsets=self.offsets, docs=self.docs, tfs=self.tfs,
+                 fields=self.fields, doc_lengths=self.doc_lengths, doc_ids=self.doc_ids)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(*(data[name] for name in ('vocab', 'offsets', 'docs', 'tfs', 'fields', 'doc_lengths', 'doc_ids')))
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def _postings(self, term):
+        term = term.encode('ascii')  # tokenize() only yields ASCII
+        i = int(np.searchsorted(self.vocab, term))
+        if i == len(self.vocab) or self.vocab[i] != term:
+            return None
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+    def match(self, query, mask=None):
+        """(positions, bm25 scores, coverage) of every document sharing a term with `query`.
+
+        Coverage is the share of the query a document covers: 1.0 only if
+        every term is in its title / author, and a term found only in the
+        blurb counts half. It is the "match" score of lexical results.
+        `mask` (bool per document, see filters.py) restricts the documents considered.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        docs, weights, covers = [], [], []
+        for term in terms:
+            span = self._postings(term)
+            if span is None:
+                continue
+            found, tf, fields = self.docs[span], self.tfs[span], self.fields[span]
+            idf = np.log1p((len(self) - len(found) + 0.5) / (len(found) + 0.5))
+            if mask is not None:
+                allowed = mask[found]
+                found, tf, fields = found[allowed], tf[allowed], fields[allowed]
+            norm = K1 * (1 - B + B * self.doc_lengths[found] / self.avg_length)
+            docs.append(found)
+            weights.append(idf * tf * (K1 + 1) / (tf + norm))
+            covers.append(np.where(fields & (TITLE | AUTHOR), 1.0, BLURB_ONLY_COVERAGE))
+        if not docs:
+            return np.empty(0, dtype='int64'), np.empty(0, dtype='float32'), np.empty(0, dtype='float32')
+        unique, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weights)).astype('float32')
+        coverage = (np.bincount(inverse, weights=np.concatenate(covers)) / len(terms)).astype('float32')
+        return unique, scores, coverage
+
+    def search(self, query, k=5, mask=None):
+        """(bm25 scores, ids) of the best `k` documents, like index.search for one query."""
+        positions, scores, _ = self.match(query, mask)
+        top = top_k(scores, k)
+        return scores[top], self.doc_ids[positions[top]]
+
+    def term_coverage(self, query, mask=None):
+        """(ids, share of the query each book covers) - see match()."""
+        positions, _, coverage = self.match(query, mask)
+        return self.doc_ids[positions], coverage
+
+
+class LexicalBuilder:
+    """Accumulates postings chunk by chunk (bookindex.py --stream), then packs them.
+
+    Each add() packs its chunk's postings into arrays and writes them under
+    `directory` (a temporary one by default); finish() merges the parts
+    straight into the final arrays, one part at a time. Only one length
+    and ID per book stay in memory between chunks.
+    """
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix='onceuponai-postings-')
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(directory)
+        self.directory = directory
+        self.parts = 0
+        self.lengths = []
+        self.ids = []
+
+    def _part_path(self, number):
+        return os.path.join(self.directory, f"{number}.npz")
+
+    def add(self, df, ids):
+        offset = sum(len(chunk) for chunk in self.lengths)
+        postings = {}
+        lengths = np.zeros(len(df), dtype='float32')
+        for i, (_, row) in enumerate(df.iterrows()):
+            doc = offset + i
+            for column, field in FIELDS.items():
+                weight = FIELD_WEIGHTS[field]
+                for term in tokenize(row.get(column)):
+                    entry = postings.setdefault(term, {}).setdefault(doc, [0.0, 0])
+                    entry[0] += weight
+                    entry[1] |= field
+                    lengths[i] += weight
+        vocab = sorted(postings)
+        entries = [entry for term in vocab for entry in postings[term].items()]  # docs ascending per term
+        np.savez(self._part_path(self.parts),
+                 vocab=np.array([term.encode('ascii') for term in vocab], dtype=f'S{MAX_TERM_LENGTH}'),
+                 counts=np.array([len(postings[term]) for term in vocab], dtype='int64'),
+                 docs=np.array([doc for doc, _ in entries], dtype='int32'),
+                 tfs=np.array([tf for _, (tf, _) in entries], dtype='float32'),
+                 fields=np.array([mask for _, (_, mask) in entries], dtype='uint8'))
+        self.parts += 1
+        self.lengths.append(lengths)
+        self.ids.append(np.asarray(ids, dtype='int64'))
+
+    def _part(self, number, *names):
+        with np.load(self._part_path(number)) as data:
+            return [data[name] for name in names]
+
+    def finish(self):
+        # Pass 1: the vocabulary and each term's posting count
+        vocab = np.zeros(0, dtype=f'S{MAX_TERM_LENGTH}')
+        for number in range(self.parts):
+            vocab = np.union1d(vocab, self._part(number, 'vocab')[0])
+        totals = np.zeros(len(vocab), dtype='int64')
+        for number in range(self.parts):
+            part_vocab, counts = self._part(number, 'vocab', 'counts')
+            totals[np.searchsorted(vocab, part_vocab)] += counts
+        offsets = np.zeros(len(vocab) + 1, dtype='int64')
+        offsets[1:] = np.cumsum(totals)
+
+        # Pass 2: parts come in document order, so appending keeps every term's postings sorted
+        docs = np.empty(offsets[-1], dtype='int32')
+        tfs = np.empty(offsets[-1], dtype='float32')
+        fields = np.empty(offsets[-1], dtype='uint8')
+        cursor = offsets[:-1].copy()
+        for number in range(self.parts):
+            part_vocab, counts, part_docs, part_tfs, part_fields = self._part(number, 'vocab', 'counts', 'docs', 'tfs', 'fields')
+            terms = np.searchsorted(vocab, part_vocab)
+            starts = np.cumsum(counts) - counts
+            rank = np.arange(len(part_docs)) - np.repeat(starts, counts)
+            target = np.repeat(cursor[terms], counts) + rank
+            docs[target], tfs[target], fields[target] = part_docs, part_tfs, part_fields
+            cursor[terms] += counts
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+        lengths = np.concatenate(self.lengths) if self.lengths else np.zeros(0, dtype='float32')
+        ids = np.concatenate(self.ids) if self.ids else np.zeros(0, dtype='int64')
+        return LexicalIndex(vocab, offsets, docs, tfs, fields, lengths, ids)
+
+
+def top_k(scores, k):
+    """Positions of the `k` highest scores, best first (ties by position, like a stable sort).
+
+    Only those `k` are sorted, so the cost stays linear in the matches.
+    """
+    if k <= 0:
+        return np.empty(0, dtype='int64')
+    if k < len(scores):
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        picks = np.flatnonzero(scores > kth)
+        picks = np.concatenate([picks, np.flatnonzero(scores == kth)[:k - len(picks)]])
+    else:
+        picks = np.arange(len(scores))
+    return picks[np.lexsort((picks, -scores[picks]))]
+
+
+def lexical_only(lexical, query, k=5, max_terms=SHORTCUT_MAX_TERMS, mask=None):
+    """(scores, ids) for short queries that name a title or author outright, else None.
+
+    Books matching every term in their title / author come first (score 1.0),
+    then the rest of the BM25 ranking up to `k`.
+    """
+    terms = tokenize(query)
+    if not terms or len(terms) > max_terms:
+        return None
+    positions, scores, coverage = lexical.match(query, mask)
+    exact = coverage >= 1.0 - 1e-6
+    if not exact.any():
+        return None
+    exact, rest = np.flatnonzero(exact), np.flatnonzero(~exact)
+    ranked = np.concatenate([exact[top_k(scores[exact], k)], rest[top_k(scores[rest], k)]])[:k]
+    return coverage[ranked], lexical.doc_ids[positions[ranked]].astype('int64')
+
+
+def fuse(lexical, query, vector_scores, vector_ids, k=5, candidates=None, mask=None, min_coverage=FUSION_MIN_COVERAGE):
+    """Reciprocal rank fusion of the vector ranking with the BM25 ranking.
+
+    Each result keeps its vector score; books only the lexical side found
+    score by how much of the query they cover (see term_coverage). That
+    share is not calibrated like the vector scores, so such books are kept
+    only if it reaches `min_coverage` - a query whose vector hits all fell
+    below the score cutoff does not get weak BM25 matches instead.
+    """
+    positions, bm25, coverage = lexical.match(query, mask)
+    top = top_k(bm25, candidates or len(vector_ids))
+    lexical_ids = lexical.doc_ids[positions[top]]
+    scores = dict(zip(vector_ids.tolist(), vector_scores.tolist()))
+    covered = dict(zip(lexical_ids.tolist(), coverage[top].tolist()))
+    ranked = [book_id for book_id in reciprocal_rank_fusion([vector_ids, lexical_ids])
+              if book_id in scores or covered.get(book_id, 0.0) >= min_coverage - 1e-6][:k]
+    return (np.array([scores.get(book_id, covered.get(book_id, 0.0)) for book_id in ranked], dtype='float32'),
+            np.array(ranked, dtype='int64'))
@@ -0,0 +1,123 @@
+"""
+Per-stage timing spans for the search request path
+Off unless ONCEUPONAI_METRICS=1 (or enable() is called): span() then returns
+one shared no-op context manager, so instrumented code pays a global lookup
+and a call. When on, each span lands in a per-process rolling histogram (the
+last WINDOW samples per stage), and hit/miss counters track the caches.
+Read by the search service's /metrics endpoint and the apps' hidden
+diagnostics panel (open the app with ?diagnostics=1).
+"""
+
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+import numpy as np
+
+WINDOW = 2048
+
+ENABLED = os.environ.get('ONCEUPONAI_METRICS', '') not in ('', '0')
+
+_NOOP = nullcontext()
+_histograms = {}
+_counters = {}
+_lock = threading.Lock()
+
+
+class RollingHistogram:
+    """The last `window` durations of one stage (a ring buffer), plus lifetime totals."""
+
+    def __init__(self, window=WINDOW):
+        self.samples = np.zeros(window, dtype='float64')
+        self.count = 0
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples[self.count % len(self.samples)] = seconds
+            self.count += 1
+            self.total += seconds
+
+    def summary(self):
+        with self.lock:
+            count, total = self.count, self.total
+            window = self.samples[:min(count, len(self.samples))].copy()
+        if not count:
+            return {'count': 0}
+        p50, p95, p99 = np.percentile(window, [50, 95, 99]) * 1000
+        return {
+            'count': count,
+            'mean_ms': total / count * 1000,
+            'p50_ms': float(p50),
+            'p95_ms': float(p95),
+            'p99_ms': float(p99),
+            'max_ms': float(window.max() * 1000),
+        }
+
+
+class Span:
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.started)
+
+
+def enable(on=True):
+    global ENABLED
+    ENABLED = on
+
+
+def span(name):
+    """`with span('encode'): ...` - times the block when metrics are enabled."""
+    return Span(name) if ENABLED else _NOOP
+
+
+def record(name, seconds):
+    histogram = _histograms.get(name)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(name, RollingHistogram())
+    histogram.add(seconds)
+
+
+def count(name, hit):
+    """Count one hit (or miss) of the cache or check called `name`."""
+    if not ENABLED:
+        return
+    with _lock:
+        hits, total = _counters.get(name, (0, 0))
+        _counters[name] = (hits + bool(hit), total + 1)
+
+
+def snapshot():
+    """Percentiles per stage and hit rates per counter, as plain JSON-able dicts."""
+    with _lock:
+        histograms = dict(_histograms)
+        counters = dict(_counters)
+    return {
+        'enabled': ENABLED,
+        'spans': {name: histogram.summary() for name, histogram in sorted(histograms.items())},
+        'rates': {name: {'hits': hits, 'total': total, 'hit_rate': hits / total if total else 0.0}
+                  for name, (hits, total) in sorted(counters.items())},
+    }
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def table(snapshot):
+    """One row per stage (for st.table / printing)."""
+    return [{'stage': name, **{key: round(value, 3) if isinstance(value, float) else value for key, value in summary.items()}}
+            for name, summary in snapshot.get('spans', {}).items()]
@@ -0,0 +1,192 @@
+"""
+Process-wide cache for the search path
+Kiosk users repeat the same few dozen prompts, so each normalized query keeps
+its vector and top-k hits (per index version) in a size-bounded LRU; a repeat
+search skips the transformer forward pass and the FAISS search entirely.
+With a lexical index (lexical.py) results are hybrid: short title / author
+queries are answered from BM25 alone, others fuse BM25 with the vectors.
+Metadata filters (filters.py) are part of the key and applied inside FAISS.
+Vector scores come from the index's offline calibration table (see
+annindex.ScoreCalibration); hits below `min_score` are cut off, and fusion
+only adds BM25-only books that name the whole query (lexical.fuse).
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from filters import normalize_filters, search_params
+from lexical import fuse, lexical_only
+from metrics import count, span
+
+DEFAULT_MAX_ENTRIES = 512
+
+# Vector and BM25 candidates per query that go into rank fusion
+FUSION_CANDIDATES = 50
+
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive form of a query."""
+    return ' '.join(query.lower().split())
+
+
+class QueryCache:
+    """LRU of normalized query -> (vector, scores, ids, k) for one index version.
+
+    Shared by every session of a server process (create it under
+    st.cache_resource), so it is guarded by a lock.
+    """
+
+    def __init__(self, model, index, version, max_entries=DEFAULT_MAX_ENTRIES, lexical=None, filters=None,
+                 calibration=None, min_score=0.0):
+        self.model = model
+        self.index = index
+        self.version = version
+        self.lexical = lexical
+        self.filters = filters
+        if calibration is None:
+            # annindex imports faiss, so only when needed (see searchservice.load_search)
+            from annindex import ScoreCalibration
+            calibration = ScoreCalibration()
+        self.calibration = calibration
+        self.min_score = min_score
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.lexical_answers = 0
+
+    def _key(self, query, filters):
+        return normalize_query(query), normalize_filters(filters), self.version
+
+    def lookup(self, query, k=5, filters=None):
+        """Cached (scores, ids) for `query`, or None; counts a hit or a miss."""
+        key = self._key(query, filters)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[3] >= k:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                count('query_cache', True)
+                return entry[1][:k], entry[2][:k]
+            self.misses += 1
+            count('query_cache', False)
+            return None
+
+    def store(self, query, vector, scores, ids, k, filters=None):
+        """Remember the top-`k` answer (`ids` may be shorter when fewer books match)."""
+        key = self._key(query, filters)
+        with self.lock:
+            self.entries[key] = (vector, scores, ids, k)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    @property
+    def candidates(self):
+        """How many vector hits to ask FAISS for, per result shown."""
+        return FUSION_CANDIDATES if self.lexical is not None else 0
+
+    def active_filter(self, filters):
+        """filters.ActiveFilter for a filters dict (None when unfiltered)."""
+        if not normalize_filters(filters):
+            return None
+        if self.filters is None:
+            raise ValueError("this searcher was built without catalog filters")
+        return self.filters.get(filters)
+
+    def encode(self, texts):
+        """Query vectors in the index's space (unit length for inner-product indexes)."""
+        vectors = np.asarray(self.model.encode(list(texts)), dtype='float32')
+        if self.calibration.metric != 'ip':
+            return vectors
+        from annindex import normalize
+        return normalize(vectors)
+
+    def vector_search(self, vectors, k, active=None):
+        """index.search, restricted to the filter's books inside FAISS."""
+        if active is None:
+            return self.index.search(vectors, k)
+        return self.index.search(vectors, k, params=search_params(self.index, active.selector))
+
+    def answer_lexically(self, query, k=5, active=None):
+        """(scores, ids) straight from BM25 for short title / author queries, else None."""
+        if self.lexical is None:
+            return None
+        with span('lexical'):
+            result = lexical_only(self.lexical, query, k, mask=active.lexical_mask if active else None)
+        count('lexical_shortcut', result is not None)
+        if result is not None:
+            with self.lock:
+                self.lexical_answers += 1
+        return result
+
+    def rank(self, query, distances, ids, k=5, active=None):
+        """Final (scores, ids) from one row of vector search results."""
+        with span('rank'):
+            return self._rank(query, distances, ids, k, active)
+
+    def _rank(self, query, distances, ids, k, active):
+        distances, ids = np.asarray(distances), np.asarray(ids)
+        keep = ids >= 0
+        scores, ids = self.calibration(distances[keep]), ids[keep]
+        # Hits come best first, so everything after the first weak one goes too
+        weak = np.flatnonzero(scores < self.min_score)
+        if len(weak):
+            scores, ids = scores[:weak[0]], ids[:weak[0]]
+        if self.lexical is None:
+            return scores[:k], ids[:k]
+        return fuse(self.lexical, query, scores, ids, k, self.candidates, active.lexical_mask if active else None)
+
+    def search(self, query, k=5, filters=None):
+        """(scores, ids) of the best matches for one query, best first.
+
+        `filters` is a dict of call_prefix / author / has_cover (see filters.py).
+        A vague query whose vector hits all fall below `min_score` gets
+        nothing back, even with the lexical index loaded:
+
+        >>> import types, faiss, pandas as pd
+        >>> from annindex import ScoreCalibration
+        >>> from lexical import LexicalIndex
+        >>> books = pd.DataFrame({'title': ['Dune', 'Emma'], 'author': ['Herbert, Frank', 'Austen, Jane'],
+        ...                       'blurb': ['Sand worms on a desert planet.', 'A matchmaker in a quiet village.']})
+        >>> index = faiss.IndexIDMap(faiss.IndexFlatIP(2))
+        >>> index.add_with_ids(np.eye(2, dtype='float32'), np.array([10, 11]))
+        >>> model = types.SimpleNamespace(encode=lambda texts: np.array([[-1.0, 0.0]]))  # far from both books
+        >>> cache = QueryCache(model, index, 'v1', lexical=LexicalIndex.build(books, [10, 11]),
+        ...                    calibration=ScoreCalibration('ip'), min_score=0.6)
+        >>> cache.search('a quiet evening in the desert')
+        (array([], dtype=float32), array([], dtype=int64))
+        >>> cache.search('frank herbert dune')  # named outright, so BM25 still answers
+        (array([1.], dtype=float32), array([10]))
+        """
+        cached = self.lookup(query, k, filters)
+        if cached is not None:
+            return cached
+        active = self.active_filter(filters)
+        result = self.answer_lexically(query, k, active)
+        if result is not None:
+            self.store(query, None, *result, k, filters)
+            return result
+        # The model is uncased, so the normalized text encodes the same
+        with span('encode'):
+            vector = self.encode([normalize_query(query)])[0]
+        with span('search'):
+            distances, ids = self.vector_search(vector[None, :], max(k, self.candidates), active)
+        scores, ids = self.rank(query, distances[0], ids[0], k, active)
+        self.store(query, vector, scores, ids, k, filters)
+        return scores, ids
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'lexical_answers': self.lexical_answers,
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+            }
@@ -0,0 +1,97 @@
+"""
+Token-bucket rate limiter shared by the fetch workers
+Every outgoing request takes one token; 429/5xx responses make the bucket back off
+"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket with adaptive (AIMD) rate.
+
+    `rate` tokens are added per second up to `burst`. When the server pushes
+    back, `backoff()` halves the current rate and pauses every caller; each
+    successful request then creeps the rate back up towards the configured one.
+    """
+
+    def __init__(self, rate, burst=1, min_rate=0.1, recovery=0.05):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.burst = max(1, int(burst))
+        self.recovery = recovery
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+
+    def acquire(self):
+        """Block until a token is available, then take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def backoff(self, retry_after=None):
+        """Slow down after a 429/5xx: halve the rate and pause all workers."""
+        with self.lock:
+            now = time.monotonic()
+            self.rate = max(self.min_rate, self.rate / 2)
+            delay = retry_after if retry_after else 1 / self.rate
+            self.paused_until = max(self.paused_until, now + delay)
+            self.tokens = 0.0
+            self.updated = now
+
+    def success(self):
+        """Additive recovery towards the configured rate."""
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * self.recovery)
+
+
+def retry_after_seconds(response):
+    """Parse a Retry-After header (seconds form only), or None."""
+    value = response.headers.get('Retry-After')
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
+def limited_get(session, limiter, url, retries=4, cache=None, **kwargs):
+    """GET through the shared limiter, backing off and retrying on 429/5xx.
+
+    With an `HTTPCache`, hits skip the limiter and the network entirely and
+    successful responses are stored for the next run.
+    """
+    params = kwargs.get('params')
+    if cache is not None:
+        cached = cache.get(url, params)
+        if cached is not None:
+            return cached
+
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        response = session.get(url, **kwargs)
+        if response.status_code == 429 or response.status_code >= 500:
+            limiter.backoff(retry_after_seconds(response))
+            if attempt < retries:
+                continue
+            response.raise_for_status()
+        limiter.success()
+        if cache is not None and response.status_code == 200:
+            cache.put(url, params, response)
+        return response
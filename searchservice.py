@@ -0,0 +1,377 @@
+"""
+Local search service
+Holds the one copy of the sentence model and FAISS index for every app
+session and worker. Concurrent queries are collected into micro-batches
+(up to --max-batch queries, waiting at most --max-wait-ms for the batch to
+fill) so each batch costs one model.encode and one index.search.
+Usage: python searchservice.py [--port 8790] [--max-batch 32] [--max-wait-ms 5] [--metrics]
+API:   POST /search {"query": "...", "k": 5, "filters": {...}} -> {"scores": [...], "ids": [...]}
+       GET /stats, GET /health, GET /metrics (per-stage latency percentiles, see metrics.py)
+The apps use it when it is running (ONCEUPONAI_SEARCH_URL, default
+http://127.0.0.1:8790) and otherwise load the model in-process - in a
+background thread (BackgroundSearcher), so the page renders before the
+model is ready.
+"""
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+
+import metrics
+from encoders import BACKENDS, DEFAULT_BACKEND, DEFAULT_MODEL, MODELS_DIR, IncompatibleEncoder, check_compatible, load_encoder
+from metrics import span
+from querycache import QueryCache, normalize_query
+
+INDEX_FILE = 'books.index'
+CATALOG_FILE = 'books.arrow'
+SERVICE_URL = os.environ.get('ONCEUPONAI_SEARCH_URL', 'http://127.0.0.1:8790')
+DEFAULT_MAX_BATCH = 32
+DEFAULT_MAX_WAIT_MS = 5.0
+
+
+@contextmanager
+def timed(timings, phase):
+    """Record how long the block took as timings[phase] (seconds)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = time.perf_counter() - started
+
+
+def format_timings(timings):
+    return ', '.join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items())
+
+
+def load_search(index_file=INDEX_FILE, timings=None, backend=DEFAULT_BACKEND, models_dir=MODELS_DIR,
+                catalog_file=CATALOG_FILE):
+    """In-process QueryCache over books.index and the model it was built with.
+
+    torch / sentence_transformers / faiss are only imported here, so
+    importing this module stays cheap for the apps. Raises
+    IncompatibleEncoder if `backend` cannot query this index.
+    """
+    timings = {} if timings is None else timings
+    with timed(timings, 'import'):
+        from annindex import ScoreCalibration, index_version, open_index
+        from catalog import Catalog
+        from filters import CatalogFilters
+        from lexical import LexicalIndex, lexical_path
+
+    with timed(timings, 'index'):
+        index = open_index(index_file)
+    try:
+        with open(f"{index_file}.json") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {}
+    with timed(timings, 'model'):
+        encoder = load_encoder(manifest.get('model', DEFAULT_MODEL), backend, models_dir)
+    with timed(timings, 'check'):
+        check_compatible(encoder, manifest)
+        if encoder.dim != index.d:
+            raise IncompatibleEncoder(f"index holds {index.d}-d vectors, the {backend} encoder makes {encoder.dim}-d ones")
+    lexical = LexicalIndex.load(lexical_path(index_file)) if os.path.exists(lexical_path(index_file)) else None
+    with timed(timings, 'filters'):
+        filters = CatalogFilters(Catalog(catalog_file), lexical)
+    return QueryCache(encoder, index, index_version(index_file), lexical=lexical, filters=filters,
+                      calibration=ScoreCalibration.from_manifest(manifest), min_score=manifest.get('min_score', 0.0))
+
+
+def warm_up(cache):
+    """One throwaway encode + search, so the first real query does not pay for lazy initialisation."""
+    cache.index.search(cache.encode(['a story to warm up the model']), 5)
+
+
+class MicroBatcher:
+    """Funnel single queries from many threads into batched encode + search calls."""
+
+    def __init__(self, cache, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.cache = cache
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.queries = 0
+        self.largest = 0
+        threading.Thread(target=self._run, name='micro-batcher', daemon=True).start()
+
+    def submit(self, text, k, active=None):
+        """Future resolving to (vector, distances, ids) for one query (`active`: filters.ActiveFilter)."""
+        future = Future()
+        self.queue.put((text, k, active, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch):
+        try:
+            with span('encode'):
+                vectors = self.cache.encode([text for text, _, _, _ in batch])
+            # One search per distinct filter in the batch (usually just the unfiltered one)
+            groups = {}
+            for row, (_, _, active, _) in enumerate(batch):
+                groups.setdefault(active.key if active else (), (active, []))[1].append(row)
+            results = {}
+            for active, rows in groups.values():
+                k = max(batch[row][1] for row in rows)
+                with span('search'):
+                    distances, ids = self.cache.vector_search(vectors[rows], k, active)
+                for i, row in enumerate(rows):
+                    results[row] = (distances[i], ids[i])
+        except Exception as e:
+            for _, _, _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.queries += len(batch)
+        self.largest = max(self.largest, len(batch))
+        for row, (_, k, _, future) in enumerate(batch):
+            distances, ids = results[row]
+            future.set_result((vectors[row], distances[:k], ids[:k]))
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'queries': self.queries,
+            'mean_batch': self.queries / self.batches if self.batches else 0.0,
+            'largest_batch': self.largest,
+        }
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive: clients reuse one connection
+    # Headers and body go out as separate writes; without this, Nagle + delayed ACK stall each reply ~40 ms
+    disable_nagle_algorithm = True
+    cache = None
+    batcher = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send(200, {'status': 'ok', 'version': self.cache.version, 'count': int(self.cache.index.ntotal)})
+        elif self.path == '/stats':
+            self._send(200, {'cache': self.cache.stats(), 'batcher': self.batcher.stats()})
+        elif self.path == '/metrics':
+            self._send(200, metrics.snapshot())
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/search':
+            self._send(404, {'error': 'not found'})
+            return
+        with span('request'):
+            self._search()
+
+    def _search(self):
+        cache = self.cache
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            query, k, filters = str(request['query']), int(request.get('k', 5)), request.get('filters') or {}
+            active = cache.active_filter(filters)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self._send(400, {'error': f'expected {{"query": str, "k": int, "filters": dict}} ({e})'})
+            return
+
+        cached = cache.lookup(query, k, filters)
+        if cached is not None:
+            scores, ids = cached
+        elif (answer := cache.answer_lexically(query, k, active)) is not None:
+            scores, ids = answer
+            cache.store(query, None, scores, ids, k, filters)
+        else:
+            try:
+                vector, distances, ids = self.batcher.submit(normalize_query(query), max(k, cache.candidates), active).result()
+            except Exception as e:
+                self._send(500, {'error': str(e)})
+                return
+            scores, ids = cache.rank(query, distances, ids, k, active)
+            cache.store(query, vector, scores, ids, k, filters)
+        self._send(200, {'scores': scores.tolist(), 'ids': ids.tolist(), 'cached': cached is not None})
+
+
+class SearchHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # bursts of concurrent sessions must not be refused
+
+
+class SearchService:
+    """Serve `cache` (a QueryCache) over HTTP in a background thread."""
+
+    def __init__(self, cache, port=0, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.cache = cache
+        self.batcher = MicroBatcher(cache, max_batch, max_wait_ms)
+        handler = type('BoundSearchHandler', (SearchHandler,), {'cache': cache, 'batcher': self.batcher})
+        self.httpd = SearchHTTPServer(('127.0.0.1', port), handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self.url
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class SearchClient:
+    """Same search() as QueryCache, answered by the search service."""
+
+    def __init__(self, url=SERVICE_URL, timeout=10.0):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.local = threading.local()
+
+    @property
+    def session(self):
+        # Keep-alive connection per thread (Streamlit runs each session on its own thread)
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def healthy(self):
+        try:
+            return self.session.get(f"{self.url}/health", timeout=1.0).ok
+        except requests.RequestException:
+            return False
+
+    def search(self, query, k=5, filters=None):
+        with span('service_call'):
+            return self._post(query, k, filters)
+
+    def _post(self, query, k, filters):
+        response = self.session.post(f"{self.url}/search", json={'query': query, 'k': k, 'filters': filters or {}},
+                                     timeout=self.timeout)
+        response.raise_for_status()
+        result = response.json()
+        return np.array(result['scores'], dtype='float32'), np.array(result['ids'], dtype='int64')
+
+    def stats(self):
+        return self.session.get(f"{self.url}/stats", timeout=self.timeout).json()
+
+    def metrics(self):
+        """The service process's metrics.snapshot()."""
+        return self.session.get(f"{self.url}/metrics", timeout=self.timeout).json()
+
+
+def open_searcher(url=SERVICE_URL, index_file=INDEX_FILE, timings=None):
+    """A client for the running search service, else a warmed-up in-process searcher."""
+    timings = {} if timings is None else timings
+    client = SearchClient(url)
+    with timed(timings, 'connect'):
+        healthy = client.healthy()
+    if healthy:
+        print(f"🔌 Using search service at {url}")
+        return client
+    print(f"🧠 No search service at {url} - loading the model in-process")
+    cache = load_search(index_file, timings)
+    with timed(timings, 'warmup'):
+        warm_up(cache)
+    return cache
+
+
+class BackgroundSearcher:
+    """open_searcher() on a background thread; search() waits until it is ready.
+
+    Lets the apps render the carousel from the catalog straight away while
+    the model and index load. `timings` holds the startup phases.
+    """
+
+    def __init__(self, url=SERVICE_URL, index_file=INDEX_FILE):
+        self.url = url
+        self.index_file = index_file
+        self.timings = {}
+        self.searcher = None
+        self.error = None
+        self.ready = threading.Event()
+        threading.Thread(target=self._load, name='searcher-warmup', daemon=True).start()
+
+    def _load(self):
+        started = time.perf_counter()
+        try:
+            self.searcher = open_searcher(self.url, self.index_file, self.timings)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.timings['total'] = time.perf_counter() - started
+            print(f"⏱️  Search ready: {format_timings(self.timings)}" if self.error is None
+                  else f"❌ Search failed to load: {self.error}")
+            self.ready.set()
+
+    def search(self, query, k=5, filters=None):
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self.searcher.search(query, k, filters)
+
+    def stats(self):
+        return self.searcher.stats() if self.searcher is not None else {}
+
+    def service_metrics(self):
+        """metrics.snapshot() of the search service, or None when searching in-process."""
+        return self.searcher.metrics() if isinstance(self.searcher, SearchClient) else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OnceUponAI search service")
+    parser.add_argument('--port', type=int, default=8790)
+    parser.add_argument('--index', default=INDEX_FILE)
+    parser.add_argument('--backend', choices=list(BACKENDS), default=DEFAULT_BACKEND, help="encoder backend (see encoders.py)")
+    parser.add_argument('--models-dir', default=MODELS_DIR)
+    parser.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH, help="most queries per encode/search call")
+    parser.add_argument('--max-wait-ms', type=float, default=DEFAULT_MAX_WAIT_MS, help="how long a batch waits to fill")
+    parser.add_argument('--metrics', action='store_true', help="time every stage (GET /metrics; same as ONCEUPONAI_METRICS=1)")
+    args = parser.parse_args()
+    if args.metrics:
+        metrics.enable()
+
+    print("🤖 Loading model and index...")
+    timings = {}
+    cache = load_search(args.index, timings, args.backend, args.models_dir)
+    with timed(timings, 'warmup'):
+        warm_up(cache)
+    print(f"⏱️  {format_timings(timings)}")
+    service = SearchService(cache, args.port, args.max_batch, args.max_wait_ms)
+    print(f"🔍 Search service on {service.url} ({cache.index.ntotal} books, {args.backend} encoder, batches of up to {args.max_batch})")
+    try:
+        service.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Local stand-in for the Google Books volumes endpoint
+Answers /books/v1/volumes?q=... with a deterministic fake volume and serves
+generated cover JPEGs, so fetchdata.py can be exercised without the network.
+Usage: python stubserver.py [--port 8777] [--miss-rate 0.1] [--rate-limit 5]
+Then:  python fetchdata.py --api-url http://127.0.0.1:8777/books/v1/volumes
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class StubState:
+    """Shared knobs and counters for the stub handler."""
+
+    def __init__(self, miss_rate=0.0, error_rate=0.0, rate_limit=None, latency=0.0):
+        self.miss_rate = miss_rate
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.latency = latency
+        self.requests = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.cover_bytes = {}
+
+    def should_throttle(self):
+        """Crude fixed one-second window: reply 429 once the window is full."""
+        if not self.rate_limit:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 1.0:
+                self.window_start = now
+                self.window_count = 0
+            self.window_count += 1
+            if self.window_count > self.rate_limit:
+                self.throttled += 1
+                return True
+            return False
+
+    def cover(self, key):
+        with self.lock:
+            if key not in self.cover_bytes:
+                shade = int(key[:6], 16)
+                color = ((shade >> 16) & 255, (shade >> 8) & 255, shade & 255)
+                buffer = BytesIO()
+                Image.new('RGB', (600, 900), color).save(buffer, format='JPEG')
+                self.cover_bytes[key] = buffer.getvalue()
+            return self.cover_bytes[key]
+
+
+def _fraction(key):
+    return int(key[6:14], 16) / 0xFFFFFFFF
+
+
+def _field(query, name):
+    """Value of a `name:"..."` or `name:word` search operator in `query`, else None."""
+    match = re.search(rf'{name}:(?:"([^"]*)"|(\S+))', query)
+    return None if match is None else (match.group(1) if match.group(1) is not None else match.group(2))
+
+
+def fake_volume(query, host, state):
+    """Build a Google-Books-shaped response for `query` (or an empty one)."""
+    key = _digest(query)
+    if _fraction(key) < state.miss_rate:
+        return {'kind': 'books#volumes', 'totalItems': 0}
+    isbn_query = _field(query, 'isbn')
+    title = _field(query, 'intitle') or (f"ISBN {isbn_query}" if isbn_query else query)
+    author = _field(query, 'inauthor') or 'Stub Author'
+    isbn = '978' + str(int(key[:12], 16))[:10].zfill(10)
+    return {
+        'kind': 'books#volumes',
+        'totalItems': 1,
+        'items': [{
+            'volumeInfo': {
+                'title': title,
+                'authors': [author],
+                'description': f"A stub description for {query}. " * 20,
+                'industryIdentifiers': [{'type': 'ISBN_13', 'identifier': isbn}],
+                'imageLinks': {
+                    'thumbnail': f"http://{host}/covers/{key}.jpg?zoom=1",
+                },
+            }
+        }],
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        state = self.state
+        with state.lock:
+            state.requests += 1
+        if state.latency:
+            time.sleep(state.latency)
+        if state.should_throttle():
+            self._send(429, b'{"error": "rate limited"}', 'application/json')
+            return
+
+        url = urlparse(self.path)
+        if url.path.endswith('/volumes'):
+            query = parse_qs(url.query).get('q', [''])[0]
+            if state.error_rate and _fraction(_digest(query + str(state.requests))) < state.error_rate:
+                self._send(503, b'{"error": "unavailable"}', 'application/json')
+                return
+            body = json.dumps(fake_volume(query, self.headers.get('Host'), state)).encode('utf-8')
+            self._send(200, body, 'application/json')
+        elif url.path.startswith('/covers/'):
+            key = url.path.rsplit('/', 1)[-1].split('.')[0]
+            self._send(200, state.cover(key), 'image/jpeg')
+        else:
+            self._send(404, b'not found', 'text/plain')
+
+
+class StubBooksServer:
+    """Run the stub in a background thread: `with StubBooksServer() as url: ...`"""
+
+    def __init__(self, port=0, **options):
+        self.state = StubState(**options)
+        handler = type('BoundStubHandler', (StubHandler,), {'state': self.state})
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def api_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/books/v1/volumes"
+
+    def __enter__(self):
+        self.thread.start()
+        return self.api_url
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub Google Books server")
+    parser.add_argument('--port', type=int, default=8777)
+    parser.add_argument('--miss-rate', type=float, default=0.1, help="fraction of queries with no match")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of lookups answered with 503")
+    parser.add_argument('--rate-limit', type=int, default=None, help="requests per second before replying 429")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds of delay per request")
+    args = parser.parse_args()
+
+    server = StubBooksServer(args.port, miss_rate=args.miss_rate, error_rate=args.error_rate,
+                             rate_limit=args.rate_limit, latency=args.latency)
+    print(f"📡 Stub Google Books API on {server.api_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()